@@ -88,42 +88,68 @@ def DLTcameraPosition(coefs):
     ypr=np.rad2deg(np.array([gamma,beta,alpha]))
     return xyz, T, ypr, Uo, Vo, Z, rvecs
 
+def read_profile(profp):
+    """
+    Argus camera profile as a dataframe indexed by camera number: 1 focal length, 2 width, 3 height,
+    4 and 5 principal point, 6 aspect ratio, 7 to 11 distortion coefficients
+    """
+    return pd.read_csv(profp, header=None, delimiter=' ', index_col=0)
+
+
+def camera_entry(name, size, matrix, distortions, rotation, translation):
+    """
+    one camera of an anipose-style calibration.toml
+    """
+    return {
+        "name": str(name),
+        "size": [float(s) for s in size],
+        "matrix": [[float(m) for m in row] for row in matrix],
+        "distortions": [float(d) for d in distortions],
+        "rotation": [float(r) for r in rotation],
+        "translation": [float(t) for t in translation]
+    }
+
+
+def write_calibration(cameras, ofile, adjusted=False, error=0.1):
+    """
+    writes camera entries (in camera order) as an anipose-style calibration.toml
+    """
+    cal = {'cam_{}'.format(i): cam for i, cam in enumerate(cameras)}
+    cal["metadata"] = {"adjusted": adjusted, "error": error}
+    with open(str(ofile), "w") as f:
+        toml.dump(cal, f)
+    print("data written to ", ofile)
+
+
 def dlt2dlcCoefs(dltp, profp):
     #make paths into Paths
     dltp = Path(dltp)
     profp = Path(profp)
 
     dlt = pd.read_csv(dltp, header=None)
-    prof = pd.read_csv(profp, header=None, delimiter=' ', index_col=0)
+    prof = read_profile(profp)
     numcams = len(prof)
     # in dltcoefs, treat columns as camera "names", not python indexing
     dlt.columns = list(range(1,numcams+1))
 
     # start building the calibration.toml
-    cal = {}
+    cameras = []
     for cam in prof.index:
         xyz, T, ypr, Uo, Vo, Z, rvec = DLTcameraPosition(dlt[cam])
-        camdict = {
-            "name": str(cam),
-            "size": [float(prof.loc[cam, 2]), float(prof.loc[cam,3])],
-            "matrix": [[float(prof.loc[cam, 1]), 0.0, float(prof.loc[cam, 4])],
-                       [0.0, float(prof.loc[cam,1]), float(prof.loc[cam,5])],
-                       [0.0, 0.0, 1.0]],
-            "distortions" : prof.loc[cam, [7, 8, 9, 10, 11]],
-            "rotation": rvec.T.tolist()[0],
-            "translation" : xyz.T.tolist()[0]
-        }
-        cal['cam_{}'.format(cam-1)]=camdict
+        cameras.append(camera_entry(
+            cam,
+            [prof.loc[cam, 2], prof.loc[cam,3]],
+            [[prof.loc[cam, 1], 0.0, prof.loc[cam, 4]],
+             [0.0, prof.loc[cam,1], prof.loc[cam,5]],
+             [0.0, 0.0, 1.0]],
+            prof.loc[cam, [7, 8, 9, 10, 11]],
+            rvec.T.tolist()[0],
+            xyz.T.tolist()[0]))
+    print(cameras)
     # not clear if metadata is important, and can't calculate "error" without original checkerboard pattern, so making somehting up for now
-    # might be able to grab the reconstruction error from the wand calibration output
-    cal["metadata"]= {"adjusted": False, "error": 0.1}
+    # might be able to grab the reconstruction error from the wand calibration output (or use bundle.py, which does)
     # write toml
-    ofile = dltp.parent / 'calibration.toml'
-    print(cal)
-
-    with open(str(ofile), "w") as f:
-        toml.dump(cal, f)
-    print("data written to ", ofile)
+    write_calibration(cameras, dltp.parent / 'calibration.toml')
 
 
 if __name__ == '__main__':
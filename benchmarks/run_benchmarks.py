@@ -0,0 +1,190 @@
+"""
+Benchmarks the conversion and triangulation tools on synthetic trials (see synthetic.py) of configurable sizes.
+
+Each size is given as FRAMESxCAMSxTRACKSxINDS, e.g. 10000x4x8x2. For each size a trial is generated, then each
+benchmark is run -repeat times and the best wall time is kept. Peak memory is measured with tracemalloc
+in a separate run, so it does not slow down the timing runs.
+
+Results are printed as a table and, with -out, saved as json along with the git commit so runs can be compared
+across commits. Benchmarks whose imports fail are skipped.
+
+The shared cache (cache.py) is turned off, so the repeats time the work itself; with -cache, it is used (in a
+temporary folder), and all but the first run of each benchmark time cache hits.
+
+Example call:
+python benchmarks/run_benchmarks.py -sizes 1000x2x4x1 10000x4x8x2 -repeat 3 -out bench.json
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import tools
+import synthetic
+
+
+def bench_triangulate(trial):
+    xypath = trial['xypts'][0]
+    return lambda: tools.triangulate(xypath, trial['dlt'], flipy=True, heights=trial['heights'])
+
+
+def bench_get_repo_errors(trial):
+    import pandas as pd
+    ncams = trial['cams']
+    pts = pd.read_csv(trial['xypts'][0]).values
+    dlt = pd.read_csv(trial['dlt'], header=None).values.T
+    xyz = np.hstack([tools.uv_to_xyz(pts[:, j * 2 * ncams:(j + 1) * 2 * ncams], dlt)
+                     for j in range(trial['tracks'])])
+    return lambda: tools.get_repo_errors(xyz, pts, None, dlt)
+
+
+def bench_dlc2dlt(trial):
+    from dlc2dlt import dlc2dlt
+    opath = trial['path'] / 'bench_dlc2dlt'
+    dlcpaths = [str(p) for p in trial['dlctracks']]
+    return lambda: dlc2dlt(trial['config'], opath, dlcpaths, True, trial['offsets'], 0.9, vid=trial['videos'])
+
+
+def bench_dlt2dlclabels(trial):
+    from dlt2dlclabels import dlt2dlclabels
+    vid = trial['videos'][0]
+    labdir = trial['path'] / 'labeled-data' / vid.stem
+
+    def run():
+        # start from a clean labeled-data folder each time, so every run imports all frames
+        for f in labdir.glob('CollectedData_*'):
+            f.unlink()
+        dlt2dlclabels(trial['config'], trial['xypts'][0], vid, 1, trial['offsets'][0], flipy=True)
+    return run
+
+
+def bench_dlt2dlctracks(trial):
+    from dlt2dlctracks import dlt2dlctracks
+    if trial['inds'] > 1:
+        # dlt2dlctracks only works with single animal projects
+        return None
+    src = trial['dlctracks'][0]
+    dlcxy = trial['path'] / 'bench_dlt2dlctracks.h5'
+
+    def run():
+        # dlt2dlctracks overwrites its dlc file, so work on a copy
+        shutil.copy(src, dlcxy)
+        dlt2dlctracks(trial['config'], trial['xypts'][0], dlcxy, trial['videos'][0], flipy=True)
+    return run
+
+
+BENCHMARKS = {'triangulate': bench_triangulate,
+              'get_repo_errors': bench_get_repo_errors,
+              'dlc2dlt': bench_dlc2dlt,
+              'dlt2dlclabels': bench_dlt2dlclabels,
+              'dlt2dlctracks': bench_dlt2dlctracks}
+
+
+def parse_size(size):
+    frames, cams, tracks, inds = [int(x) for x in size.lower().split('x')]
+    return {'frames': frames, 'cams': cams, 'tracks': tracks, 'inds': inds}
+
+
+def run_one(func, repeat):
+    """
+    returns the best wall time over repeat runs, and the peak traced memory (bytes) of one more run
+    """
+    times = []
+    for r in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                             cwd=str(Path(__file__).resolve().parents[1]))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(sizes, names, repeat, workdir=None, seed=0):
+    results = []
+    tmp = None
+    if workdir is None:
+        tmp = tempfile.mkdtemp(prefix='dlcdlt_bench_')
+        workdir = tmp
+    workdir = Path(workdir)
+    try:
+        for size in sizes:
+            dims = parse_size(size)
+            trial = synthetic.make_trial(workdir / size, dims['frames'], dims['cams'], dims['tracks'], dims['inds'],
+                                         seed=seed)
+            for name in names:
+                try:
+                    func = BENCHMARKS[name](trial)
+                except ImportError as e:
+                    print('skipping {} ({})'.format(name, e))
+                    continue
+                if func is None:
+                    print('skipping {} (not available for size {})'.format(name, size))
+                    continue
+                best, peak = run_one(func, repeat)
+                res = dict(dims, size=size, benchmark=name, seconds=best, peak_mb=peak / 1e6)
+                results.append(res)
+                print('{:>20} {:>16} {:>10.4f} s {:>10.1f} MB'.format(size, name, best, peak / 1e6))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='benchmark conversion and triangulation on synthetic data')
+    parser.add_argument('-sizes', nargs='+', default=['1000x2x4x1', '10000x3x8x1', '10000x4x8x2'],
+                        help='trial sizes as FRAMESxCAMSxTRACKSxINDS, space separated')
+    parser.add_argument('-bench', nargs='+', default=list(BENCHMARKS.keys()), choices=list(BENCHMARKS.keys()),
+                        help='benchmarks to run, defaults to all')
+    parser.add_argument('-repeat', default=3, type=int, help='number of timed runs per benchmark, best is kept')
+    parser.add_argument('-workdir', default=None, help='folder for the synthetic trials, a temporary folder (deleted afterwards) by default')
+    parser.add_argument('-seed', default=0, type=int, help='random seed for the synthetic data')
+    parser.add_argument('-out', default=None, help='path to save the results as json')
+    parser.add_argument('-cache', action='store_true', help='use the shared cache, in a temporary folder (off by default)')
+
+    args = parser.parse_args()
+
+    cachedir = tempfile.mkdtemp(prefix='dlcdlt_cache_') if args.cache else None
+    os.environ['DLCDLT_CACHE'] = cachedir or 'off'
+
+    try:
+        results = main(args.sizes, args.bench, args.repeat, args.workdir, args.seed)
+    finally:
+        if cachedir is not None:
+            shutil.rmtree(cachedir, ignore_errors=True)
+    if args.out:
+        report = {'commit': git_commit(),
+                  'python': platform.python_version(),
+                  'numpy': np.__version__,
+                  'platform': platform.platform(),
+                  'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'cache': args.cache,
+                  'results': results}
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('results written to ', args.out)
@@ -0,0 +1,218 @@
+"""
+Makes synthetic multi-camera trials for benchmarking the conversion and triangulation tools.
+
+Random smooth 3D tracks are projected through a ring of DLT calibrated cameras, then noise, dropouts and
+per-camera frame offsets are added. A trial folder contains everything the tools expect:
+    dlt-coefficients.csv            11 DLT coefficients per camera (one column per camera)
+    config.yaml                     DLC style config (single or multianimal)
+    cam<n>.avi                      a one-frame video per camera, so the tools can read the frame size
+    cam<n>DLC_synth.h5              DLC style tracks per camera, in video frame numbers (upper left origin)
+    trial-xypts.csv                 DLT style xypts (lower left origin, offsets applied), or trial_<ind>-xypts.csv
+    trial-offsets.csv               the frame offsets used
+    labeled-data/cam<n>/img####.png a few extracted frames per camera, for dlt2dlclabels
+
+Example call:
+python benchmarks/synthetic.py /path/to/folder -frames 10000 -cams 4 -tracks 8 -inds 2
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import yaml
+
+
+def make_dlt(numcams, width=640, height=480, radius=5., focal=800.):
+    """
+    makes DLT coefficients (numcams x 11) for cameras spaced evenly on a ring around the origin, all looking at it
+    the coefficients use an upper left image origin
+    """
+    dlt = np.zeros((numcams, 11))
+    for c in range(numcams):
+        ang = 2 * np.pi * c / numcams
+        center = np.array([radius * np.cos(ang), radius * np.sin(ang), 0.2 * radius])
+        # camera axes, z looking at the origin
+        z = -center / np.linalg.norm(center)
+        x = np.cross([0., 0., 1.], z)
+        x = x / np.linalg.norm(x)
+        y = np.cross(z, x)
+        R = np.vstack([x, y, z])
+        K = np.array([[focal, 0., width / 2.],
+                      [0., focal, height / 2.],
+                      [0., 0., 1.]])
+        P = np.matmul(K, np.hstack([R, -np.matmul(R, center)[:, None]]))
+        P = P / P[2, 3]
+        dlt[c] = np.concatenate([P[0], P[1], P[2, :3]])
+    return dlt
+
+
+def project(dlt, xyz):
+    """
+    projects (..., 3) points through all cameras in dlt, returns (..., cams, 2) pixel coordinates
+    """
+    xyz = np.asarray(xyz)[..., None, :]
+    den = (xyz * dlt[:, 8:11]).sum(-1) + 1.
+    u = ((xyz * dlt[:, 0:3]).sum(-1) + dlt[:, 3]) / den
+    v = ((xyz * dlt[:, 4:7]).sum(-1) + dlt[:, 7]) / den
+    return np.stack([u, v], axis=-1)
+
+
+def make_tracks(numframes, numinds, numtracks, rng, spread=0.6):
+    """
+    makes smooth random 3D tracks as a (frames, inds, tracks, 3) array
+    each individual wanders around the origin, and its tracks are fixed points on a small rigid body
+    """
+    # smoothed random walk for each individual's centre
+    steps = rng.normal(0, 0.01, (numframes, numinds, 3))
+    center = np.cumsum(steps, axis=0)
+    center = spread * np.tanh(center)
+    body = rng.normal(0, 0.1, (1, numinds, numtracks, 3))
+    return center[:, :, None, :] + body
+
+
+def make_trial(opath, numframes=1000, numcams=3, numtracks=5, numinds=1, noise=0.5, dropout=0.1, maxoffset=10,
+               width=640, height=480, numimages=10, seed=0):
+    """
+    writes a synthetic trial to opath, and returns a dict describing it (paths, offsets, sizes)
+    """
+    opath = Path(opath)
+    opath.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    ma = numinds > 1
+    individuals = ['ind{}'.format(i + 1) for i in range(numinds)]
+    bodyparts = ['pt{}'.format(t + 1) for t in range(numtracks)]
+    scorer = 'DLC_synth'
+
+    dlt = make_dlt(numcams, width, height)
+    # first camera is the reference, others are offset (DLT row = video frame - offset)
+    offsets = np.concatenate([[0], rng.integers(-maxoffset, maxoffset + 1, numcams - 1)]).astype(int)
+
+    xyz = make_tracks(numframes, numinds, numtracks, rng)
+    # (frames, inds, tracks, cams, 2), upper left origin, in DLT rows
+    uv = project(dlt, xyz)
+    uv = uv + rng.normal(0, noise, uv.shape)
+    like = rng.uniform(0.9, 1., uv.shape[:-1])
+    drop = rng.random(uv.shape[:-1]) < dropout
+    like[drop] = rng.uniform(0., 0.5, drop.sum())
+    uv[drop] = np.nan
+
+    # dlt coefficients, one column per camera, the way Argus and DLTdv save them
+    # like the xypts, these use the lower left origin (v' = height - v)
+    dltflip = dlt.copy()
+    dltflip[:, 4:7] = height * dlt[:, 8:11] - dlt[:, 4:7]
+    dltflip[:, 7] = height - dlt[:, 7]
+    dltpath = opath / 'dlt-coefficients.csv'
+    pd.DataFrame(dltflip.T).to_csv(dltpath, header=False, index=False)
+
+    videos = []
+    for c in range(numcams):
+        vidpath = opath / 'cam{}.avi'.format(c + 1)
+        _write_video(vidpath, width, height)
+        videos.append(vidpath)
+
+    cfgpath = opath / 'config.yaml'
+    cfg = {'Task': 'synth',
+           'scorer': 'synth',
+           'date': 'Jan1',
+           'project_path': str(opath),
+           'multianimalproject': ma,
+           'video_sets': {str(v): {'crop': '0, {}, 0, {}'.format(width, height)} for v in videos},
+           'bodyparts': 'MULTI!' if ma else bodyparts}
+    if ma:
+        cfg['individuals'] = individuals
+        cfg['uniquebodyparts'] = []
+        cfg['multianimalbodyparts'] = bodyparts
+    with open(cfgpath, 'w') as f:
+        yaml.safe_dump(cfg, f, sort_keys=False)
+
+    # DLC tracks, in each camera's own video frame numbers
+    dlcpaths = []
+    for c in range(numcams):
+        if ma:
+            header = pd.MultiIndex.from_product([[scorer], individuals, bodyparts, ['x', 'y', 'likelihood']],
+                                                names=['scorer', 'individuals', 'bodyparts', 'coords'])
+        else:
+            header = pd.MultiIndex.from_product([[scorer], bodyparts, ['x', 'y', 'likelihood']],
+                                                names=['scorer', 'bodyparts', 'coords'])
+        data = np.concatenate([uv[:, :, :, c, :], like[:, :, :, c, None]], axis=-1)
+        data = data.reshape((numframes, -1))
+        # video frame = DLT row + offset
+        frames = np.arange(numframes) + offsets[c]
+        keep = frames >= 0
+        df = pd.DataFrame(data[keep], columns=header, index=frames[keep])
+        df = df.reindex(range(frames[keep].max() + 1))
+        dlcpath = opath / 'cam{}{}.h5'.format(c + 1, scorer)
+        df.to_hdf(dlcpath, key='df_with_missing', format='table', mode='w')
+        dlcpaths.append(dlcpath)
+
+    # DLT xypts, lower left origin
+    flipped = uv.copy()
+    flipped[..., 1] = height - flipped[..., 1]
+    xycols = ['{}_cam_{}_{}'.format(bp, c, d) for bp in bodyparts for c in range(1, numcams + 1) for d in ['x', 'y']]
+    xypaths = []
+    for i, ind in enumerate(individuals):
+        basename = 'trial_{}-'.format(ind) if ma else 'trial-'
+        xypath = opath / (basename + 'xypts.csv')
+        pd.DataFrame(flipped[:, i].reshape((numframes, -1)), columns=xycols).to_csv(xypath, na_rep='NaN', index=False)
+        xypaths.append(xypath)
+    offpath = opath / 'trial-offsets.csv'
+    pd.DataFrame([offsets], columns=['camera_{}'.format(c) for c in range(1, numcams + 1)]).to_csv(offpath, index=False)
+
+    # a few extracted frames per camera, so dlt2dlclabels has something to label
+    imgframes = np.linspace(0, numframes - 1, min(numimages, numframes)).astype(int)
+    for v in videos:
+        labdir = opath / 'labeled-data' / v.stem
+        labdir.mkdir(parents=True, exist_ok=True)
+        for fr in imgframes:
+            _write_image(labdir / 'img{:04d}.png'.format(fr), width, height)
+
+    return {'path': opath,
+            'config': cfgpath,
+            'dlt': dltpath,
+            'videos': videos,
+            'dlctracks': dlcpaths,
+            'xypts': xypaths,
+            'offsets': [int(o) for o in offsets],
+            'heights': [height] * numcams,
+            'xyz': xyz,
+            'individuals': individuals,
+            'bodyparts': bodyparts,
+            'frames': numframes,
+            'cams': numcams,
+            'tracks': numtracks,
+            'inds': numinds}
+
+
+def _write_video(vidpath, width, height):
+    import cv2
+    out = cv2.VideoWriter(str(vidpath), cv2.VideoWriter_fourcc(*'MJPG'), 30, (width, height), True)
+    out.write(np.zeros((height, width, 3), np.uint8))
+    out.release()
+
+
+def _write_image(imgpath, width, height):
+    import cv2
+    cv2.imwrite(str(imgpath), np.zeros((height, width, 3), np.uint8))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='make a synthetic multi-camera DLC/DLT trial')
+    parser.add_argument('opath', help='folder to write the trial to')
+    parser.add_argument('-frames', default=1000, type=int, help='number of frames')
+    parser.add_argument('-cams', default=3, type=int, help='number of cameras')
+    parser.add_argument('-tracks', default=5, type=int, help='number of tracks (bodyparts) per individual')
+    parser.add_argument('-inds', default=1, type=int, help='number of individuals, more than 1 makes a multianimal project')
+    parser.add_argument('-noise', default=0.5, type=float, help='standard deviation of pixel noise')
+    parser.add_argument('-dropout', default=0.1, type=float, help='fraction of points missing (low likelihood)')
+    parser.add_argument('-maxoffset', default=10, type=int, help='largest absolute frame offset between cameras')
+    parser.add_argument('-seed', default=0, type=int, help='random seed')
+
+    args = parser.parse_args()
+
+    trial = make_trial(args.opath, args.frames, args.cams, args.tracks, args.inds, args.noise, args.dropout,
+                       args.maxoffset, seed=args.seed)
+    print('synthetic trial written to {}, offsets {}'.format(trial['path'], trial['offsets']))
@@ -0,0 +1,115 @@
+"""
+Checks bundle.py on synthetic trials (see synthetic.py): the cameras of a trial are bumped (turned and moved a little),
+some observations are made into gross tracking errors, and bundle.bundle refines the bumped calibration with the
+trial's xypts file.
+
+The report gives how well each calibration reconstructs the true tracks: the noise free projections of the tracks are
+triangulated with the bumped, refined and true coefficients, and the median distance to the true tracks is taken
+after the best similarity transform (the coordinate system itself can't be recovered from the observations), along
+with the time and peak traced memory of bundle.bundle.
+
+Example call:
+python benchmarks/validate_bundle.py -sizes 100000x4x4x1 -out bundle.json
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import tools
+import bundle
+import calibrate
+import synthetic
+from run_benchmarks import parse_size
+
+
+def corrupt(xypath, fraction, rng, size=40.):
+    """
+    adds gross errors (normal, size pixels) to a fraction of the points of an xypts file
+    """
+    df = pd.read_csv(xypath)
+    pts = df.values.reshape((len(df), -1, 2))
+    bad = np.isfinite(pts).all(-1) & (rng.random(pts.shape[:2]) < fraction)
+    pts[bad] += rng.normal(0, size, (bad.sum(), 2))
+    pd.DataFrame(pts.reshape((len(df), -1)), columns=df.columns).to_csv(xypath, na_rep='NaN', index=False)
+
+
+def track_error(dlt, trial):
+    """
+    median distance (after the best similarity transform) of the tracks triangulated from their noise free
+    projections with dlt to the true tracks
+    """
+    xyz = trial['xyz'].reshape((-1, 3))
+    # in the xypts coordinates, like the coefficients
+    uv = synthetic.project(tools.load_dlt(trial['dlt']), xyz)
+    est = tools.triangulate_obs(tools.Observations.from_array(uv[:, None]), dlt)[:, 0]
+    s, Q, t = bundle.similarity(est, xyz)
+    return float(np.median(np.linalg.norm(s * est @ Q.T + t - xyz, axis=1)))
+
+
+def validate(trial, turn, move, outliers, robust, seed=0):
+    rng = np.random.default_rng(seed)
+    true = tools.load_dlt(trial['dlt'])
+    cams = bundle.Cameras.from_dlt(true, trial['xyz'].reshape((-1, 3)))
+    step = np.zeros((len(true), bundle.NPARAMS))
+    step[:, 0:3] = rng.normal(0, np.deg2rad(turn), (len(true), 3))
+    step[:, 3:6] = rng.normal(0, move, (len(true), 3))
+    bumped = cams.update(step).to_dlt()
+    bumpedpath = trial['path'] / 'bumped-dlt-coefficients.csv'
+    calibrate.write_dlt(bumpedpath, bumped)
+    for xypath in trial['xypts']:
+        corrupt(xypath, outliers, rng)
+
+    tracemalloc.start()
+    t = time.perf_counter()
+    refined = bundle.bundle(trial['xypts'], bumpedpath, robust=robust)
+    seconds = time.perf_counter() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': seconds, 'peak_mb': peak / 1e6, 'true_error': track_error(true, trial),
+            'bumped_error': track_error(bumped, trial), 'refined_error': track_error(refined, trial)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='check bundle adjustment of bumped cameras on synthetic data')
+    parser.add_argument('-sizes', nargs='+', default=['10000x3x5x1', '100000x4x4x1'],
+                        help='trial sizes as FRAMESxCAMSxTRACKSxINDS, space separated')
+    parser.add_argument('-turn', default=0.5, type=float, help='how far the cameras are turned, degrees (sd)')
+    parser.add_argument('-move', default=0.01, type=float, help='how far the cameras are moved, calibration units (sd)')
+    parser.add_argument('-outliers', default=0.02, type=float, help='fraction of points made into gross errors')
+    parser.add_argument('-robust', default=3., type=float, help='Huber threshold for bundle.py, pixels')
+    parser.add_argument('-seed', default=0, type=int, help='random seed for the synthetic data')
+    parser.add_argument('-out', default=None, help='path to save the report as json')
+
+    args = parser.parse_args()
+
+    results = []
+    tmp = Path(tempfile.mkdtemp(prefix='dlcdlt_bundle_'))
+    try:
+        for size in args.sizes:
+            dims = parse_size(size)
+            trial = synthetic.make_trial(tmp / size, dims['frames'], dims['cams'], dims['tracks'], dims['inds'],
+                                         seed=args.seed)
+            res = dict(dims, size=size, **validate(trial, args.turn, args.move, args.outliers, args.robust,
+                                                   args.seed))
+            results.append(res)
+            print('{}: track error bumped {:.3g}, refined {:.3g} (true {:.3g}), {:.1f} s, peak memory {:.1f} MB'.format(
+                size, res['bumped_error'], res['refined_error'], res['true_error'], res['seconds'], res['peak_mb']))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('report written to ', args.out)
@@ -0,0 +1,135 @@
+"""
+Checks the compiled kernels (kernels.py) against the reference implementations on a synthetic trial (see synthetic.py):
+    kernels.solve_groups        against tools.uv_to_xyz
+    kernels.repo_groups         against tools.get_repo_errors
+    kernels.undistort_pinhole   against tools.undistort_pts (OpenCV)
+along with the NumPy versions in tools (triangulate_obs, repo_errors_obs) used when the kernels are off, and times
+all of them. Without the kernels, undistortion uses tools.undistort_pts itself, so it has no NumPy column.
+
+The kernels are checked whether or not Numba is installed (without it they run as plain python, slowly). Exits with
+an error if any difference (kernel or NumPy) is larger than its tolerance.
+
+Example call:
+python benchmarks/validate_kernels.py -size 2000x4x8x1
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import tools
+import kernels
+import synthetic
+from run_benchmarks import parse_size
+
+# absolute tolerances: xyz in calibration units, pixels for residuals and undistortion
+# OpenCV undistorts in float32, so that comparison can't be tighter than float32 pixels
+TOLERANCES = {'xyz': 1e-8, 'residuals': 1e-8, 'undistort': 1e-3}
+
+
+def timed(func):
+    t0 = time.perf_counter()
+    out = func()
+    return out, time.perf_counter() - t0
+
+
+def numpy_only(func):
+    """
+    runs func with the kernels switched off, so tools uses its NumPy versions
+    """
+    use = kernels.NUMBA
+    kernels.NUMBA = False
+    try:
+        return func()
+    finally:
+        kernels.NUMBA = use
+
+
+def max_diff(a, b):
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if not (np.isnan(a) == np.isnan(b)).all():
+        return np.inf
+    both = np.isfinite(a)
+    return float(np.abs(a[both] - b[both]).max()) if both.any() else 0.
+
+
+def validate(trial):
+    ncams = trial['cams']
+    pts = pd.read_csv(trial['xypts'][0]).values
+    obs = tools.Observations.from_array(tools.xypts_to_array(pts, ncams))
+    dlt = pd.read_csv(trial['dlt'], header=None).values.T
+    order, points, starts, counts = tools._point_groups(obs)
+    uv = obs.uv[order].astype(float)
+    cam = obs.cam[order]
+    # compile first, so the timings below are of the compiled code
+    ones = np.ones(len(uv))
+    kernels.solve_groups(uv[:2], cam[:2], starts[:1], np.minimum(counts[:1], 2), dlt, ones[:2])
+
+    ref, t_ref = timed(lambda: np.hstack([tools.uv_to_xyz(pts[:, j * 2 * ncams:(j + 1) * 2 * ncams], dlt)
+                                          for j in range(trial['tracks'])]))
+    ref = ref.reshape((len(pts), -1, 3))
+    got, t_kern = timed(lambda: kernels.solve_groups(uv, cam, starts, counts, dlt, ones))
+    xyz = np.full((obs.shape[0] * obs.shape[1], 3), np.nan)
+    xyz[points] = got
+    xyz = xyz.reshape(ref.shape)
+    npxyz, t_np = timed(lambda: numpy_only(lambda: tools.triangulate_obs(obs, dlt)))
+    res = [('xyz', max_diff(ref, xyz), max_diff(ref, npxyz), t_ref, t_np, t_kern)]
+
+    flat = xyz.reshape((len(pts), -1))
+    ref, t_ref = timed(lambda: tools.get_repo_errors(flat, pts, None, dlt).T)
+    # compile on the first point (its observations are the first counts[0] rows)
+    kernels.repo_groups(uv[:counts[0]], cam[:counts[0]], starts[:1], counts[:1], xyz.reshape((-1, 3))[points[:1]], dlt)
+    got, t_kern = timed(lambda: kernels.repo_groups(uv, cam, starts, counts, xyz.reshape((-1, 3))[points], dlt))
+    err = np.full(obs.shape[0] * obs.shape[1], np.nan)
+    err[points] = got
+    err[err == 0] = np.nan
+    nperr, t_np = timed(lambda: numpy_only(lambda: tools.repo_errors_obs(obs, xyz, dlt)))
+    res.append(('residuals', max_diff(ref, err.reshape(ref.shape)), max_diff(ref, nperr), t_ref, t_np, t_kern))
+
+    prof = np.array([800., 320., 240., -0.2, 0.05, 0.001, -0.002, 0.01])
+    sel = obs.uv[obs.cam == 0].astype(float)
+    kernels.undistort_pinhole(sel[:1], prof)
+    ref, t_ref = timed(lambda: tools.undistort_pts(sel, prof))
+    got, t_kern = timed(lambda: kernels.undistort_pinhole(sel, prof))
+    res.append(('undistort', max_diff(ref, got), None, t_ref, None, t_kern))
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='check the compiled kernels against the reference implementations')
+    parser.add_argument('-size', default='2000x4x8x1', help='trial size as FRAMESxCAMSxTRACKSxINDS')
+    parser.add_argument('-seed', default=0, type=int, help='random seed for the synthetic data')
+
+    args = parser.parse_args()
+
+    print('kernels ' + ('in use' if kernels.NUMBA else 'not in use (numba not installed, or DLCDLT_NO_NUMBA set)'))
+    dims = parse_size(args.size)
+    tmp = Path(tempfile.mkdtemp(prefix='dlcdlt_kernels_'))
+    try:
+        trial = synthetic.make_trial(tmp / args.size, dims['frames'], dims['cams'], dims['tracks'], 1,
+                                     seed=args.seed, numimages=0)
+        results = validate(trial)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    print('{:<12} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}'.format('', 'kernel diff', 'numpy diff', 'tolerance',
+                                                                    'reference s', 'numpy s', 'kernel s'))
+    failed = False
+    for name, diff, npdiff, t_ref, t_np, t_kern in results:
+        ok = diff <= TOLERANCES[name] and (npdiff is None or npdiff <= TOLERANCES[name])
+        failed = failed or not ok
+        print('{:<12} {:>12.3g} {:>12} {:>12.3g} {:>12.4f} {:>12} {:>12.4f} {}'.format(
+            name, diff, '' if npdiff is None else '{:.3g}'.format(npdiff), TOLERANCES[name], t_ref,
+            '' if t_np is None else '{:.4f}'.format(t_np), t_kern, '' if ok else 'FAILED'))
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,78 @@
+"""
+Checks that pipeline.py keeps the 3D points of a trial through the correction loop, on a synthetic trial (see
+synthetic.py): the season is run once, then the DLC config file is edited (a comment is added, which re-runs dlc2dlt
+without changing the 2D points) and the season is run again, twice. The number of triangulated points has to stay the
+same after every run.
+
+Example call:
+python benchmarks/validate_pipeline.py -size 2000x3x4x1
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import yaml
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import pipeline
+import synthetic
+from run_benchmarks import parse_size
+
+
+def finite_points(xyzpath):
+    return int(np.isfinite(pd.read_csv(xyzpath).values).sum())
+
+
+def run_season(specpath):
+    trials = pipeline.load_season(specpath)
+    status = pipeline.build_season(trials, Path(specpath).with_suffix('.state.json')).run()
+    return sorted(name for name, s in status.items() if s.startswith('ran'))
+
+
+def validate(trial, tmp):
+    specpath = tmp / 'season.yaml'
+    spec = {'config': str(trial['config']), 'dlt': str(trial['dlt']), 'like': 0.5,
+            'trials': [{'name': 'trial', 'path': str(tmp / 'out' / 'trial'),
+                        'dlctracks': [str(p) for p in trial['dlctracks']],
+                        'videos': [str(v) for v in trial['videos']], 'offsets': trial['offsets']}]}
+    with open(specpath, 'w') as f:
+        yaml.safe_dump(spec, f)
+    (tmp / 'out').mkdir(exist_ok=True)
+    xyzpath = tmp / 'out' / 'trial-xyzpts.csv'
+
+    steps = [('first run', run_season(specpath), finite_points(xyzpath))]
+    with open(trial['config'], 'a') as f:
+        f.write('# edited\n')
+    for step in ['after editing config.yaml', 'run again']:
+        steps.append((step, run_season(specpath), finite_points(xyzpath)))
+    return steps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='check that editing the DLC config between pipeline runs keeps the triangulated points')
+    parser.add_argument('-size', default='2000x3x4x1', help='trial size as FRAMESxCAMSxTRACKSxINDS')
+    parser.add_argument('-seed', default=0, type=int, help='random seed for the synthetic data')
+
+    args = parser.parse_args()
+
+    dims = parse_size(args.size)
+    tmp = Path(tempfile.mkdtemp(prefix='dlcdlt_pipeline_'))
+    try:
+        trial = synthetic.make_trial(tmp / 'trial', dims['frames'], dims['cams'], dims['tracks'], dims['inds'],
+                                     seed=args.seed)
+        steps = validate(trial, tmp)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    print()
+    for step, ran, points in steps:
+        print('{:<28} {:>8} finite xyz values, ran {}'.format(step, points, ', '.join(ran) or 'nothing'))
+    if len({points for _, _, points in steps}) > 1 or steps[0][2] == 0:
+        raise SystemExit('triangulated points were lost')
@@ -0,0 +1,100 @@
+"""
+Checks the float32 precision mode against float64 on synthetic trials (see synthetic.py).
+
+For each size (FRAMESxCAMSxTRACKSxINDS), a trial is generated and dlc2dlt and tools.triangulate are run once with
+each precision. The report gives the largest differences between the two in the xypts coordinates (pixels),
+the xyz coordinates and the reprojection residuals, along with the peak traced memory of each run.
+
+Example call:
+python benchmarks/validate_precision.py -sizes 10000x4x8x1 -out precision.json
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import tools
+from dlc2dlt import dlc2dlt
+import synthetic
+from run_benchmarks import parse_size
+
+
+def peak_mb(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1e6
+
+
+def max_diff(a, b):
+    """
+    largest absolute difference between two files of numbers, and whether they have NaNs in the same places
+    """
+    a = pd.read_csv(a).values
+    b = pd.read_csv(b).values
+    same = bool((np.isnan(a) == np.isnan(b)).all())
+    both = np.isfinite(a) & np.isfinite(b)
+    return (float(np.abs(a[both] - b[both]).max()) if both.any() else 0.), same
+
+
+def validate(trial):
+    res = {}
+    for prec in ['float64', 'float32']:
+        opath = trial['path'] / prec
+        opath.mkdir(exist_ok=True)
+        dlcpaths = [str(p) for p in trial['dlctracks']]
+        res[prec + '_dlc2dlt_mb'] = peak_mb(
+            lambda: dlc2dlt(trial['config'], opath / 'dlc', dlcpaths, True, trial['offsets'], 0.9,
+                            vid=trial['videos'], precision=prec))
+        xypath = opath / 'manual-xypts.csv'
+        shutil.copy(trial['xypts'][0], xypath)
+        res[prec + '_triangulate_mb'] = peak_mb(
+            lambda: tools.triangulate(xypath, trial['dlt'], flipy=True, heights=trial['heights'], precision=prec))
+    dlcname = 'dlc_{}-xypts.csv'.format(trial['individuals'][0]) if trial['inds'] > 1 else 'dlc-xypts.csv'
+    for key, name in [('xypts', dlcname), ('xyz', 'manual-xyzpts.csv'), ('residuals', 'manual-xyzres.csv')]:
+        res[key + '_max_diff'], res[key + '_same_nans'] = max_diff(trial['path'] / 'float64' / name,
+                                                                  trial['path'] / 'float32' / name)
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='compare float32 and float64 precision modes on synthetic data')
+    parser.add_argument('-sizes', nargs='+', default=['1000x2x4x1', '10000x4x8x1'],
+                        help='trial sizes as FRAMESxCAMSxTRACKSxINDS, space separated')
+    parser.add_argument('-seed', default=0, type=int, help='random seed for the synthetic data')
+    parser.add_argument('-out', default=None, help='path to save the report as json')
+
+    args = parser.parse_args()
+
+    results = []
+    tmp = Path(tempfile.mkdtemp(prefix='dlcdlt_precision_'))
+    try:
+        for size in args.sizes:
+            dims = parse_size(size)
+            trial = synthetic.make_trial(tmp / size, dims['frames'], dims['cams'], dims['tracks'], dims['inds'],
+                                         seed=args.seed)
+            res = dict(dims, size=size, **validate(trial))
+            results.append(res)
+            print('{}: max difference xypts {:.3g} px, xyz {:.3g}, residuals {:.3g} px'.format(
+                size, res['xypts_max_diff'], res['xyz_max_diff'], res['residuals_max_diff']))
+            print('{}: peak memory dlc2dlt {:.1f} -> {:.1f} MB, triangulate {:.1f} -> {:.1f} MB'.format(
+                size, res['float64_dlc2dlt_mb'], res['float32_dlc2dlt_mb'],
+                res['float64_triangulate_mb'], res['float32_triangulate_mb']))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('report written to ', args.out)
@@ -0,0 +1,433 @@
+"""
+Refines a DLT calibration with the points tracked in many frames (bundle adjustment): the cameras and the 3D points
+are adjusted together to minimize the reprojection error of every 2D observation.
+
+Each camera starts from the decomposition of its DLT coefficients (tools.DLTcameraPosition): position, orientation,
+focal length and principal point, as a pinhole camera with square pixels and no skew (what the DLT is for a real
+camera). The 3D points start triangulated with the original coefficients. Only the positions and orientations of the
+cameras are refined unless -intrinsics is given: points tracked on an animal usually cover a small part of each
+image, which hardly tells a shift of the principal point from a turn of the camera, and letting both move can warp
+the reconstruction without lowering the error. Gauss-Newton (Levenberg-Marquardt) steps use the sparse structure of
+the problem: each observation only depends on one camera and one point, so the points are eliminated per point (the
+Schur complement) and only a small system of camera parameters is solved, which scales to hundreds of thousands of
+points. Observations off by more than -robust pixels count less (Huber loss), so tracking errors don't pull the
+calibration. Afterwards the cameras and points are moved back into the original coordinate system (scale, position
+and orientation are not determined by the observations alone).
+
+The observations come from one or more xypts files (e.g. dlc2dlt.py output of several trials with the same
+calibration, DLT rows already offset), and only points seen by 2 or more cameras are used. With -prof they are
+undistorted first, and the distortion is kept fixed.
+
+The refined coefficients are saved the way Argus saves them (default <dlt coefficients>-refined.csv), ready for -dlt
+in the other tools, and with -toml (which needs -prof) as an anipose-style calibration.toml next to them, as
+DLTcameraPosition.py writes it.
+
+Example call:
+python bundle.py -xy /path/trial1-xypts.csv /path/trial2-xypts.csv -dlt /path/dlt-coefficients.csv -robust 3
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import contextlib
+import io
+from pathlib import Path
+import numpy as np
+import tools
+import calibrate
+import profiling
+
+# camera parameters: rotation (3, a small rotation applied to the current one), center (3), focal length, principal
+# point (2)
+NPARAMS = 9
+INTRINSICS = slice(6, 9)
+# points per block when building the reduced system
+CHUNK = 50000
+
+
+def decompose(L, xyz):
+    """
+    pinhole camera of DLT coefficients L, starting from tools.DLTcameraPosition
+    xyz are (n, 3) points the camera sees, to tell which way it looks
+    returns R (world to camera rotation), center, [f, cx, cy] and the sign of the v axis (-1 for a mirror image,
+    e.g. coefficients for a lower left image origin)
+    """
+    L = np.asarray(L, dtype=float)
+    # (it warns about non-orthogonal axes, which is expected here)
+    with contextlib.redirect_stdout(io.StringIO()):
+        center, T, _, Uo, Vo, _ = tools.DLTcameraPosition(L)
+    center = np.asarray(center).ravel()
+    # rows of T3, the camera axes up to their sign
+    axes = np.linalg.inv(np.asarray(T)[:3, :3])
+    axes = axes / np.linalg.norm(axes, axis=1)[:, None]
+    l1 = L[0:3] - Uo * L[8:11]
+    l2 = L[4:7] - Vo * L[8:11]
+    r3 = axes[2] if np.nanmedian((xyz - center) @ axes[2]) > 0 else -axes[2]
+    # scale of the coefficients, their third row is lam * r3
+    lam = L[8:11] @ r3
+    r1 = axes[0] * np.sign(axes[0] @ l1) * np.sign(lam)
+    r2 = np.cross(r3, r1)
+    sign = np.sign(lam * (r2 @ l2))
+    # the decomposition's axes are only orthogonal without skew, take the nearest rotation
+    u, _, vt = np.linalg.svd(np.vstack([r1, r2, r3]))
+    R = u @ np.diag([1, 1, np.linalg.det(u @ vt)]) @ vt
+    # (DLTcameraPosition's Z mixes up Uo and Vo, so the focal length is taken from the coefficients)
+    f = np.mean([np.linalg.norm(l1), np.linalg.norm(l2)]) / abs(lam)
+    return R, center, np.array([f, Uo, Vo]), sign
+
+
+def compose(R, center, k, sign):
+    """
+    DLT coefficients (11) of a pinhole camera, as from decompose
+    """
+    K = np.array([[k[0], 0, k[1]], [0, sign * k[0], k[2]], [0, 0, 1]])
+    P = K @ np.hstack([R, -(R @ center)[:, None]])
+    return P.ravel()[:11] / P[2, 3]
+
+
+def rotation(v):
+    """
+    (..., 3, 3) rotation matrices of (..., 3) rotation vectors (Rodrigues)
+    """
+    theta = np.linalg.norm(v, axis=-1)[..., None, None]
+    K = np.zeros(v.shape[:-1] + (3, 3))
+    K[..., 0, 1], K[..., 0, 2], K[..., 1, 2] = -v[..., 2], v[..., 1], -v[..., 0]
+    K = K - np.swapaxes(K, -1, -2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = np.where(theta > 1e-12, np.sin(theta) / theta, 1.)
+        b = np.where(theta > 1e-12, (1 - np.cos(theta)) / theta ** 2, .5)
+    return np.eye(3) + a * K + b * (K @ K)
+
+
+class Cameras:
+    """
+    pinhole cameras being refined: R (cams, 3, 3) world to camera rotations, center (cams, 3), k (cams, 3) focal
+    length and principal point, sign (cams) of the v axis
+    """
+    def __init__(self, R, center, k, sign):
+        self.R = np.asarray(R, dtype=float)
+        self.center = np.asarray(center, dtype=float)
+        self.k = np.asarray(k, dtype=float)
+        self.sign = np.asarray(sign, dtype=float)
+
+    @classmethod
+    def from_dlt(cls, dlt, xyz):
+        parts = [decompose(L, xyz) for L in dlt]
+        return cls(*[np.array([p[i] for p in parts]) for i in range(4)])
+
+    def to_dlt(self):
+        return np.array([compose(*p) for p in zip(self.R, self.center, self.k, self.sign)])
+
+    def update(self, step):
+        """
+        cameras moved by a (cams, NPARAMS) step
+        """
+        return Cameras(rotation(step[:, 0:3]) @ self.R, self.center + step[:, 3:6], self.k + step[:, 6:9], self.sign)
+
+    def transform(self, s, Q, t):
+        """
+        the same cameras for world coordinates s * Q @ xyz + t
+        """
+        return Cameras(self.R @ Q.T, s * self.center @ Q.T + t, self.k, self.sign)
+
+
+def _residuals(cams, xyz, uv, mask):
+    """
+    reprojection errors (n, cams, 2) of the (n, 3) points in the (n, cams, 2) observations, 0 where mask is False,
+    and the points in each camera's coordinates (n, cams, 3)
+    """
+    p = np.einsum('cij,ncj->nci', cams.R, xyz[:, None, :] - cams.center[None])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xy = p[..., :2] / p[..., 2:]
+    proj = cams.k[:, 0, None] * xy * np.stack([np.ones_like(cams.sign), cams.sign], axis=-1) + cams.k[:, 1:]
+    return np.where(mask[..., None], proj - uv, 0), p
+
+
+def _weights(res, mask, robust):
+    """
+    Huber weights of the observations (0 where mask is False) and the total cost
+    """
+    e = np.sqrt((res ** 2).sum(-1))
+    if robust is None:
+        return mask.astype(float), (e ** 2).sum()
+    w = np.where(e > robust, robust / np.where(e > 0, e, 1), 1.) * mask
+    return w, np.where(e > robust, 2 * robust * e - robust ** 2, e ** 2).sum()
+
+
+def _cost(cams, xyz, uv, mask, robust, chunk=CHUNK):
+    cost = 0.
+    for i in range(0, len(xyz), chunk):
+        sl = slice(i, i + chunk)
+        res, _ = _residuals(cams, xyz[sl], uv[sl], mask[sl])
+        cost += _weights(res, mask[sl], robust)[1]
+    return cost
+
+
+def _jacobians(cams, p, w):
+    """
+    derivatives of the residuals by the camera parameters (n, cams, 2, NPARAMS) and by the points (n, cams, 2, 3),
+    times the square root of the weights
+    """
+    sw = np.sqrt(w)
+    f = cams.k[:, 0] * sw
+    fs = f * cams.sign
+    with np.errstate(invalid='ignore', divide='ignore'):
+        iz = np.where(w > 0, 1 / p[..., 2], 0)
+    x, y = p[..., 0] * iz, p[..., 1] * iz
+    A = np.zeros(p.shape[:2] + (2, NPARAMS))
+    # a small rotation d turns p into p + d x p
+    A[..., 0, 0], A[..., 0, 1], A[..., 0, 2] = -f * x * y, f * (1 + x * x), -f * y
+    A[..., 1, 0], A[..., 1, 1], A[..., 1, 2] = -fs * (1 + y * y), fs * x * y, fs * x
+    B = np.empty(p.shape[:2] + (2, 3))
+    B[..., 0, :] = (f * iz)[..., None] * (cams.R[:, 0] - x[..., None] * cams.R[:, 2])
+    B[..., 1, :] = (fs * iz)[..., None] * (cams.R[:, 1] - y[..., None] * cams.R[:, 2])
+    A[..., 3:6] = -B
+    A[..., 0, 6] = x * sw
+    A[..., 1, 6] = cams.sign * y * sw
+    A[..., 0, 7] = sw
+    A[..., 1, 8] = sw
+    return A, B
+
+
+def _normal_equations(cams, xyz, uv, mask, robust, chunk=CHUNK):
+    """
+    the blocks of the weighted normal equations: U (cams, NPARAMS, NPARAMS) and gc (cams, NPARAMS) of the cameras,
+    and for each chunk of points V (n, 3, 3), Wt (n, 3, cams * NPARAMS) (the camera-point blocks, transposed) and
+    gp (n, 3)
+    """
+    ncams = len(cams.R)
+    U = np.zeros((ncams, NPARAMS, NPARAMS))
+    gc = np.zeros((ncams, NPARAMS))
+    blocks = []
+    for i in range(0, len(xyz), chunk):
+        sl = slice(i, i + chunk)
+        res, p = _residuals(cams, xyz[sl], uv[sl], mask[sl])
+        w, _ = _weights(res, mask[sl], robust)
+        A, B = _jacobians(cams, p, w)
+        r = res * np.sqrt(w)[..., None]
+        for c in range(ncams):
+            Ac = A[:, c].reshape((-1, NPARAMS))
+            U[c] += Ac.T @ Ac
+        gc += np.einsum('ncki,nck->ci', A, r)
+        Bt = np.swapaxes(B, -1, -2)
+        Wt = (Bt @ A).transpose((0, 2, 1, 3)).reshape((len(A), 3, ncams * NPARAMS))
+        blocks.append((np.einsum('ncki,nckj->nij', B, B), Wt, np.einsum('ncki,nck->ni', B, r)))
+    return U, gc, blocks
+
+
+def _solve(U, gc, blocks, mu, active):
+    """
+    the damped Gauss-Newton step of the cameras (cams, NPARAMS) and the points (n, 3), with the points eliminated
+    per point (Schur complement); active (cams, NPARAMS) marks the camera parameters being refined
+    """
+    ncams = len(U)
+    size = ncams * NPARAMS
+    S = np.zeros((size, size))
+    for c in range(ncams):
+        S[c * NPARAMS:(c + 1) * NPARAMS, c * NPARAMS:(c + 1) * NPARAMS] = U[c] + mu * np.diag(np.diag(U[c]) + 1e-9)
+    rhs = gc.ravel().copy()
+    inv = []
+    for V, Wt, gp in blocks:
+        Vinv = np.linalg.inv(V + mu * (V * np.eye(3) + 1e-9 * np.eye(3)))
+        # W Vinv Wt summed over the points, as one product: with Vinv = L L', Z = L' Wt and the sum is Z' Z
+        Lt = np.swapaxes(np.linalg.cholesky(Vinv), -1, -2)
+        Z = (Lt @ Wt).reshape((-1, size))
+        S -= Z.T @ Z
+        rhs -= Z.T @ (Lt @ gp[..., None]).ravel()
+        inv.append(Vinv)
+    act = active.ravel()
+    dc = np.zeros(size)
+    dc[act] = -np.linalg.solve(S[np.ix_(act, act)], rhs[act])
+    dxyz = [-(Vinv @ (gp + Wt @ dc)[..., None])[..., 0] for Vinv, (V, Wt, gp) in zip(inv, blocks)]
+    return dc.reshape((ncams, NPARAMS)), np.concatenate(dxyz) if dxyz else np.zeros((0, 3))
+
+
+def similarity(src, dst):
+    """
+    scale s, rotation Q and translation t that best map (n, 3) points src onto dst, s * Q @ src + t (Umeyama)
+    """
+    ms, md = src.mean(0), dst.mean(0)
+    a, b = src - ms, dst - md
+    u, d, vt = np.linalg.svd(b.T @ a / len(src))
+    e = np.diag([1, 1, np.sign(np.linalg.det(u @ vt))])
+    Q = u @ e @ vt
+    s = np.trace(np.diag(d) @ e) / (a ** 2).sum(1).mean()
+    return s, Q, md - s * Q @ ms
+
+
+def adjust(cams, xyz, uv, mask, robust=None, iterations=50, intrinsics=False, tol=1e-4, chunk=CHUNK):
+    """
+    bundle adjustment of Cameras and (n, 3) points xyz to the (n, cams, 2) observations uv (where mask), see the
+    module docstring; intrinsics=True also refines focal lengths and principal points
+    returns the refined cameras and points, in the coordinate system of xyz, and the cost of each iteration
+    """
+    if robust is not None and robust <= 0:
+        # every Huber weight would be 0, and nothing refined
+        raise ValueError('robust must be a positive number of pixels, got {}'.format(robust))
+    active = np.ones((len(cams.R), NPARAMS), dtype=bool)
+    if not intrinsics:
+        active[:, INTRINSICS] = False
+    # the observations don't change if everything is moved, turned or scaled together, so the first camera stays
+    # where it is, and the second keeps its distance from it along one axis (this only picks the coordinate system
+    # the solution is found in, it is moved back to the original one at the end)
+    active[0, 0:6] = False
+    active[1, 3 + np.argmax(np.abs(cams.center[1] - cams.center[0]))] = False
+    start = xyz
+    cost = _cost(cams, xyz, uv, mask, robust, chunk)
+    costs = [cost]
+    mu = 1e-3
+    for it in range(iterations):
+        with profiling.stage('normal_equations', items=len(xyz)):
+            U, gc, blocks = _normal_equations(cams, xyz, uv, mask, robust, chunk)
+        while mu < 1e10:
+            try:
+                dc, dxyz = _solve(U, gc, blocks, mu, active)
+            except np.linalg.LinAlgError:
+                mu *= 10
+                continue
+            newcams, newxyz = cams.update(dc), xyz + dxyz
+            newcost = _cost(newcams, newxyz, uv, mask, robust, chunk)
+            if newcost < cost:
+                mu = max(mu / 3, 1e-12)
+                break
+            mu *= 4
+        else:
+            break
+        cams, xyz = newcams, newxyz
+        done = cost - newcost < tol * cost
+        cost = newcost
+        costs.append(cost)
+        if done:
+            break
+    # back to the original coordinate system, by the points that stayed about where they were (a few points with
+    # outliers can run off far away)
+    moved = np.linalg.norm(xyz - start, axis=1)
+    near = moved <= 10 * np.median(moved)
+    s, Q, t = similarity(xyz[near], start[near])
+    return cams.transform(s, Q, t), s * xyz @ Q.T + t, costs
+
+
+def load_observations(xypaths, dlt, prof=None, flipy=False, heights=None, maxpoints=None, seed=0):
+    """
+    the (n, cams, 2) observations of the points seen by 2 or more cameras in the xypts files (undistorted with
+    prof), their mask, and the (n, 3) points triangulated with dlt
+    xypaths are paths to xypts files or tools.Points2D
+    """
+    uvs = []
+    for xypath in xypaths:
+        arr = tools.as_points2d(xypath, likelihoods=False).to_array().astype(float)
+        if prof is not None:
+            arr = calibrate.undistort(arr, prof, flipy, heights)
+        arr = arr.reshape((-1, len(dlt), 2))
+        uvs.append(arr[np.isfinite(arr).all(-1).sum(-1) >= 2])
+    uv = np.concatenate(uvs)
+    if maxpoints and len(uv) > maxpoints:
+        uv = uv[np.sort(np.random.default_rng(seed).choice(len(uv), maxpoints, replace=False))]
+    xyz = tools.triangulate_obs(tools.Observations.from_array(uv[:, None]), dlt)[:, 0]
+    keep = np.isfinite(xyz).all(-1)
+    uv, xyz = uv[keep], xyz[keep]
+    return np.where(np.isfinite(uv), uv, 0), np.isfinite(uv).all(-1), xyz
+
+
+def errors(dlt, xyz, uv, mask):
+    """
+    reprojection errors (pixels) with (cams, 11) coefficients, NaN where mask is False
+    """
+    res = calibrate.project(dlt, xyz).transpose((1, 0, 2)) - uv
+    return np.where(mask, np.sqrt((res ** 2).sum(-1)), np.nan)
+
+
+def write_toml(path, cams, profpath, flipy, error):
+    """
+    saves the cameras as an anipose-style calibration.toml with DLTcameraPosition.write_calibration, with image
+    sizes and distortion from the Argus profile (OpenCV cameras have an upper left image origin, so with flipy the
+    principal point is flipped with the profile's height)
+    """
+    import cv2
+    import DLTcameraPosition
+    prof = DLTcameraPosition.read_profile(profpath)
+    entries = []
+    for c, cam in enumerate(prof.index[:len(cams.R)]):
+        f, cx, cy = cams.k[c]
+        if flipy:
+            cy = prof.loc[cam, 3] - cy
+        if cams.sign[c] * (-1 if flipy else 1) < 0:
+            raise ValueError('camera {} is a mirror image with an upper left origin, check -flipy'.format(cam))
+        entries.append(DLTcameraPosition.camera_entry(
+            cam, [prof.loc[cam, 2], prof.loc[cam, 3]], [[f, 0.0, cx], [0.0, f, cy], [0.0, 0.0, 1.0]],
+            prof.loc[cam, [7, 8, 9, 10, 11]], cv2.Rodrigues(cams.R[c])[0].ravel(), -cams.R[c] @ cams.center[c]))
+    DLTcameraPosition.write_calibration(entries, path, adjusted=True, error=error)
+
+
+@profiling.profiled('bundle')
+def bundle(xypaths, dltpath, outpath=None, profpath=None, flipy=True, heights=None, robust=None, iterations=50,
+           intrinsics=False, maxpoints=None, toml=False):
+    """
+    refines the calibration in dltpath with the observations in xypaths, see the module docstring
+    writes the refined coefficients to outpath (default <dltpath>-refined.csv), and calibration.toml next to it with
+    toml; returns the refined (cams, 11) coefficients
+    xypaths can also be tools.Points2D, and dltpath a tools.Calibration (with its own profile, profpath is then only
+    read for the calibration.toml), which is refined without writing anything unless outpath is given
+    """
+    if outpath is None and not isinstance(dltpath, tools.Calibration):
+        outpath = str(dltpath)[:-4] + '-refined.csv' if str(dltpath).endswith('.csv') else str(dltpath) + '-refined.csv'
+    if robust is not None and robust <= 0:
+        raise ValueError('robust must be a positive number of pixels, got {}'.format(robust))
+    if toml and (profpath is None or outpath is None):
+        raise ValueError('the calibration.toml needs the camera profile (image sizes and distortion) and an outpath')
+    calib = tools.as_calibration(dltpath, profpath)
+    dlt, prof = calib.dlt, calib.prof
+    if prof is not None and flipy and (heights is None or len(heights) < len(dlt)):
+        raise ValueError('heights (one per camera) are needed to flip the points for undistortion')
+    with profiling.stage('load', items=len(xypaths)):
+        uv, mask, xyz = load_observations(xypaths, dlt, prof, flipy, heights, maxpoints)
+    if len(xyz) == 0:
+        raise ValueError('no points seen by 2 or more cameras')
+    cams = Cameras.from_dlt(dlt, xyz)
+    # points behind a camera can't be fit
+    _, p = _residuals(cams, xyz, uv, mask)
+    mask &= p[..., 2] > 0
+    keep = mask.sum(1) >= 2
+    uv, mask, xyz = uv[keep], mask[keep], xyz[keep]
+    before = errors(dlt, xyz, uv, mask)
+    with profiling.stage('adjust', items=len(xyz)):
+        cams, xyz, costs = adjust(cams, xyz, uv, mask, robust, iterations, intrinsics)
+    refined = cams.to_dlt()
+    after = errors(refined, xyz, uv, mask)
+    print('{} points, {} iterations'.format(len(xyz), len(costs) - 1))
+    # (outliers dominate the rms, and with -robust they are fit less, so the median tells more)
+    for c in range(len(dlt)):
+        print('camera {}: {} observations, reprojection error rms {:.3f} -> {:.3f} px, median {:.3f} -> {:.3f} px'.format(
+            c + 1, mask[:, c].sum(), np.sqrt(np.nanmean(before[:, c] ** 2)), np.sqrt(np.nanmean(after[:, c] ** 2)),
+            np.nanmedian(before[:, c]), np.nanmedian(after[:, c])))
+    if outpath is not None:
+        calibrate.write_dlt(outpath, refined)
+    if toml:
+        error = float(np.sqrt(np.nanmean(after ** 2)))
+        write_toml(Path(outpath).parent / 'calibration.toml', cams, profpath, flipy, error)
+    return refined
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='refine a DLT calibration with tracked points (bundle adjustment)')
+    parser.add_argument('-xy', nargs='+', help='input paths to one or more xypts files')
+    parser.add_argument('-dlt', help='path to dlt coefficients to refine')
+    parser.add_argument('-o', default=None, help='output path, default: <dlt coefficients>-refined.csv')
+    parser.add_argument('-prof', default=None, help='path to camera profile file, to undistort the points first')
+    parser.add_argument('-flipy', default=True, help='the files have a lower left origin (Argus, DLTdv 1-7), set to False for DLTdv8, only matters with -prof')
+    parser.add_argument('-heights', default=None, nargs='+', type=int, help='vertical resolution of each camera, needed with -flipy and -prof')
+    parser.add_argument('-robust', default=None, type=float, help='observations off by more than this many pixels count less (Huber loss), e.g. -robust 3')
+    parser.add_argument('-iterations', default=50, type=int, help='most iterations')
+    parser.add_argument('-intrinsics', action='store_true', help='also refine focal lengths and principal points (needs points all over the images)')
+    parser.add_argument('-maxpoints', default=None, type=int, help='use a random subset of this many points')
+    parser.add_argument('-toml', action='store_true', help='also save an anipose-style calibration.toml next to the output (needs -prof)')
+    parser.add_argument('-profile', default=None, help='folder to save a json timing/memory profile of this run (or set DLCDLT_PROFILE)')
+
+    args = parser.parse_args()
+
+    profiling.enable(args.profile)
+    flipy = str(args.flipy).lower() not in ['false', '0']
+    bundle(args.xy, args.dlt, args.o, args.prof, flipy, args.heights, args.robust, args.iterations, args.intrinsics,
+           args.maxpoints, args.toml)
@@ -0,0 +1,251 @@
+"""
+One on-disk cache of intermediate results shared by all the tools, so repeated runs over the same trials don't redo
+the same work: parsed xypts files, the likelihood filtered DLC tracks, video sizes, undistorted points and flipped
+calibrations.
+
+Each entry is an .npz file of numpy arrays in <cache dir>/<kind>/, named by the sha1 of what it was computed from:
+the path, modification time and size of the input files (so an entry is never used once its inputs change), plus
+the settings used. Entries are written to a temporary file and renamed into place, and are never modified, so
+several processes (e.g. a batch of dlc2dlt calls, the worker and watch.py) can share the cache safely. Reading an
+entry marks it as used; when the cache grows over its size limit, the least recently used entries are deleted. Each
+process keeps a running total of the cache size, so writes don't have to list the whole folder.
+
+The cache is in ~/.cache/dlcdlt by default. Set the DLCDLT_CACHE environment variable to use another folder, or to
+off to turn caching off, and DLCDLT_CACHE_MB to change the size limit (default 2048 MB).
+
+Inspect or clear the cache:
+python cache.py
+python cache.py -clear
+python cache.py -clear xypts
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+import numpy as np
+
+ENV_DIR = 'DLCDLT_CACHE'
+ENV_SIZE = 'DLCDLT_CACHE_MB'
+DEFAULT_MB = 2048
+# eviction trims the cache to this fraction of the limit, so it doesn't run on every write
+TRIM = 0.9
+# each process keeps a running total of the cache size: the folder is scanned on its first write, then the sizes of
+# its own writes are added, and it is scanned again every RESCAN writes to count what other processes wrote
+RESCAN = 100
+_usage = {'root': None, 'bytes': 0, 'writes': 0}
+
+
+def cache_dir():
+    """
+    the cache folder, None if caching is off
+    """
+    path = os.environ.get(ENV_DIR)
+    if path is not None and path.strip().lower() in ['', '0', 'off', 'false', 'none']:
+        return None
+    return Path(path) if path else Path.home() / '.cache' / 'dlcdlt'
+
+
+def size_limit():
+    """
+    the size limit of the cache in bytes
+    """
+    return int(float(os.environ.get(ENV_SIZE, DEFAULT_MB)) * 2 ** 20)
+
+
+def file_id(path):
+    """
+    what identifies the current version of a file: its full path, modification time and size
+    """
+    path = Path(path).resolve()
+    st = path.stat()
+    return [str(path), st.st_mtime_ns, st.st_size]
+
+
+def make_key(*parts):
+    """
+    sha1 of parts, which can be anything json can write, numpy arrays (hashed by their contents) and Paths
+    """
+    h = hashlib.sha1()
+    for p in parts:
+        if isinstance(p, np.ndarray):
+            h.update(str((p.dtype.str, p.shape)).encode())
+            h.update(np.ascontiguousarray(p).tobytes())
+        else:
+            h.update(json.dumps(p, default=str).encode())
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def _entry(kind, key):
+    root = cache_dir()
+    return None if root is None else root / kind / (key + '.npz')
+
+
+def get(kind, key):
+    """
+    the dict of arrays saved under kind and key, None if there isn't one (or caching is off)
+    """
+    path = _entry(kind, key)
+    if path is None:
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as f:
+            arrays = {k: f[k] for k in f.files}
+    except (OSError, ValueError, EOFError):
+        return None
+    try:
+        # mark it as recently used
+        os.utime(path)
+    except OSError:
+        pass
+    return arrays
+
+
+def put(kind, key, arrays):
+    """
+    saves a dict of arrays under kind and key, then evicts old entries if the cache is (by its running total) over
+    its limit; nothing is saved if caching is off or the cache can't be written
+    """
+    path = _entry(kind, key)
+    if path is None:
+        return
+    tmp = path.with_name('{}.{}.tmp.npz'.format(path.stem, uuid.uuid4().hex))
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(tmp, **arrays)
+        size = tmp.stat().st_size
+        tmp.replace(path)
+    except OSError:
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        return
+    root = cache_dir()
+    if _usage['root'] != root or _usage['writes'] >= RESCAN:
+        # (counts the entry just written)
+        _usage.update(root=root, bytes=sum(e[1] for e in entries()), writes=0)
+    else:
+        _usage['bytes'] += size
+        _usage['writes'] += 1
+    if _usage['bytes'] > size_limit():
+        evict()
+
+
+def cached(kind, key, compute):
+    """
+    the dict of arrays saved under kind and key, or compute() (which returns one) saved there
+    """
+    arrays = get(kind, key)
+    if arrays is None:
+        arrays = compute()
+        put(kind, key, arrays)
+    return arrays
+
+
+def entries():
+    """
+    (path, size, last used) of every entry in the cache, least recently used first
+    """
+    root = cache_dir()
+    if root is None or not root.exists():
+        return []
+    out = []
+    for sub in root.iterdir():
+        if not sub.is_dir():
+            continue
+        for path in sub.glob('*.npz'):
+            if path.name.endswith('.tmp.npz'):
+                # being written
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                # deleted by another process meanwhile
+                continue
+            out.append((path, st.st_size, st.st_mtime))
+    return sorted(out, key=lambda e: e[2])
+
+
+def evict(limit=None):
+    """
+    deletes the least recently used entries until the cache is under TRIM of limit (default size_limit()), if it is
+    over the limit; returns the number of entries deleted
+    """
+    limit = size_limit() if limit is None else limit
+    ents = entries()
+    total = sum(e[1] for e in ents)
+    deleted = 0
+    if total > limit:
+        for path, size, _ in ents:
+            if total <= TRIM * limit:
+                break
+            try:
+                path.unlink()
+                deleted += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # in use (on windows), skip it
+                continue
+            total -= size
+    _usage.update(root=cache_dir(), bytes=total, writes=0)
+    return deleted
+
+
+def clear(kind=None):
+    """
+    deletes all entries, or all of one kind, returns the number deleted
+    """
+    # the running total is scanned again on the next write
+    _usage['root'] = None
+    deleted = 0
+    for path, _, _ in entries():
+        if kind is None or path.parent.name == kind:
+            try:
+                path.unlink()
+                deleted += 1
+            except OSError:
+                pass
+    return deleted
+
+
+def summary():
+    """
+    number of entries and bytes of each kind in the cache
+    """
+    out = {}
+    for path, size, _ in entries():
+        n, b = out.get(path.parent.name, (0, 0))
+        out[path.parent.name] = (n + 1, b + size)
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='inspect or clear the cache of intermediate results shared by the tools')
+    parser.add_argument('-clear', nargs='?', const='all', default=None, help='delete all entries, or only those of one kind (e.g. -clear xypts)')
+    parser.add_argument('-evict', action='store_true', help='delete the least recently used entries if the cache is over its size limit')
+
+    args = parser.parse_args()
+
+    root = cache_dir()
+    if root is None:
+        print('caching is off ({}={})'.format(ENV_DIR, os.environ.get(ENV_DIR)))
+    elif args.clear is not None:
+        print('deleted {} entries'.format(clear(None if args.clear == 'all' else args.clear)))
+    elif args.evict:
+        print('deleted {} entries'.format(evict()))
+    else:
+        kinds = summary()
+        print('{}: {} entries, {:.1f} of {:.0f} MB'.format(root, sum(n for n, _ in kinds.values()),
+                                                           sum(b for _, b in kinds.values()) / 2 ** 20,
+                                                           size_limit() / 2 ** 20))
+        for kind, (n, b) in sorted(kinds.items()):
+            print('  {:<12} {:>6} entries {:>10.1f} MB'.format(kind, n, b / 2 ** 20))
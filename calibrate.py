@@ -0,0 +1,318 @@
+"""
+Estimates DLT coefficients from known 3D points and their 2D observations, e.g. to recalibrate a camera that was
+bumped mid session without going back to easyWand or Argus.
+
+The 3D points come from an -xyzpts.csv file (e.g. wand ends or landmarks triangulated before the bump, columns
+<track>_X, <track>_Y, <track>_Z) and their 2D observations from an -xypts.csv file with the same track names, row
+for row. Or, with -dlt and -cams, the points are triangulated from the cameras that did not move (with their
+coefficients from -dlt), and only the cameras in -cams are estimated again.
+
+Each camera's 11 coefficients are the least squares solution of the linear DLT equations, with the points
+normalized first (Hartley & Zisserman) so the solution doesn't depend on the units. All cameras (and all windows)
+are solved in one batched SVD. Each camera needs at least 6 points, not all in one plane, and points spread
+through the volume of interest. With -prof the 2D points are undistorted first, so the coefficients go with that
+camera profile.
+
+With -window, the coefficients are also estimated for every window of that many frames, e.g. to find when a camera
+moved or to follow one that drifts. They are saved as <out>-<first frame>.csv (0-indexed xypts row), and the number
+of points and the rms reprojection error of each window and camera are saved in <out>-windows.csv.
+
+The coefficients are saved the way Argus and DLTdv save them, and tools.triangulate reads them: a csv of 11 rows,
+one column per camera, in the coordinate system of the xypts file (lower left origin for Argus and DLTdv 1-7).
+
+Example calls:
+python calibrate.py -xy /path/wand-xypts.csv -xyz /path/wand-xyzpts.csv -o /path/new-dlt-coefficients.csv
+python calibrate.py -xy /path/trial-xypts.csv -dlt /path/dlt-coefficients.csv -cams 3 -window 5000
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import tools
+import profiling
+
+# fewest points that determine the 11 coefficients
+MIN_POINTS = 6
+# points (over the whole batch) whose equations are reduced at a time, to bound memory with long trials
+CHUNK = 200000
+
+
+def _normalizer(pts, valid):
+    """
+    (..., d + 1, d + 1) transforms moving the valid points of each batch of (..., n, d) pts to their centroid and
+    scaling them to a mean distance of sqrt(d) from it
+    """
+    d = pts.shape[-1]
+    w = valid[..., None].astype(float)
+    n = np.maximum(w.sum(axis=-2), 1)
+    center = np.where(w > 0, pts, 0).sum(axis=-2) / n
+    dist = np.sqrt(((np.where(w > 0, pts, center[..., None, :]) - center[..., None, :]) ** 2).sum(axis=-1))
+    mean = (dist * valid).sum(axis=-1) / n[..., 0]
+    scale = np.sqrt(d) / np.where(mean > 0, mean, 1)
+    T = np.zeros(pts.shape[:-2] + (d + 1, d + 1))
+    idx = np.arange(d)
+    T[..., idx, idx] = scale[..., None]
+    T[..., :d, d] = -scale[..., None] * center
+    T[..., d, d] = 1
+    return T
+
+
+def _apply(T, pts):
+    """
+    applies the (..., d + 1, d + 1) transforms of _normalizer (a scale and a shift) to (..., n, d) points
+    """
+    d = pts.shape[-1]
+    return pts * T[..., None, :1, 0] + T[..., None, :d, d]
+
+
+def _equations(X, u):
+    """
+    the two DLT equations of each point, from (..., n, 4) homogeneous xyz and (..., n, 2) uv
+    """
+    zero = np.zeros_like(X)
+    return np.concatenate([np.concatenate([X, zero, -u[..., :1] * X], axis=-1),
+                           np.concatenate([zero, X, -u[..., 1:] * X], axis=-1)], axis=-2)
+
+
+def estimate_dlt(xyz, uv, valid=None, chunk=CHUNK):
+    """
+    DLT coefficients from (..., n, 3) xyz points and their (..., n, 2) uv observations, a batch of problems (e.g.
+    one per camera) solved at once; valid marks the (..., n) points to use, default all finite ones
+    returns the (..., 11) coefficients (NaN where there are fewer than MIN_POINTS points) and the (...) number of
+    points used
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    uv = np.asarray(uv, dtype=float)
+    if valid is None:
+        valid = np.isfinite(xyz).all(axis=-1) & np.isfinite(uv).all(axis=-1)
+    npts = valid.sum(axis=-1)
+    xyz = np.where(valid[..., None], xyz, 0)
+    uv = np.where(valid[..., None], uv, 0)
+    T3 = _normalizer(xyz, valid)
+    T2 = _normalizer(uv, valid)
+    # unused points give rows of zeros
+    X = np.concatenate([_apply(T3, xyz), np.ones(xyz.shape[:-1] + (1,))], axis=-1) * valid[..., None]
+    u = _apply(T2, uv)
+    # the 12 x 12 R (of A = QR) has the same right singular vectors as A, and R of [R; more rows] is R of all the
+    # rows, so the equations are reduced a chunk at a time and only small matrices go into the SVD
+    batch = int(np.prod(X.shape[:-2]))
+    step = max(chunk // max(batch, 1), MIN_POINTS)
+    R = np.zeros(X.shape[:-2] + (0, 12))
+    for i in range(0, X.shape[-2], step):
+        R = np.linalg.qr(np.concatenate([R, _equations(X[..., i:i + step, :], u[..., i:i + step, :])], axis=-2),
+                         mode='r')
+    _, _, vt = np.linalg.svd(R)
+    P = vt[..., -1, :].reshape(X.shape[:-2] + (3, 4))
+    # back to the original units
+    P = np.linalg.inv(T2) @ P @ T3
+    P = P.reshape(P.shape[:-2] + (12,))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        L = P[..., :11] / P[..., 11:]
+    L[npts < MIN_POINTS] = np.nan
+    return L, npts
+
+
+def project(dlt, xyz):
+    """
+    projects (..., n, 3) points with (..., 11) coefficients, returns (..., n, 2) uv
+    """
+    dlt = np.asarray(dlt, dtype=float)[..., None, :]
+    den = (xyz * dlt[..., 8:11]).sum(-1) + 1.
+    u = ((xyz * dlt[..., 0:3]).sum(-1) + dlt[..., 3]) / den
+    v = ((xyz * dlt[..., 4:7]).sum(-1) + dlt[..., 7]) / den
+    return np.stack([u, v], axis=-1)
+
+
+def rms_error(dlt, xyz, uv, valid=None):
+    """
+    rms reprojection error (pixels) of the valid points of each batch, as for estimate_dlt
+    """
+    if valid is None:
+        valid = np.isfinite(xyz).all(axis=-1) & np.isfinite(uv).all(axis=-1)
+    with np.errstate(invalid='ignore'):
+        sq = ((project(dlt, np.where(valid[..., None], xyz, 0)) - np.where(valid[..., None], uv, 0)) ** 2).sum(-1)
+        return np.sqrt((sq * valid).sum(-1) / valid.sum(-1))
+
+
+def _batches(xyz, arr, cams, window=None):
+    """
+    the points of each camera in cams (and each window of frames), as batches for estimate_dlt
+    xyz is (frames, tracks, 3), arr the (frames, tracks, cams, 2) xypts array
+    returns (windows, cams, n, 3) xyz, (windows, cams, n, 2) uv and (windows, cams, n) valid, n being the most
+    points any batch has
+    """
+    frames = len(arr)
+    window = window or max(frames, 1)
+    nwin = -(-frames // window) if frames else 1
+    pad = nwin * window - frames
+    xyz = np.concatenate([xyz, np.full((pad,) + xyz.shape[1:], np.nan)]).reshape((nwin, -1, 3))
+    uv = arr[:, :, cams]
+    uv = np.concatenate([uv, np.full((pad,) + uv.shape[1:], np.nan)])
+    uv = uv.reshape((nwin, -1, len(cams), 2)).transpose((0, 2, 1, 3))
+    valid = np.isfinite(xyz).all(-1)[:, None, :] & np.isfinite(uv).all(-1)
+    # only the valid points, first, padded to the longest batch
+    n = max(int(valid.sum(-1).max()), 1)
+    order = np.argsort(~valid, axis=-1, kind='stable')[..., :n]
+    xyz = np.take_along_axis(np.broadcast_to(xyz[:, None], uv.shape[:-1] + (3,)), order[..., None], axis=-2)
+    uv = np.take_along_axis(uv, order[..., None], axis=-2)
+    return xyz, uv, np.take_along_axis(valid, order, axis=-1)
+
+
+def load_xyz(xyzpath, tracks):
+    """
+    the (frames, tracks, 3) points of the given tracks from an xyzpts file (columns <track>_X, _Y, _Z, any case) or
+    a tools.Points3D, NaN for tracks it doesn't have
+    """
+    if isinstance(xyzpath, tools.Points3D):
+        names = {t.lower(): i for i, t in enumerate(xyzpath.tracks)}
+        out = np.full((len(xyzpath), len(tracks), 3), np.nan)
+        for t, track in enumerate(tracks):
+            if track.lower() in names:
+                out[:, t] = xyzpath.xyz[:, names[track.lower()]]
+        return out
+    df = pd.read_csv(xyzpath, index_col=False)
+    cols = {c.lower(): c for c in df.columns}
+    out = np.full((len(df), len(tracks), 3), np.nan)
+    for t, track in enumerate(tracks):
+        for d, ax in enumerate('xyz'):
+            col = cols.get('{}_{}'.format(track, ax).lower())
+            if col is not None:
+                out[:, t, d] = df[col].values
+    return out
+
+
+def undistort(arr, prof, flipy=False, heights=None):
+    """
+    undistorts a (frames, tracks, cams, 2) xypts array with a camera profile, keeping its coordinate system
+    (the profile is for an upper left origin, so with flipy the points are flipped there and back)
+    """
+    obs = tools.Observations.from_array(arr)
+    if flipy:
+        obs = obs.flip_y(heights)
+    obs = obs.undistort(prof)
+    if flipy:
+        obs = obs.flip_y(heights)
+    return obs.to_array()
+
+
+def triangulate_fixed(arr, dlt, fixed):
+    """
+    (frames, tracks, 3) points triangulated from the cameras in fixed only, with their (cams, 11) coefficients
+    arr is the (frames, tracks, cams, 2) xypts array, in the same coordinate system as dlt (no flipping, which is
+    only approximate for coefficients with skew, see cFlip)
+    """
+    obs = tools.Observations.from_array(arr)
+    return tools.triangulate_obs(obs.select(np.isin(obs.cam, fixed)), dlt)
+
+
+def write_dlt(path, dlt):
+    """
+    saves (cams, 11) coefficients as Argus and DLTdv do: 11 rows, one column per camera
+    """
+    tools.Calibration(dlt).write(path)
+
+
+@profiling.profiled('calibrate')
+def calibrate(xypath, outpath=None, xyzpath=None, dltpath=None, cams=None, profpath=None, flipy=True, heights=None,
+              window=None):
+    """
+    estimates the DLT coefficients of the cameras in cams (0-indexed, default all) from xypath and xyzpath, or from
+    xypath alone by triangulating the points from the other cameras with dltpath, see the module docstring
+    writes outpath (default <xypts prefix>dlt-coefficients.csv, with the coefficients of the other cameras copied
+    from dltpath) and, with window, the coefficients and errors of each window
+    returns the (cams, 11) coefficients, and the per window summary as a dataframe (None without window)
+    xypath, xyzpath and dltpath can also be a tools.Points2D, Points3D and Calibration (with its own profile, profpath
+    is then not used); with a Points2D, nothing is written unless outpath is given
+    """
+    if outpath is None and not isinstance(xypath, tools.Points2D):
+        outpath = str(xypath).split('xypts')[0] + 'dlt-coefficients.csv'
+    with profiling.stage('load') as stg:
+        points = tools.as_points2d(xypath, likelihoods=False)
+        tracks = points.tracks
+        ncams = points.ncams
+        arr = points.to_array().astype(float)
+        stg.items = len(arr)
+    cams = list(range(ncams)) if cams is None else sorted(int(c) for c in cams)
+    old = None
+    prof = tools.load_camera_cached(profpath) if profpath else None
+    if dltpath is not None:
+        calib = tools.as_calibration(dltpath, profpath)
+        old, prof = calib.dlt, calib.prof
+        if old.shape[0] != ncams:
+            raise ValueError('the dlt coefficients have {} cameras, the xypts file {}'.format(old.shape[0], ncams))
+    elif len(cams) < ncams:
+        raise ValueError('the coefficients of the cameras not estimated have to come from a dlt file')
+    if prof is not None and flipy and (heights is None or len(heights) < ncams):
+        raise ValueError('heights (one per camera) are needed to flip the points for undistortion')
+    if prof is not None:
+        with profiling.stage('undistort', items=len(arr)):
+            arr = undistort(arr, prof, flipy, heights)
+
+    if xyzpath is not None:
+        with profiling.stage('read_xyz'):
+            xyz = load_xyz(xyzpath, tracks)
+        rows = min(len(xyz), len(arr))
+        xyz, arr = xyz[:rows], arr[:rows]
+    else:
+        fixed = [c for c in range(ncams) if c not in cams]
+        if old is None or len(fixed) < 2:
+            raise ValueError('without 3D points, give a dlt file and leave at least 2 cameras out of cams')
+        with profiling.stage('triangulate', items=len(arr)):
+            xyz = triangulate_fixed(arr, old, fixed)
+
+    with profiling.stage('estimate', items=len(cams)):
+        bxyz, buv, valid = _batches(xyz, arr, cams)
+        L, npts = estimate_dlt(bxyz, buv, valid)
+        err = rms_error(L, bxyz, buv, valid)
+    dlt = old.copy() if old is not None else np.full((ncams, 11), np.nan)
+    dlt[cams] = L[0]
+    for i, c in enumerate(cams):
+        print('camera {}: {} points, rms reprojection error {:.3f} px'.format(c + 1, npts[0, i], err[0, i]))
+    if outpath is not None:
+        write_dlt(outpath, dlt)
+
+    summary = None
+    if window:
+        base = None if outpath is None else str(outpath)[:-4] if str(outpath).endswith('.csv') else str(outpath)
+        with profiling.stage('estimate_windows', items=len(arr)):
+            bxyz, buv, valid = _batches(xyz, arr, cams, int(window))
+            L, npts = estimate_dlt(bxyz, buv, valid)
+            err = rms_error(L, bxyz, buv, valid)
+        parts = []
+        for w in range(L.shape[0]):
+            start = w * int(window)
+            wdlt = dlt.copy()
+            wdlt[cams] = L[w]
+            if base is not None:
+                write_dlt('{}-{}.csv'.format(base, start), wdlt)
+            parts.append(pd.DataFrame({'start': start, 'end': min(start + int(window), len(arr)),
+                                       'camera': np.array(cams) + 1, 'points': npts[w], 'rmse': err[w]}))
+        summary = pd.concat(parts, ignore_index=True)
+        if base is not None:
+            summary.to_csv(base + '-windows.csv', index=False, na_rep='NaN')
+    return dlt, summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='estimate DLT coefficients from 3D points and their 2D observations')
+    parser.add_argument('-xy', help='input path to xypts file with the 2D observations')
+    parser.add_argument('-xyz', default=None, help='input path to xyzpts file with the 3D points, same tracks and rows as -xy')
+    parser.add_argument('-dlt', default=None, help='path to dlt coefficients, for the cameras not in -cams, and to triangulate the points from them if there is no -xyz')
+    parser.add_argument('-cams', default=None, nargs='+', type=int, help='1-indexed cameras to estimate, e.g. -cams 3, default: all')
+    parser.add_argument('-o', default=None, help='output path, default: dlt-coefficients.csv next to the xypts file, with its prefix')
+    parser.add_argument('-prof', default=None, help='path to camera profile file, to undistort the 2D points first')
+    parser.add_argument('-flipy', default=True, help='the xypts file has a lower left origin (Argus, DLTdv 1-7), set to False for DLTdv8, only matters with -prof')
+    parser.add_argument('-heights', default=None, nargs='+', type=int, help='vertical resolution of each camera, needed with -flipy and -prof')
+    parser.add_argument('-window', default=None, type=int, help='also estimate the coefficients for every window of this many frames')
+    parser.add_argument('-profile', default=None, help='folder to save a json timing/memory profile of this run (or set DLCDLT_PROFILE)')
+
+    args = parser.parse_args()
+
+    profiling.enable(args.profile)
+    flipy = str(args.flipy).lower() not in ['false', '0']
+    cams = None if args.cams is None else [c - 1 for c in args.cams]
+    calibrate(args.xy, args.o, args.xyz, args.dlt, cams, args.prof, flipy, args.heights, args.window)
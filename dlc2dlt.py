@@ -8,6 +8,16 @@ That file can then be loaded into DLTdv* or Argus, along with the camera profile
 
 Argus and DLTdv* also contain 3d_reconstruct commands that can be called on the command line with the xypts file output here.
 
+With -jump and/or -gap, the 2D tracks are cleaned before they are written: single frame jumps faster than -jump pixels
+per frame are removed, and gaps of up to -gap frames (e.g. where the likelihood dipped under -like) are filled
+linearly, per camera. What was changed is saved in -xyflags.csv (1 = jump removed, 2 = filled, 3 = both).
+
+With -start and -end, only a window of DLT frames (0-indexed xypts rows, end not included) is converted, and only
+frames start + offset to end + offset are read from each camera's .h5. The files written are a trial of their own
+(row 0 is DLT frame start, and -offsets.csv has the offsets shifted by start so the rows still match the videos), or
+with -embed, full length files with NaN outside the window. If the full length files are already there (e.g. an
+earlier conversion, maybe corrected since), -embed only replaces the window's rows in them.
+
 With multi-animal projects, this will create SEPARATE dlt files for each individual, which can be combined in post-hoc analysis, or when/if I write a functions specifically to that.
 
 Author: Brandon E. Jackson, Ph.D.
@@ -15,24 +25,86 @@ email: jacksonbe3@longwood.edu
 Last edited: 23 Jan 2020
 """
 
+import sys
+import worker
+if __name__ == '__main__':
+    # hand the job to a running worker (worker.py serve) if there is one
+    code = worker.forward(__file__, sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
 import argparse
 import pandas as pd
 import numpy as np
 import cv2
 from pathlib import Path
 import re
-from deeplabcut.utils.auxiliaryfunctions import read_config
+import json
+from dlcio import read_config
+import dlcio
+import tools
+import profiling
+import sync
+import cache
 
 # TODO: read no. of individuals if multi, decide if 1 file per indiv., or multiple tracks in one file
 
-def dlc2dlt(config, opath, camlist, flipy, offsets, like, vid=None, videotype='.avi'):
-    config=Path(config)
-    opath = Path(opath)
-    offsets = [int(x) for x in offsets]
-    numcams = len(camlist)
+def dlc_to_array(camdata, scorer, tracks, like, ind=None, dtype='float64', with_like=False):
+    """
+    pulls the x, y coordinates of tracks out of a DLC dataframe as a (frames, tracks, 2) array of dtype
+    x, y values with likelihoods at or below like are set to nan
+    missing tracks come back as nan
+    with_like, also returns the (frames, tracks) likelihoods
+    """
+    prefix = (scorer,) if ind is None else (scorer, ind)
+    cols = pd.MultiIndex.from_tuples([prefix + (track, coord) for track in tracks for coord in ['x', 'y', 'likelihood']])
+    vals = camdata.reindex(columns=cols).values.astype(dtype).reshape((len(camdata), len(tracks), 3))
+    xy = vals[:, :, :2].copy()
+    xy[vals[:, :, 2] <= like] = np.nan
+    if with_like:
+        return xy, vals[:, :, 2].copy()
+    return xy
+
+
+def load_tracks(config, camlist, like, precision='float64', windows=None):
+    """
+    loads the DLC tracks of each camera, with x, y values at or below the likelihood threshold set to nan
+    windows is an optional (start, end) range of video frames for each camera (None for open ends), only those frames
+    are read and row 0 of that camera's arrays is then its frame start
+    returns alldata, a nested dict of (frames, tracks, 2) arrays (first key is cam, second is indiv, 0 if not
+    multianimal), the track names, whether the data are multianimal, the scorer of each camera, and likes, a nested
+    dict like alldata of (frames, tracks) likelihoods
+    the result is kept in the shared cache (see cache.py) until the config or the tracks change
+    """
+    try:
+        key = cache.make_key(cache.file_id(config), [cache.file_id(p) for p in camlist], like, precision, windows)
+    except OSError:
+        # let the loader report the missing file
+        return _load_tracks(config, camlist, like, precision, windows)
+
+    def load():
+        alldata, tracks, ma, scorers, likes = _load_tracks(config, camlist, like, precision, windows)
+        keys = [list(alldata[c].keys()) for c in range(len(camlist))]
+        arrays = {'meta': np.array(json.dumps({'tracks': tracks, 'ma': ma, 'scorers': scorers, 'keys': keys}))}
+        for c in range(len(camlist)):
+            for i, k in enumerate(keys[c]):
+                arrays['xy_{}_{}'.format(c, i)] = alldata[c][k]
+                arrays['like_{}_{}'.format(c, i)] = likes[c][k]
+        return arrays
+    arrays = cache.cached('tracks', key, load)
+    meta = json.loads(str(arrays['meta']))
+    alldata = {c: {k: arrays['xy_{}_{}'.format(c, i)] for i, k in enumerate(keys)} for c, keys in enumerate(meta['keys'])}
+    likes = {c: {k: arrays['like_{}_{}'.format(c, i)] for i, k in enumerate(keys)} for c, keys in enumerate(meta['keys'])}
+    return alldata, meta['tracks'], meta['ma'], meta['scorers'], likes
 
+
+def _load_tracks(config, camlist, like, precision='float64', windows=None):
+    """
+    load_tracks without the cache
+    """
     # load dlc config
-    cfg = read_config(config)
+    with profiling.stage('read_config'):
+        cfg = read_config(config)
     #scorer = cfg['scorer']
     ma = cfg['multianimalproject']
 
@@ -42,163 +114,199 @@ def dlc2dlt(config, opath, camlist, flipy, offsets, like, vid=None, videotype='.
         bodyparts = cfg['multianimalbodyparts']
     else:
         bodyparts=cfg['bodyparts']
-    coords = ['x', 'y']
     tracks=bodyparts
-    # alldata is a nested dict to contain numpy arrays until writing to csv
-    # first key is cam, second is indiv
+    # alldata is a nested dict to contain (frames, tracks, 2) numpy arrays until assembly
+    # first key is cam, second is indiv (0 if not multianimal)
     alldata = {}
+    likes = {}
+    camdatas = []
     numframes = []
     scorers=[]
-    # load each data file get some basic info and store data in a dict
-    for c in range(numcams):
-        #load the hd5
-        camdata = pd.read_hdf(camlist[c], 'df_with_missing')
+    # load all the hd5s, only the columns of the tracks (and individuals) used
+    with profiling.stage('read_hdf') as stg:
+        loaded = dlcio.read_all_tracks(camlist, windows=windows, bodyparts=bodyparts,
+                                       individuals=individuals if ma else None)
+        stg.items = sum(len(camdata) for camdata in loaded)
+    # get some basic info from each data file
+    for c, camdata in enumerate(loaded):
+        # allow different "scorer"s if different DLC models were used on each camera
         scorer=camdata.columns.get_level_values('scorer')[0]
         scorers.append(scorer)
-        #get track names from first camera
-        #if c== 0:
-            #tracks = camdata.columns.get_level_values('bodyparts')
-            #TODO: check if multianimal project based on "individual" in multi-index
-        # allow different "scorer"s if different DLC models were used on each camera
-        #scorer = camdata.columns.get_level_values('scorer')[0]
-        # re-index if h5 is training style - index is paths to images instead of all frame numbers
-        # if camdata.index.dtype != np.int64:
-        #     # it's DLT created or training data during testing, indexed by a path to a training image, which is numbered
-        #     new = [Path(x).stem for x in camdata.index]
-        #     camdata.index = [int(re.findall(r'\d+', s)[0]) for s in new]
-        #     # add Nans for all missing indexes from 0 to numframes
-        #     camdata = camdata.reindex(range(0, camdata.index.max() + 1))
-        #     digi = False
-        # else:
-            # set x,y values with likelihoods below like to nan
-            # for each point
-
-        if ma:
-            alldata[c]={}
-            try:
-                for ind in individuals:
-                    for track in set(tracks):
-                        camdata.loc[camdata[scorer][ind][track]['likelihood'] <= like, (scorer, ind, track, ['x', 'y'])] = np.nan
-                    alldata[c][ind]=camdata[scorer][ind]
-            except:
-                #it's possible in some workflows for config to show multianimal but the tracked data file to not have individuals
-                # so act as if single animal
-                ma=False
-                for track in set(tracks):
-                    camdata.loc[camdata[scorer][track]['likelihood'] <= like, (scorer, track, ['x', 'y'])] = np.nan
-                alldata[c] = camdata[scorer]
-        else:
-            for track in set(tracks):
-                camdata.loc[camdata[scorer][track]['likelihood'] <= like, (scorer, track, ['x', 'y'])] = np.nan
-            alldata[c] = camdata[scorer]
-
+        #it's possible in some workflows for config to show multianimal but the tracked data file to not have individuals
+        # so act as if single animal
+        if ma and 'individuals' not in camdata.columns.names:
+            ma = False
         # make a list to keep track of the number of frames in each camera's dataset
-        numframes.append(max(camdata.index.values) + 1)
+        first = 0 if windows is None or windows[c][0] is None else windows[c][0]
+        if windows is not None and windows[c][1] is not None:
+            last = windows[c][1]
+        else:
+            last = max(camdata.index.values) + 1 if len(camdata) else first
+        numframes.append(max(last - first, 0))
+        camdatas.append(camdata.reindex(range(first, first + numframes[c])))
 
-    # initialize the massive array full of nans (with more than enough rows)
-    blankarr = np.empty((max(numframes) - min(offsets), len(tracks) * 2 * numcams)) * np.nan
-    xcols = range(0, len(tracks) * 2 * numcams, 2)
-    ycols = range(1, len(tracks) * 2 * numcams, 2)
-    # outdata is a dict with first key = indiv (0 if not multianimal)
-    outdata={}
-    if ma:
-        for ind in individuals:
-            outdata[ind]=blankarr.copy()
-    else:
-        outdata[0] = blankarr.copy()
+    # set x,y values with likelihoods below like to nan, for all tracks at once
+    with profiling.stage('likelihood_filter', items=sum(numframes)):
+        for c, camdata in enumerate(camdatas):
+            keys = individuals if ma else [None]
+            pairs = [dlc_to_array(camdata, scorers[c], tracks, like, ind, precision, with_like=True) for ind in keys]
+            if not ma:
+                keys = [0]
+            alldata[c] = {k: p[0] for k, p in zip(keys, pairs)}
+            likes[c] = {k: p[1] for k, p in zip(keys, pairs)}
+    return alldata, tracks, ma, scorers, likes
 
-    # loop through each camera's data and assign to the proper row
-    for c, camdata in alldata.items():
 
-        # load each video, check for "height", and flip the y-coordinates (origin is lower left in Argus and DLTdv 1-7, upper left in openCV, DLC, DLTdv8)
-        if vid:
-            vidname = vid[c]
-        else:
-            vidname = camlist[c].rsplit(scorers[c])[0] + videotype
+def video_size(vidname):
+    """
+    height and width of a video, 0 if it can't be opened; kept in the shared cache (see cache.py)
+    """
+    def probe():
         cap = cv2.VideoCapture(str(vidname))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        if height==0 or width==0:
-            print(f"video file {vidname} not found, so video dimensions cannot be determined")
-        # make lists of rows, of matching length, that account for offsets (out = in - offset)
-        outrows = list(range(max([0, 0 - offsets[c]]), min([numframes[c], numframes[c] - offsets[c]]), 1))
-        inrows = list(range(max([0, 0 + offsets[c]]), min([numframes[c], numframes[c] + offsets[c]]), 1))
-        iter = 3
-        if ma:
-            for ind in individuals:
-                for i in range(len(tracks)):
-                    incol = i * iter
-                    outcol = (i * 2 * numcams) + (2 * c)
-                    if flipy:
-                        outdata[ind][outrows, outcol] = camdata[ind].iloc[inrows, incol]
-                        outdata[ind][outrows, outcol+1] = height - camdata[ind].iloc[inrows,incol+1]
-                    else:
-                        outdata[ind][outrows, outcol:outcol+2] = camdata[ind].iloc[inrows, incol:incol+2]
-                    # set out of range values to nan
-                    outdata[ind][outdata[ind] <= 0] = np.nan
-
-                    for xc in xcols:
-                        foo = outdata[ind][:, xc]
-                        foo[foo >= width] = np.nan
-                        outdata[ind][:, xc] = foo
-
-                    for yc in ycols:
-                        foo = outdata[ind][:, yc]
-                        foo[foo >= height] = np.nan
-                        outdata[ind][:, yc] = foo
+        size = [int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))]
+        cap.release()
+        return {'size': np.array(size)}
+    try:
+        key = cache.make_key(cache.file_id(vidname))
+    except OSError:
+        # no such video
+        return 0, 0
+    arrays = cache.get('video', key)
+    if arrays is None:
+        arrays = probe()
+        # videos that can't be read are tried again next time
+        if arrays['size'].all():
+            cache.put('video', key, arrays)
+    height, width = arrays['size']
+    return int(height), int(width)
+
+
+def video_sizes(camlist, scorers, vid=None, videotype='.avi'):
+    """
+    heights and widths of each camera's video, 0 if the video can't be opened
+    """
+    # load each video, check for "height" to flip the y-coordinates (origin is lower left in Argus and DLTdv 1-7, upper left in openCV, DLC, DLTdv8)
+    heights = []
+    widths = []
+    with profiling.stage('video_probe', items=len(camlist)):
+        for c in range(len(camlist)):
+            if vid:
+                vidname = vid[c]
+            else:
+                vidname = camlist[c].rsplit(scorers[c])[0] + videotype
+            height, width = video_size(vidname)
+            if height==0 or width==0:
+                print(f"video file {vidname} not found, so video dimensions cannot be determined")
+            heights.append(height)
+            widths.append(width)
+    return np.array(heights), np.array(widths)
+
+
+@profiling.profiled('dlc2dlt')
+def dlc2dlt(config, opath, camlist, flipy, offsets, like, vid=None, videotype='.avi', precision='float64',
+            dltpath=None, profpath=None, longpath=None, weighted=False, maxgap=0, maxjump=None, start=None, end=None,
+            embed=False):
+    """
+    converts the DLC tracks of each camera (camlist) to DLT xypts files, see the module docstring
+    opath is the prefix of the files written, None to write nothing; dltpath is the path to the dlt coefficients or a
+    tools.Calibration (with its own profile, profpath is then not used)
+    returns the tools.Points2D of each individual, and with dltpath their tools.Points3D (None without), as dicts
+    keyed by individual (0 if not multianimal)
+    """
+    config=Path(config)
+    opath = None if opath is None else Path(opath)
+    numcams = len(camlist)
 
+    windows = None
+    if start is not None or end is not None:
+        # only the frames of the window are read from each camera, which needs the offsets up front
+        if offsets is None or list(offsets) == ['auto']:
+            raise ValueError('a frame window (start, end) needs the offsets, estimate them first with sync.py')
+        start = int(start or 0)
+        windows = [(start + int(o), None if end is None else int(end) + int(o)) for o in offsets]
+
+    alldata, tracks, ma, scorers, likes = load_tracks(config, camlist, like, precision, windows)
+    numframes = [len(alldata[c][next(iter(alldata[c]))]) for c in range(numcams)]
+    heights, widths = video_sizes(camlist, scorers, vid, videotype)
+    calib = None if dltpath is None else tools.as_calibration(dltpath, profpath)
+    if offsets is None or list(offsets) == ['auto']:
+        # estimate them from the tracks, which needs the dlt coefficients
+        if calib is None:
+            raise ValueError('offsets can only be estimated (offsets auto) when dlt coefficients are given')
+        offsets, _ = sync.estimate_from_tracks(alldata, calib, heights if flipy else None)
+        print('estimated offsets:', ' '.join(str(o) for o in offsets))
+    offsets = [int(x) for x in offsets]
+
+    # outdata is a dict with first key = indiv (0 if not multianimal)
+    # each entry is built as a sparse table of the points that passed the likelihood filter, offsets and flips are
+    # applied to all cameras at once (out row = in row - offset), and the dense xypts array is only made to write it
+    nrows = max(numframes) - min(offsets)
+    shifts = offsets
+    # with embed, the rows of the full length files that the window covers
+    rows = None
+    if windows is not None:
+        # the cameras' windows are already lined up, row 0 is DLT row start
+        nrows = max(numframes) if end is None else int(end) - start
+        shifts = [0] * numcams
+        if embed:
+            # back into the full length trial
+            rows = np.arange(start, start + nrows)
+            nrows = max(dlcio.read_frames(p).max() + 1 for p in camlist) - min(offsets)
+            rows = rows[rows < nrows]
+            shifts = [-start] * numcams
         else:
-            for i in range(len(tracks)):
-                incol = i * iter
-                outcol = (i * 2 * numcams) + (2 * c)
-                if flipy:
-                    outdata[0][outrows, outcol] = camdata.iloc[inrows, incol]
-                    outdata[0][outrows, outcol+1] = height - camdata.iloc[inrows, incol+1]
-                else:
-                    outdata[0][outrows, outcol:outcol+2] = camdata.iloc[inrows, incol:incol+2]
-
-    #TODO: set up for multi animal
-    #tracknames = tracks[0:-1:3]
-    # make col names (same for all files)
-    xycols = ['{}_cam_{}_{}'.format(x, c, d) for x in tracks for c in range(1,numcams+1) for d in ['x', 'y']]
-    if ma:
-        # make separate files for each indiv
-        for i, ind in enumerate(individuals):
-            basename = str(opath) + '_' + str(ind) + '-'
-            xydf = pd.DataFrame(outdata[ind], columns=xycols, index=range(len(outdata[ind])))
-            # write to CSV
-            xydf.to_csv((basename + 'xypts.csv'), na_rep="NaN", index=False)
-            #make "dummy" files
-            xyzcols = ['{}_{}'.format(x, d) for x in tracks for d in ['x', 'y', 'z']]
-            xyzdf = pd.DataFrame(np.nan, columns=xyzcols, index=range(len(outdata[ind])))
-            xyzdf.to_csv((basename + 'xyzpts.csv'), na_rep='NaN', index=False)
-
-            residdf = pd.DataFrame(np.nan, columns=tracks, index=range(len(outdata[ind])))
-            residdf.to_csv((basename + 'xyzres.csv'), na_rep='NaN', index=False)
-
-            offcols = ['camera_{}'.format(cnum) for cnum in range(1, numcams + 1)]
-            offdf = pd.DataFrame(0, columns=offcols, index=range(len(outdata[ind])))
-            offdf.iloc[0] = offsets
-            offdf.to_csv((basename + 'offsets.csv'), na_rep='NaN', index=False)
+            # a trial of its own, whose first row is video frame start + offset
+            offsets = [o + start for o in offsets]
+    # the points of each individual
+    outdata={}
+    with profiling.stage('assemble', items=nrows):
+        for key in alldata[0].keys():
+            obs = tools.Observations.from_cameras([alldata[c][key] for c in range(numcams)],
+                                                  [likes[c][key] for c in range(numcams)])
+            obs = obs.shift_frames(shifts, nrows=nrows)
+            if flipy:
+                obs = obs.flip_y(heights)
+            if ma:
+                # set out of range values to nan, for cameras with known dimensions
+                obs.uv[obs.uv <= 0] = np.nan
+                known = (heights > 0) & (widths > 0)
+                limits = np.stack([widths, heights], axis=-1)
+                obs.uv[(obs.uv >= limits[obs.cam]) & known[obs.cam, None]] = np.nan
+            flags = None
+            if maxgap or maxjump is not None:
+                # on the dense array, all tracks and cameras at once
+                with profiling.stage('clean_2d', items=nrows):
+                    arr, lk, flags = tools.clean_tracks(obs.to_array(), obs.like_array(), maxgap, maxjump)
+                    obs = tools.Observations.from_array(arr, like=lk)
+            outdata[key] = tools.Points2D(obs.select(np.isfinite(obs.uv).all(axis=1)), tracks, offsets, flags)
 
-    else:
-        ind=0
-        basename = str(opath) + '-'
-        xydf = pd.DataFrame(outdata[ind], columns=xycols, index=range(len(outdata[ind])))
-        # write to CSV
-        xydf.to_csv((basename + 'xypts.csv'), na_rep="NaN", index=False)
-        # make "dummy" files
-        xyzcols = ['{}_{}'.format(x, d) for x in tracks for d in ['x', 'y', 'z']]
-        xyzdf = pd.DataFrame(np.nan, columns=xyzcols, index=range(len(outdata[ind])))
-        xyzdf.to_csv((basename + 'xyzpts.csv'), na_rep='NaN', index=False)
-
-        residdf = pd.DataFrame(np.nan, columns=tracks, index=range(len(outdata[ind])))
-        residdf.to_csv((basename + 'xyzres.csv'), na_rep='NaN', index=False)
-
-        offcols = ['camera_{}'.format(cnum) for cnum in range(1, numcams + 1)]
-        offdf = pd.DataFrame(0, columns=offcols, index=range(len(outdata[ind])))
-        offdf.iloc[0] = offsets
-        offdf.to_csv((basename + 'offsets.csv'), na_rep='NaN', index=False)
+    # separate files for each indiv
+    basenames = {key: str(opath) + ('_' + str(key) + '-' if ma else '-') for key in outdata} if opath else {}
+    with profiling.stage('write_csv', items=len(basenames)):
+        for key, basename in basenames.items():
+            if rows is None:
+                outdata[key].write(basename)
+            else:
+                # into an existing (maybe corrected) trial, only the window's rows are replaced
+                outdata[key].embed(basename, rows)
+
+    xyzdata = None
+    if calib is not None:
+        # all individuals in one pass, replacing the empty xyzpts and xyzres files
+        keys = list(outdata.keys())
+        dlt = calib.coefficients(flipy, heights if flipy else None)
+        results = tools.triangulate_individuals([outdata[k].obs for k in keys], dlt, calib.prof, flipy, heights,
+                                                weighted)
+        xyzdata = {key: tools.Points3D(xyz, errs, tracks) for key, (xyz, errs) in zip(keys, results)}
+        for key, basename in basenames.items():
+            if rows is None:
+                xyzdata[key].write(basename)
+            else:
+                tools.embed_xyz(basename, nrows, rows, xyzdata[key].xyz[rows], xyzdata[key].errs[rows], tracks)
+        if longpath is not None:
+            names = keys if ma else [opath.name if opath else 'trial']
+            tools.long_table(results, names, [tracks] * len(keys)).to_csv(longpath, index=False, na_rep='NaN')
+    return outdata, xyzdata
 
     # # convert to dataframe
     # xydf = pd.DataFrame(arr, columns = xycols, index = range(len(arr)))
@@ -226,11 +334,24 @@ if __name__== '__main__':
     parser.add_argument('-dlctracks', nargs='+', help='input paths of DLC tracked coordinates (hd5) in order used in DLT calibration, each path separated by a space')
     parser.add_argument('-newpath', type=str, help = 'enter a path for saving, will overwrite if it already exists, should not be in DLC project folder, should end with filename prefix')
     parser.add_argument('-flipy', default=True, help = 'flip y coordinates - necessar for Argus and DLTdv versions 1-7, set to False for DLTdv8')
-    parser.add_argument('-offsets', nargs='+', default = None, help='enter offsets as space separated list including first camera e.g.: -offsets 0 -12 2')
+    parser.add_argument('-offsets', nargs='+', default = None, help='enter offsets as space separated list including first camera e.g.: -offsets 0 -12 2, or -offsets auto to estimate them (needs -dlt, see sync.py)')
     parser.add_argument('-like', default=0.9, help='enter the likelihood threshold - defaults to 0.9')
     parser.add_argument('-vid', default = None, nargs='+', help='path to video if it is not located with the data file')
+    parser.add_argument('-dlt', default=None, help='path to dlt coefficients, to also triangulate (all individuals in one pass) and fill the xyzpts and xyzres files')
+    parser.add_argument('-prof', default=None, help='path to camera profile file, for undistortion with -dlt')
+    parser.add_argument('-weighted', action='store_true', help='with -dlt, weight each camera by its DLC likelihood when triangulating')
+    parser.add_argument('-long', default=None, help='with -dlt, also save all individuals and tracks as one long format csv at this path')
+    parser.add_argument('-gap', default=0, type=int, help='fill gaps of up to this many frames in each camera\'s tracks, default = 0 (none)')
+    parser.add_argument('-jump', default=None, type=float, help='remove single frame jumps faster than this (pixels per frame), off by default')
+    parser.add_argument('-start', default=None, type=int, help='first DLT frame (0-indexed xypts row) to convert, only frames start + offset onwards are read from each camera')
+    parser.add_argument('-end', default=None, type=int, help='DLT frame to stop at (not included), default: the end of the tracks')
+    parser.add_argument('-embed', action='store_true', help='with -start/-end, write full length files (NaN outside the window, or just the window rows of existing ones) instead of files of just the window, whose offsets are then shifted by -start')
+    parser.add_argument('-precision', default='float64', choices=['float64', 'float32'], help='precision of the coordinates in memory and in the xypts file, float32 halves memory use')
+    parser.add_argument('-profile', default=None, help='folder to save a json timing/memory profile of this run (or set DLCDLT_PROFILE)')
 
     args = parser.parse_args()
 
-    
-    dlc2dlt(args.config, args.newpath, args.dlctracks, args.flipy, args.offsets, float(args.like), args.vid)
+    profiling.enable(args.profile)
+    dlc2dlt(args.config, args.newpath, args.dlctracks, args.flipy, args.offsets, float(args.like), args.vid, precision=args.precision,
+            dltpath=args.dlt, profpath=args.prof, longpath=args.long, weighted=args.weighted,
+            maxgap=args.gap, maxjump=args.jump, start=args.start, end=args.end, embed=args.embed)
@@ -0,0 +1,160 @@
+"""
+Lightweight readers for DeepLabCut project files, so the conversion tools don't have to import deeplabcut
+(and with it TensorFlow/PyTorch) just to parse a config.yaml or tidy up a CollectedData index.
+
+These follow the DLC conventions:
+read_config - parses config.yaml, project_path is taken from where the config file actually is (DLC does the same when
+              a project has been moved)
+guarantee_multiindex_rows - turns 'labeled-data/video/img0001.png' row names into ('labeled-data', 'video', 'img0001.png')
+read_tracks - loads a DLC .h5 (tracks or CollectedData), optionally only some bodyparts, individuals and frames
+read_all_tracks - read_tracks of each camera's file
+read_frames - the frame numbers in a DLC .h5, without loading the data
+
+deeplabcut itself is only imported if no yaml parser is available.
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+DLC_KEY = 'df_with_missing'
+
+
+def read_config(configname):
+    """
+    reads a DLC project config.yaml into a dict
+    """
+    configname = Path(configname)
+    if not configname.exists():
+        raise FileNotFoundError('Config file {} not found'.format(configname))
+    try:
+        import yaml
+        with open(configname, 'r') as f:
+            cfg = yaml.safe_load(f)
+    except ImportError:
+        try:
+            from ruamel.yaml import YAML
+            with open(configname, 'r') as f:
+                cfg = YAML(typ='safe', pure=True).load(f)
+        except ImportError:
+            # last resort, let deeplabcut do it
+            from deeplabcut.utils.auxiliaryfunctions import read_config as dlc_read_config
+            return dlc_read_config(configname)
+    # older single animal projects don't have this key
+    cfg.setdefault('multianimalproject', False)
+    # DLC uses the current location of the config as the project path
+    if 'project_path' in cfg:
+        cfg['project_path'] = str(configname.parent)
+    return cfg
+
+
+def guarantee_multiindex_rows(df):
+    """
+    makes the row index of a CollectedData dataframe a MultiIndex of path parts (in place), as DLC >= 2.2 expects
+    numerically indexed (analyzed tracks) dataframes are left alone
+    """
+    if not isinstance(df.index, pd.MultiIndex):
+        path = df.index[0]
+        try:
+            sep = '/' if '/' in path else '\\'
+            splits = tuple(df.index.str.split(sep))
+            df.index = pd.MultiIndex.from_tuples(splits)
+        except TypeError:
+            # frame numbers, nothing to do
+            pass
+    # make sure folder names are strings
+    try:
+        df.index = df.index.set_levels(df.index.levels[1].astype(str), level=1)
+    except (AttributeError, IndexError):
+        pass
+
+
+def track_columns(columns, bodyparts=None, individuals=None):
+    """
+    the columns of a DLC dataframe that belong to bodyparts and individuals (None for all)
+    """
+    keep = np.ones(len(columns), dtype=bool)
+    if bodyparts is not None and 'bodyparts' in columns.names:
+        keep &= columns.get_level_values('bodyparts').isin(bodyparts)
+    if individuals is not None and 'individuals' in columns.names:
+        keep &= columns.get_level_values('individuals').isin(individuals)
+    return columns[keep]
+
+
+def _frame_mask(frames, start, end):
+    """
+    start <= frames < end, None for open ends
+    """
+    keep = np.ones(len(frames), dtype=bool)
+    if start is not None:
+        keep &= frames >= start
+    if end is not None:
+        keep &= frames < end
+    return keep
+
+
+def read_frames(path):
+    """
+    the frame numbers (row index) of a DLC tracks .h5 file, only the index is read from table format files
+    """
+    with pd.HDFStore(path, 'r') as store:
+        if store.get_storer(DLC_KEY).is_table:
+            return store.select_column(DLC_KEY, 'index').values
+        return store.select(DLC_KEY).index.values
+
+
+def read_tracks(path, bodyparts=None, individuals=None, start=None, end=None, chunk=20000):
+    """
+    loads a DLC .h5 file (analyzed tracks or CollectedData)
+    keeps only the columns of bodyparts and individuals (None for all), and for tracks only frames start <= frame < end
+    table format files (as DLC writes them) are read a chunk of rows at a time, only the rows of the frames (found
+    from the frame numbers alone) and keeping only the columns, so the whole file is never held in memory; fixed
+    format files are read whole and then cut down
+    """
+    with pd.HDFStore(path, 'r') as store:
+        if not store.get_storer(DLC_KEY).is_table:
+            df = store.select(DLC_KEY)
+            df = df[track_columns(df.columns, bodyparts, individuals)]
+            if start is not None or end is not None:
+                df = df[_frame_mask(df.index.values, start, end)]
+            return df
+        empty = store.select(DLC_KEY, start=0, stop=0)
+        cols = track_columns(empty.columns, bodyparts, individuals)
+        nrows = store.get_storer(DLC_KEY).nrows
+        first, last = 0, nrows
+        rows = None
+        if start is not None or end is not None:
+            frames = store.select_column(DLC_KEY, 'index').values
+            if (np.diff(frames) > 0).all():
+                first, last = np.searchsorted(frames, [-np.inf if start is None else start,
+                                                       np.inf if end is None else end])
+            else:
+                rows = np.flatnonzero(_frame_mask(frames, start, end))
+        if len(cols) == len(empty.columns):
+            # nothing to leave out, read the rows at once
+            pick = lambda part: part
+            chunk = max(nrows, 1)
+        else:
+            pick = lambda part: part[cols]
+        if rows is not None:
+            parts = [pick(store.select(DLC_KEY, where=rows[i:i + chunk])) for i in range(0, len(rows), chunk)]
+        else:
+            parts = [pick(store.select(DLC_KEY, start=i, stop=min(i + chunk, last))) for i in range(first, last, chunk)]
+    if not parts:
+        return empty[cols]
+    return pd.concat(parts) if len(parts) > 1 else parts[0]
+
+
+def read_all_tracks(paths, windows=None, **selection):
+    """
+    read_tracks of each of paths (e.g. one per camera), with the same selection (see read_tracks) for all, and
+    optionally a (start, end) frame window for each path
+    returns the dataframes in the order of paths
+    the files are read one after the other: pandas and PyTables aren't thread safe, and reading only the columns used
+    is quick enough (0.1 s for 4 cameras of 100000 frames) that a process pool costs more than it saves
+    """
+    windows = windows or [(None, None)] * len(paths)
+    return [read_tracks(p, start=w[0], end=w[1], **selection) for p, w in zip(paths, windows)]
@@ -10,6 +10,9 @@ After running, you can open the labeling GUI in deeplabcut to check, edit, and a
 
 VERY IMPORTANT: Argus/DLTdv track names must exactly match DLC bodyparts (in config) for this to work. You can edit config or the xypts.csv file header to make them match if you need.
 
+With -start and -end, only that window of DLT frames is read from the xypts file, images of video frames outside
+start + offset to end + offset are left as they are.
+
 If you go back to Argus/DLTdv and digitize new frames/points, you have two options
 1. delete the Collected_Data_...h5 file in labeled-data/camerafolder to fully reimport. This is your only option if you "correct" points in Argus/DLT
 2. If you are adding frames/points from DLT, but already made corrections in the label frames GUI in DLC, add -addbp to the command line call
@@ -20,6 +23,14 @@ email: jacksonbe3@longwood.edu
 Last edited: 15 June 2022
 """
 
+import sys
+import worker
+if __name__ == '__main__':
+    # hand the job to a running worker (worker.py serve) if there is one
+    code = worker.forward(__file__, sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
 import argparse
 import pandas as pd
 import numpy as np
@@ -27,14 +38,18 @@ from pathlib import Path
 import os
 import re
 import warnings
-from deeplabcut.utils.auxiliaryfunctions import read_config
-from deeplabcut.utils import conversioncode
+from dlcio import read_config
+import dlcio
+import tools
+import profiling
 
 warnings.filterwarnings('ignore', category=pd.io.pytables.PerformanceWarning)
 
 # TODO: set up to call deeplabcut functions for "add video" and "extract frames", including manually passing a set of frame numbers
 
-def dlt2dlclabels(config, xyfname, vid, cnum, offset, flipy=True, ind=0, addbp=False, cleanup=False):
+@profiling.profiled('dlt2dlclabels')
+def dlt2dlclabels(config, xyfname, vid, cnum, offset, flipy=True, ind=0, addbp=False, cleanup=False, precision='float64',
+                  start=None, end=None):
     # make paths into Paths
     config=Path(config)
     xyfname=Path(xyfname)
@@ -42,7 +57,8 @@ def dlt2dlclabels(config, xyfname, vid, cnum, offset, flipy=True, ind=0, addbp=F
     camname=vid.stem
 
     #load dlc config
-    cfg = read_config(config)
+    with profiling.stage('read_config'):
+        cfg = read_config(config)
     labdir = Path(cfg['project_path']) / 'labeled-data' / camname
     scorer = cfg['scorer']
     ma = cfg['multianimalproject']
@@ -54,9 +70,11 @@ def dlt2dlclabels(config, xyfname, vid, cnum, offset, flipy=True, ind=0, addbp=F
         bodyparts=cfg['bodyparts']
     coords = ['x', 'y']
 
-    # load xypts file to dataframe
-    xypts = pd.read_csv(xyfname)
-    xypts = xypts.astype('float64')
+    # load xypts file to dataframe, only the rows of the window if there is one
+    with profiling.stage('read_xypts') as stg:
+        xypts = tools.read_xypts(xyfname, start, end)
+        xypts = xypts.astype(precision)
+        stg.items = len(xypts)
     # make all columns lowercase for argus DLT compatibility
     xypts.columns = [c.lower() for c in xypts.columns]
     # just get the columns for this camera
@@ -119,89 +137,79 @@ def dlt2dlclabels(config, xyfname, vid, cnum, offset, flipy=True, ind=0, addbp=F
         df.sort_index(inplace=True)
         addbp = True
     
-    conversioncode.guarantee_multiindex_rows(df)
+    dlcio.guarantee_multiindex_rows(df)
     df.sort_index(inplace=True)
 
-    if offset < 0:
-        # the DLT digitized value on the n-th row of the csv was actually digitized at n+offset frame of video file
-        # e.g. if offset = -5, a point digitized in the first frame of the video will be placed
-        # on the 5th row of the xypts csv file, so negative offsets mean that many blank rows
-        # need to be removed from the front of the df
-        print('dropping offset')
-        xypts.drop(range(-1 * offset), inplace=True)
-        xypts.reset_index(drop=True, inplace=True)
-
-    if offset > 0:
-        # need to insert blank rows at the start
-        _ = pd.DataFrame(np.nan, index=range(offset), columns=xypts.columns)
-        xypts = pd.concat([_, xypts], ignore_index=True)
-        # remove that many rows from the end of the df
-        xypts.drop(range(len(xypts) - offset, len(xypts)), inplace=True)
-        # and then reindex
-
-
+    # the DLT digitized value on the n-th row of the csv was actually digitized at n+offset frame of video file
+    # so index the rows by video frame numbers, and flip the y-coordinates
+    # (origin is lower left in Argus and DLTdv 1-7, upper left in openCV, DLC, DLTdv8)
+    heights = None
     if flipy is True:
         print('flipping')
         # get the vertical resolution from cropped parameter in config
-        height = int(cfg['video_sets'][str(vid)]['crop'].split(',')[3])
-        # flip the y-coordinates (origin is lower left in Argus and DLTdv 1-7, upper left in openCV, DLC, DLTdv8)
-        ycols = [x for x in xypts.columns if '_y' in x]
-        xypts.loc[:, ycols] = height - xypts.loc[:, ycols]
-
+        heights = [int(cfg['video_sets'][str(vid)]['crop'].split(',')[3])]
+    with profiling.stage('transform', items=len(xypts)):
+        arr = tools.xypts_to_array(xypts.values, 1)
+        arr = tools.transform_coords(arr, heights=heights, inverse=True)
+        xypts = pd.DataFrame(tools.array_to_xypts(arr), columns=xypts.columns, index=xypts.index + offset)
 
     print(bodyparts)
     # make if option flag is thrown, it checks if any bodypart x/y is empty, might be a touch slower for large data frames,
     #but allows more control over overwriting existing labels
-    if addbp:
-        newbp=[]
-        indx=[]
-        for bp in bodyparts:
-            #isolate the bodypart
-            if ma:
-                _ = df.loc[:, (scorer, indiv, bp)]
-            else:
-                _ = df.loc[:, (scorer, bp)]
-            #find empty rows
-            r = _.index[_.isnull().all(1)]
-            #if there are empty rows for that bp
-            if len(r) > 0:
-                # add to list of places to fill
-                newbp.extend([bp] * len(r))
-                indx.extend(r)
-        news = list(zip(indx, newbp))
-        for new in news:
-            xyrow = int(re.findall(r'img(\d+)\.png', new[0][2])[0])
-            bp = new[1]
-            try:
+    with profiling.stage('fill_labels', items=len(df)):
+        if addbp:
+            newbp=[]
+            indx=[]
+            for bp in bodyparts:
+                #isolate the bodypart
                 if ma:
-                    df.loc[new[0], (scorer, indiv, bp, ['x', 'y'])] = xypts.loc[
-                        xyrow, ['{}_{}x'.format(bp, camstr), '{}_{}y'.format(bp, camstr)]].values
+                    _ = df.loc[:, (scorer, indiv, bp)]
                 else:
-                    df.loc[new[0], (scorer, bp, ['x', 'y'])] = xypts.loc[
-                        xyrow, ['{}_{}x'.format(bp, camstr), '{}_{}y'.format(bp, camstr)]].values
-            except:
-                #image or xypts row not found due to offsets deletions
-                continue
-    else:
-        # go through df find indexes without any entries, extract those entries from xydata, and add
-        news = df.index[df.isnull().all(1)]
-        # go through news and get insert digitized points from xydata
-        for new in news:
-            for bp in bodyparts:
-                xyrow = int(re.findall(r'img(\d+)\.png', new[2])[0])
+                    _ = df.loc[:, (scorer, bp)]
+                #find empty rows
+                r = _.index[_.isnull().all(1)]
+                #if there are empty rows for that bp
+                if len(r) > 0:
+                    # add to list of places to fill
+                    newbp.extend([bp] * len(r))
+                    indx.extend(r)
+            news = list(zip(indx, newbp))
+            for new in news:
+                xyrow = int(re.findall(r'img(\d+)\.png', new[0][2])[0])
+                bp = new[1]
                 try:
                     if ma:
-                        df.loc[new, (scorer, indiv, bp, ['x', 'y'])] = xypts.loc[
+                        df.loc[new[0], (scorer, indiv, bp, ['x', 'y'])] = xypts.loc[
                             xyrow, ['{}_{}x'.format(bp, camstr), '{}_{}y'.format(bp, camstr)]].values
                     else:
-                        df.loc[new, (scorer, bp, ['x', 'y'])] = xypts.loc[
+                        df.loc[new[0], (scorer, bp, ['x', 'y'])] = xypts.loc[
                             xyrow, ['{}_{}x'.format(bp, camstr), '{}_{}y'.format(bp, camstr)]].values
                 except:
-                    # image or xypts row not found due to offsets deletions
+                    #image or xypts row not found due to offsets deletions
                     continue
+        else:
+            # go through df find indexes without any entries, extract those entries from xydata, and add
+            news = df.index[df.isnull().all(1)]
+            # go through news and get insert digitized points from xydata
+            for new in news:
+                for bp in bodyparts:
+                    xyrow = int(re.findall(r'img(\d+)\.png', new[2])[0])
+                    try:
+                        if ma:
+                            df.loc[new, (scorer, indiv, bp, ['x', 'y'])] = xypts.loc[
+                                xyrow, ['{}_{}x'.format(bp, camstr), '{}_{}y'.format(bp, camstr)]].values
+                        else:
+                            df.loc[new, (scorer, bp, ['x', 'y'])] = xypts.loc[
+                                xyrow, ['{}_{}x'.format(bp, camstr), '{}_{}y'.format(bp, camstr)]].values
+                    except:
+                        # image or xypts row not found due to offsets deletions
+                        continue
     if cleanup:
         # clean out rows and images with no annotation data
         blanks = df.index[df.isnull().all(1)]
+        if start is not None or end is not None:
+            # images outside the window weren't looked at
+            blanks = [b for b in blanks if int(re.findall(r'img(\d+)\.png', b[2])[0]) in xypts.index]
         df = df.drop(blanks)
         blankimgs = [labdir / Path(x[2].split(os.sep)[-1]) for x in list(blanks)]
         for bl in blankimgs:
@@ -214,8 +222,9 @@ def dlt2dlclabels(config, xyfname, vid, cnum, offset, flipy=True, ind=0, addbp=F
     df.sort_index(inplace=True)
 
     # # save out hdf and csv files
-    df.to_hdf(Path(labdir) / ('CollectedData_' + scorer + '.h5'), 'df_with_missing')#, format='table', mode='w')
-    df.to_csv(Path(labdir) / ('CollectedData_' + scorer + '.csv'))
+    with profiling.stage('write', items=len(df)):
+        df.to_hdf(Path(labdir) / ('CollectedData_' + scorer + '.h5'), 'df_with_missing')#, format='table', mode='w')
+        df.to_csv(Path(labdir) / ('CollectedData_' + scorer + '.csv'))
 
 
 if __name__ == '__main__':
@@ -232,9 +241,14 @@ if __name__ == '__main__':
     parser.add_argument('-ind', default=0, type=int, help='enter 0-indexed individual number from config file. \n xypts.csv must have only one indiv digitized.')
     parser.add_argument('-addbp', default=False, help='if new tracks/bodyparts were digitized in Argus/DLTdv, add this flag to add those to labeled data')
     parser.add_argument('-cleanup', default=False, help='if true, this will delete images and table rows for which no annotations exist in DLT or DLC data - use with caution')
+    parser.add_argument('-start', default=None, type=int, help='first DLT frame (0-indexed xypts row) to take labels from, default: the first')
+    parser.add_argument('-end', default=None, type=int, help='DLT frame to stop at (not included), default: the end of the xypts file')
+    parser.add_argument('-precision', default='float64', choices=['float64', 'float32'], help='precision of the xypts coordinates in memory, float32 halves memory use')
+    parser.add_argument('-profile', default=None, help='folder to save a json timing/memory profile of this run (or set DLCDLT_PROFILE)')
 
 
     args = parser.parse_args()
 
-    dlt2dlclabels(args.config, args.xy, args.vid, args.cnum, int(args.offset), flipy=args.flipy, ind=args.ind, addbp=args.addbp, cleanup=args.cleanup)
+    profiling.enable(args.profile)
+    dlt2dlclabels(args.config, args.xy, args.vid, args.cnum, int(args.offset), flipy=args.flipy, ind=args.ind, addbp=args.addbp, cleanup=args.cleanup, precision=args.precision, start=args.start, end=args.end)
 
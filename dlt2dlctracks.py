@@ -3,6 +3,7 @@ This function takes DLT digitized data and creates full DLC tracks, allowing Arg
 It works on a single camera at a time, and is currently only functioning with single animal projects
 
 If the DLC tracks file exists, it will compare the data in the two files. Any points in the DLT data that are different (assumed to be corrected) will be assigned a likelihood of 1.0
+With -start and -end, only that window of frames is read from the xypts file and compared, the rest of the DLC tracks are written back as they were
 This is written to only work with deeplabcut multianimal projects (even if only one individual animal)
 
 Author: Brandon E. Jackson, Ph.D.
@@ -10,6 +11,14 @@ email: jacksonbe3@longwood.edu
 Last edited: 8 Jan 2022
 """
 
+import sys
+import worker
+if __name__ == '__main__':
+    # hand the job to a running worker (worker.py serve) if there is one
+    code = worker.forward(__file__, sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+
 import argparse
 import pandas as pd
 import numpy as np
@@ -18,12 +27,16 @@ import os
 import re
 import warnings
 import cv2
-from deeplabcut.utils.auxiliaryfunctions import read_config
+from dlcio import read_config
+import dlcio
+import tools
+import profiling
 
 warnings.filterwarnings('ignore', category=pd.io.pytables.PerformanceWarning)
 
 
-def dlt2dlctracks(config, xyfname, dlcxy, vid, flipy=True, ind=0):
+@profiling.profiled('dlt2dlctracks')
+def dlt2dlctracks(config, xyfname, dlcxy, vid, flipy=True, ind=0, precision='float64', start=None, end=None):
     # make paths into Paths
     config=Path(config)
     xyfname=Path(xyfname)
@@ -32,7 +45,8 @@ def dlt2dlctracks(config, xyfname, dlcxy, vid, flipy=True, ind=0):
     camname=vid.stem
 
     #load dlc config
-    cfg = read_config(config)
+    with profiling.stage('read_config'):
+        cfg = read_config(config)
     ma = cfg['multianimalproject']
     if ma:
         individuals = cfg['individuals']
@@ -42,60 +56,73 @@ def dlt2dlctracks(config, xyfname, dlcxy, vid, flipy=True, ind=0):
         bodyparts=cfg['bodyparts']
     coords = ['x', 'y']
 
- # load xypts file to dataframe
-    xypts = pd.read_csv(xyfname)
-    xypts = xypts.astype('float64')
+    # load xypts file to dataframe, only the rows of the window if there is one
+    with profiling.stage('read_xypts') as stg:
+        xypts = tools.read_xypts(xyfname, start, end)
+        xypts = xypts.astype(precision)
+        stg.items = len(xypts)
     newcols = {}
     # store track name and column index - start of tracks - in dict
     for i in range(0, len(xypts.columns), 2):
         newcol = xypts.columns[i].split('_')[0]
         newcols[newcol]=i
     print(str(vid))
-    cap = cv2.VideoCapture(str(vid))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    with profiling.stage('video_probe', items=1):
+        cap = cv2.VideoCapture(str(vid))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        cap.release()
     print(f"height: {height}, width: {width}")
     if not height > 0:
         print("no video file found, so video dimensions cannot be determined")
         return
     if flipy is True:
         # flip the y-coordinates (origin is lower left in Argus and DLTdv 1-7, upper left in openCV, DLC, DLTdv8)
-        ycols = [x for x in xypts.columns if '_y' in x]
-        xypts.loc[:, ycols] = height - xypts.loc[:, ycols]
+        arr = tools.flip_y(tools.xypts_to_array(xypts.values, 1), [height])
+        xypts = pd.DataFrame(tools.array_to_xypts(arr), columns=xypts.columns, index=xypts.index)
 
     # load dlc tracks
-    dlcpts = pd.read_hdf(dlcxyfname, 'df_with_missing')
-    dlcpts = dlcpts.astype('float64')
+    with profiling.stage('read_hdf') as stg:
+        dlcorig = dlcio.read_tracks(dlcxyfname)
+        dlcpts = dlcorig.astype(precision)
+        stg.items = len(dlcpts)
     scorer = dlcpts.columns.get_level_values('scorer')[0]
+    # only the frames of the xypts rows read are compared (all of them without a window)
+    rows = xypts.index.intersection(dlcpts.index)
+    xypts = xypts.loc[rows]
     # convert the DLT data into a dataframe matching index and header as the DLC data (actually copy the data to keep the likelihood values, coordinates will be overwritten)
-    dltpts = dlcpts.copy()
-    for bp in bodyparts:
-        xy = xypts.loc[:,[f'{bp}_cam_1_x', f'{bp}_cam_1_y']].values
-        # reality check
-        #dltpts.loc[~np.isfinite(xy[(scorer, bp, 'x')]) | ~np.isfinite(xy[(scorer, bp, 'y')]),
-        #if a point as been deleted in DLT
-        dltpts.loc[~np.isfinite(xy[:,0]), (scorer, bp, ['x', 'y', 'likelihood'])] = np.nan, np.nan, 0.0
-        # if a point's x coordiantes are unreasonable
-        dltpts.loc[(0 > dltpts[(scorer, bp, 'x')]) | (dltpts[(scorer, bp, 'x')] > width),
-                   (scorer, bp, ['x', 'y', 'likelihood'])] = np.nan, np.nan, 0.0
-        # if a point's y coordinates are unreasonable
-        dltpts.loc[(0 > dltpts[(scorer, bp, 'y')]) | (dltpts[(scorer, bp, 'y')] > height),
-                (scorer, bp, ['x', 'y', 'likelihood'])] = np.nan, np.nan, 0.0
-        #dltpts.loc[:, (scorer, bp, ['x', 'y'])] = xypts.loc[:,[f'{bp}_cam_1_x', f'{bp}_cam_1_y']].values
-        #  argus seems to round to nearest quarter pixel, so all values are different, so find diff of > 0.5
-        # compare dlt and dlc values, and set any different value likelihoods to 1.0
-        diff = np.where((abs(dlcpts.loc[:, (scorer, bp, 'x')] - xypts.loc[:, f'{bp}_cam_1_x']) > 0.5))[0]
-        if len(diff) > 0:
-            print(bp, diff)
-            dltpts.loc[diff, (scorer, bp, 'likelihood')] = 1.0
-            dltpts.loc[diff, (scorer, bp, ['x', 'y'])] = xypts.loc[diff,[f'{bp}_cam_1_x', f'{bp}_cam_1_y']].values
-
-
-    # # save out new hdf file, overwriting the DLC file
-    dltpts.to_hdf(dlcxyfname, 'df_with_missing', format='table', mode='w')
-    # keep an archive version of the original
-    dlcorig = dlcxyfname.parent / f'{dlcxyfname.stem}_orig.h5'
-    dlcpts.to_hdf(dlcorig, 'df_with_missing', format='table', mode='w')
+    dltpts = dlcpts.loc[rows].copy()
+    with profiling.stage('compare', items=len(bodyparts)):
+        for bp in bodyparts:
+            xy = xypts.loc[:,[f'{bp}_cam_1_x', f'{bp}_cam_1_y']].values
+            # reality check
+            #dltpts.loc[~np.isfinite(xy[(scorer, bp, 'x')]) | ~np.isfinite(xy[(scorer, bp, 'y')]),
+            #if a point as been deleted in DLT
+            dltpts.loc[~np.isfinite(xy[:,0]), (scorer, bp, ['x', 'y', 'likelihood'])] = np.nan, np.nan, 0.0
+            # if a point's x coordiantes are unreasonable
+            dltpts.loc[(0 > dltpts[(scorer, bp, 'x')]) | (dltpts[(scorer, bp, 'x')] > width),
+                       (scorer, bp, ['x', 'y', 'likelihood'])] = np.nan, np.nan, 0.0
+            # if a point's y coordinates are unreasonable
+            dltpts.loc[(0 > dltpts[(scorer, bp, 'y')]) | (dltpts[(scorer, bp, 'y')] > height),
+                    (scorer, bp, ['x', 'y', 'likelihood'])] = np.nan, np.nan, 0.0
+            #dltpts.loc[:, (scorer, bp, ['x', 'y'])] = xypts.loc[:,[f'{bp}_cam_1_x', f'{bp}_cam_1_y']].values
+            #  argus seems to round to nearest quarter pixel, so all values are different, so find diff of > 0.5
+            # compare dlt and dlc values, and set any different value likelihoods to 1.0
+            diff = rows[np.where((abs(dlcpts.loc[rows, (scorer, bp, 'x')] - xypts.loc[:, f'{bp}_cam_1_x']) > 0.5))[0]]
+            if len(diff) > 0:
+                print(bp, diff.values)
+                dltpts.loc[diff, (scorer, bp, 'likelihood')] = 1.0
+                dltpts.loc[diff, (scorer, bp, ['x', 'y'])] = xypts.loc[diff,[f'{bp}_cam_1_x', f'{bp}_cam_1_y']].values
+    if len(rows) < len(dlcpts):
+        # put the window back into the full tracks
+        full = dlcpts.copy()
+        full.loc[rows] = dltpts
+        dltpts = full
+    with profiling.stage('write_hdf', items=len(dltpts)):
+        # # save out new hdf file, overwriting the DLC file
+        dltpts.to_hdf(dlcxyfname, 'df_with_missing', format='table', mode='w')
+        # keep an archive version of the original, at its original precision
+        dlcorig.to_hdf(dlcxyfname.parent / f'{dlcxyfname.stem}_orig.h5', 'df_with_missing', format='table', mode='w')
 
 
 
@@ -110,9 +137,14 @@ if __name__ == '__main__':
     parser.add_argument('-flipy', default=True,
                         help='flip y coordinates - necessary for DLTdv versions 1-7 and Argus, set to False for DLTdv8')
     parser.add_argument('-ind', default=0, type=int, help='enter 0-indexed individual number from config file. \n xypts.csv must have only one indiv digitized.')
-
+    parser.add_argument('-start', default=None, type=int, help='first frame (0-indexed xypts row) to compare, default: the first')
+    parser.add_argument('-end', default=None, type=int, help='frame to stop at (not included), default: the end of the xypts file')
+    parser.add_argument('-precision', default='float64', choices=['float64', 'float32'], help='precision of the coordinates in memory, float32 halves memory use')
+    parser.add_argument('-profile', default=None, help='folder to save a json timing/memory profile of this run (or set DLCDLT_PROFILE)')
 
     args = parser.parse_args()
 
-    dlt2dlctracks(args.config, args.xy, args.dlcxy, args.vid, flipy=args.flipy, ind=args.ind)
+    profiling.enable(args.profile)
+    dlt2dlctracks(args.config, args.xy, args.dlcxy, args.vid, flipy=args.flipy, ind=args.ind, precision=args.precision,
+                  start=args.start, end=args.end)
 
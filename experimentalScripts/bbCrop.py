@@ -10,11 +10,15 @@ Last edited: 7 Feb 2020
 """
 
 import argparse
+import sys
 from pathlib import Path
 import cv2
 import numpy as np
 import pandas as pd
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from frames import FrameReader
+
 def main(vidpath, xypath):
     vidpath=Path(vidpath)
     xypath=Path(xypath)
@@ -52,8 +56,11 @@ def main(vidpath, xypath):
     # load video
     print('loading video')
     cap = cv2.VideoCapture(str(vidpath))
-    numfr = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    # only frames with a bounding box are decoded, the others are black anyway (see frames.py)
+    reader = FrameReader(vidpath)
+    numfr = len(reader)
     print('video has {} frames'.format(numfr))
     # set up video writer with size and codecs
     fourcc = cv2.VideoWriter_fourcc(*'MP4V')
@@ -73,13 +80,13 @@ def main(vidpath, xypath):
     for i in range(numfr):
         if i % 100 == 0:
             print('frame {} of {}.'.format(i, numfr))
-        success, frame = cap.read()
         cropped = allblack.copy()
-        if not success:
-            print('failed to load frame: ', i)
-        else:
-            # get coords if they all exist
-            if (i in im):# and np.count_nonzero(bbdata.loc[i]) == 4:
+        # get coords if they all exist
+        if (i in im):# and np.count_nonzero(bbdata.loc[i]) == 4:
+            frame = reader.read(i)
+            if frame is None:
+                print('failed to load frame: ', i)
+            else:
                 print('here')
                 xmin = bbdata.loc[i, (scorer, indivs[0], 'ul', 'x')]
                 xmax = bbdata.loc[i, (scorer, indivs[0], 'br', 'x')]
@@ -93,7 +100,7 @@ def main(vidpath, xypath):
             break
 
     # exit
-    cap.release()
+    reader.close()
     out.release()
     cv2.destroyAllWindows()
     print('Saved cropped frames to {}'.format(str(outpath)))
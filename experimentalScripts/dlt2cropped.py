@@ -8,12 +8,18 @@ import pandas as pd
 from pathlib import Path
 import argparse
 import re
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import tools
 
 def main(fname, croplist, numcams, opath, flipy, offsets):
     croppaths = [Path(x) for x in croplist]
     # load xypts file to dataframe
     xypts = pd.read_csv(fname)
-    xynew = xypts.copy() * np.nan
+    arr = tools.xypts_to_array(xypts.values.astype('float64'), numcams)
+    # upper left corner of the crop for every DLT row and camera, nan where there is no bounding box
+    origins = np.full((len(xypts), 1, numcams, 2), np.nan)
     for c in range(numcams):
         # load the cropped data file
         cropped = pd.read_hdf(croppaths[c], 'df_with_missing')
@@ -28,14 +34,14 @@ def main(fname, croplist, numcams, opath, flipy, offsets):
             # it's DLT created or training data during testing, indexed by a path to a training image, which is numbered
             new = [Path(x).stem for x in ul.index]
             ul.index = [int(re.findall(r'\d+', s)[0]) for s in new]
-        # correct for offsets by reindexing, effectively inserting blank rows at the start or end of cropped
-        ul.index = ul.index - offsets[c]
-        #TODO need to flip the Y - may be different for each camera! so requires loading the videos, or add to dlt2dlc.py
-        for i in range(int(len(xypts.columns)/(2*numcams))):
-            icol = i * (2 * numcams) + (c * 2)
-            # do the subtraction, indexes should take care of everything
-            #xypts.iloc[:, icol : icol+2] = xypts.iloc[:, icol : icol+2] - ul
-            xynew.iloc[ul.index, icol: icol+2] = xypts.iloc[ul.index, icol:icol+2].values - ul.values
+        # place the corners on video frame rows, then correct for offsets (DLT row = video frame - offset)
+        ulvid = np.full((max(ul.index) + 1, 1, 1, 2), np.nan)
+        ulvid[ul.index, 0, 0, :] = ul.values
+        origins[:, :, c:c+1, :] = tools.shift_frames(ulvid, [offsets[c]], nrows=len(xypts))
+    #TODO need to flip the Y - may be different for each camera! so requires loading the videos, or add to dlt2dlc.py
+    # do the subtraction for all tracks and cameras at once
+    xynew = tools.shift_crop(arr, origins[:, 0], inverse=True)
+    xynew = pd.DataFrame(tools.array_to_xypts(xynew), columns=xypts.columns)
     # resave the xypts - no need to xyz etc since this is just an intermediate for dlt2dlc.py
     xynew.to_csv(opath, na_rep='NaN', index=False)
 
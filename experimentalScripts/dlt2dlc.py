@@ -21,7 +21,13 @@ import numpy as np
 import cv2
 from pathlib import Path
 import re
+import sys
 import warnings
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+import tools
+from frames import FrameReader
+
 warnings.filterwarnings('ignore',category=pd.io.pytables.PerformanceWarning)
 
 def dlt2dlc(fname, vname, cnum, numcams, scorer, opath, flipy, offset, croppath, origvidpath, saveImgs):
@@ -45,44 +51,45 @@ def dlt2dlc(fname, vname, cnum, numcams, scorer, opath, flipy, offset, croppath,
     xypts = pd.read_csv(fname)
     xypts = xypts.astype('float64')
             
-    if offset < 0:
-        # the DLT digitized value on the n-th row was actually digitized at n+offset frame
-        # e.g. if offset = -5, a point digitized in the first frame of the video will be placed
-        # on the 5th row of the xypts csv file, so negative offsets mean that many blank rows
-        # need to be removed from the front of the df
-        print('dropping offset')
-        xypts.drop(range(-1*offset), inplace=True)
-        xypts.reset_index(drop=True, inplace=True)
-    if offset > 0:
-        # remove that many rows from the end of the df
-        xypts.drop(range(len(xypts)-offset, len(xypts)), inplace=True)
-        
-    # make Set of frames to be extracted (they have digitized points), and get tracknames
-    frames = []
-    trackNames = []
-    for i in range(int(len(xypts.columns)/(2*numcams))):
-        icol = i*(2*numcams) + (cnum * 2)
-        arr = xypts.iloc[:, icol]
-        frs = list(np.where(np.isfinite(arr))[0])
-        frames += frs 
-        # get the track name
-        if len(frs) > 0:
-            trackNames.append(xypts.columns[icol])
-            trackNames.append(xypts.columns[icol+1])
-    
-    # get zero-indexed frame numbers that have digitized points in this camera
-    frames = sorted(set(frames))
-    # create a copy of just the relevant part of the data
-    df = xypts.loc[frames, trackNames].copy()
+    # pull just this camera out as a (frames, tracks, 1, 2) array, with matching column names
+    arr = tools.xypts_to_array(xypts.values, numcams)[:, :, cnum:cnum+1, :]
+    trackcols = xypts.columns.values.reshape((arr.shape[1], numcams, 2))[:, cnum, :]
 
+    # the DLT digitized value on the n-th row was actually digitized at n+offset frame
+    # so shift rows back to video frame numbers, and flip the y-coordinates if needed
+    # (origin is lower left in Argus and DLTdv 1-7, upper left in openCV, DLC, DLTdv8)
     if flipy is True:
         print('flipping')
-        # flip the y-coordinates (origin is lower left in Argus and DLTdv 1-7, upper left in openCV, DLC, DLTdv8)
-        ycols = [x for x in df.columns if '_y' in x]
-        df.loc[:, ycols] = height - df.loc[:, ycols]
+        heights = [height]
+    else:
+        heights = None
+    arr = tools.transform_coords(arr, heights=heights, offsets=[offset], inverse=True)
+
+    # make Set of frames to be extracted (they have digitized points), and get tracknames
+    hasdata = np.isfinite(arr[:, :, 0, 0])
+    # get zero-indexed frame numbers that have digitized points in this camera
+    frames = list(np.where(hasdata.any(axis=1))[0])
+    tracksel = np.where(hasdata.any(axis=0))[0]
+
+    # if a crop file has been passed, convert full coordinates to the cropped coordinates
+    if croppath:
+        cropped = pd.read_hdf(croppath, 'df_with_missing')
+        # get the scorer
+        cropscorer = cropped.columns.get_level_values('scorer')[0]
+        ul = cropped[cropscorer]['ul'][['x', 'y']]
+        # if it's analyzed data, index is already set as 0-indexed frame integer, do nothing
+        if cropped.index.dtype != 'int':
+            # it's DLT created or training data during testing, indexed by a path to a training image, which is numbered
+            new = [Path(x).stem for x in ul.index]
+            ul.index = [int(re.findall(r'\d+', s)[0]) for s in new]
+        # upper left corner for each video frame, nan where there is no bounding box
+        origins = np.full((len(arr), 1, 2), np.nan)
+        keep = [i for i in ul.index if 0 <= i < len(arr)]
+        origins[keep, 0, :] = ul.loc[keep].values
+        arr = tools.shift_crop(arr, origins, inverse=True)
 
     # get unique track names
-    colnames = [x.split('_cam')[0] for x in trackNames[0:-1:2]]
+    colnames = [x.split('_cam')[0] for x in trackcols[tracksel, 0]]
     # some standard multi-index headers for DLC compatability
     s = [scorer]
     coords = ['x', 'y']
@@ -93,27 +100,8 @@ def dlt2dlc(fname, vname, cnum, numcams, scorer, opath, flipy, offset, croppath,
                                          coords],
                                          names=['scorer', 'bodyparts', 'coords'])
 
-    df.columns = header
-
-    # if a crop file has been passed, convert full coordinates to the cropped coordinates
-    if croppath:
-        dfnew = df.copy() * np.nan
-        cropped = pd.read_hdf(croppath, 'df_with_missing')
-        # get the scorer
-        scorer = cropped.columns.get_level_values('scorer')[0]
-        ul = cropped[scorer]['ul'][['x', 'y']]
-        # if it's analyzed data, index is already set as 0-indexed frame integer, do nothing
-        if cropped.index.dtype != 'int':
-            # it's DLT created or training data during testing, indexed by a path to a training image, which is numbered
-            new = [Path(x).stem for x in ul.index]
-            ul.index = [int(re.findall(r'\d+', s)[0]) for s in new]
-        # correct for offsets by reindexing, effectively inserting blank rows at the start or end of cropped
-        #ul.index = ul.index - offset
-        # get tracks in new format
-        tracks = df.columns.get_level_values('bodyparts')[::2]
-        for track in tracks:
-            dfnew.loc[dfnew.index.intersection(ul.index), (scorer, track)] = df.loc[dfnew.index.intersection(ul.index), (scorer, track)].values - ul.loc[dfnew.index.intersection(ul.index), :].values
-        df = dfnew
+    # create a copy of just the relevant part of the data
+    df = pd.DataFrame(arr[frames][:, tracksel, 0, :].reshape((len(frames), -1)), index=frames, columns=header)
 
     # replace DLT nans with empty entries
     df.fillna('', inplace=True)
@@ -130,15 +118,13 @@ def dlt2dlc(fname, vname, cnum, numcams, scorer, opath, flipy, offset, croppath,
     df.to_csv(opath / ('CollectedData_' + scorer + '.csv'))
 
     if saveImgs is True:
-        numfr = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
         print("Writing images from video...")
-        # loop through frames
-        for fr in frames:
-            #set the start frame for analysis
-            cap.set(cv2.CAP_PROP_POS_MSEC, fr*1000/fps)
-            success, frame = cap.read()
-            if success:
+        # frame accurate, and only decodes from the nearest keyframe (see frames.py)
+        with FrameReader(vname) as reader:
+            for fr, frame in reader.frames(frames):
+                if frame is None:
+                    continue
                 # make file name
                 outimg = opath / ('img{:04d}.png'.format(fr))
                 #save image
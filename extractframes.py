@@ -0,0 +1,108 @@
+"""
+Extracts the digitized frames of an Argus or DLTdv xypts file from all camera videos at once, so the same instant can
+be labeled in every view in DLC.
+
+Every row of the xypts file with a digitized point in any camera is an instant to extract. With the offsets (as used
+by dlc2dlt.py etc: DLT row = video frame - offset), each camera's video frame for that instant is row + offset. All
+videos are read at the same time, one process per video (frames.FrameReader, so only the needed parts of each video
+are decoded), and the images are written as <newpath>/labeled-data/<video name>/img<frame>.png, named as DLC names
+extracted frames, ready for dlt2dlclabels.py.
+
+manifest.csv in <newpath>/labeled-data lists each instant (the 1-indexed xypts row, as in Argus and DLTdv) and its
+image in each camera (empty where the frame is outside that video).
+
+Example call:
+python extractframes.py -xy /path/trial-xypts.csv -vid cam1.mp4 cam2.mp4 cam3.mp4 -offsets 0 -12 2 -newpath /path/to/DLC/project
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import cv2
+import numpy as np
+import pandas as pd
+import tools
+import profiling
+from frames import FrameReader
+
+
+def digitized_rows(xypath, ncams):
+    """
+    0-indexed rows of an xypts file with a digitized point in any camera
+    """
+    pts = pd.read_csv(xypath, index_col=False).values
+    arr = tools.xypts_to_array(pts, ncams)
+    return np.flatnonzero(np.isfinite(arr).all(axis=-1).any(axis=(1, 2)))
+
+
+def image_name(frame, numframes):
+    """
+    the name DLC gives an extracted frame: img + frame number padded to the digits of the number of frames
+    """
+    return 'img{}.png'.format(str(frame).zfill(int(np.ceil(np.log10(max(numframes, 2))))))
+
+
+def extract_video(video, frames, outdir):
+    """
+    writes the given (0-indexed) frames of video to outdir, returns a dict of frame -> image name for the frames
+    that could be read
+    """
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    names = {}
+    with FrameReader(video) as reader:
+        for f, img in reader.frames([f for f in frames if 0 <= f < len(reader)]):
+            if img is None:
+                continue
+            names[f] = image_name(f, len(reader))
+            cv2.imwrite(str(outdir / names[f]), img)
+    return names
+
+
+@profiling.profiled('extractframes')
+def extract_frames(xypath, videos, offsets, newpath=None, jobs=None):
+    """
+    extracts the digitized instants of xypath from every video (in camera order), see the module docstring
+    returns the manifest as a dataframe
+    """
+    newpath = Path(newpath) if newpath is not None else Path(xypath).parent
+    labdir = newpath / 'labeled-data'
+    offsets = [int(o) for o in offsets]
+    with profiling.stage('read_xypts'):
+        rows = digitized_rows(xypath, len(videos))
+    jobs = jobs or len(videos)
+    with profiling.stage('extract', items=len(rows) * len(videos)):
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = [pool.submit(extract_video, str(v), rows + off, labdir / Path(v).stem)
+                       for v, off in zip(videos, offsets)]
+            names = [fut.result() for fut in futures]
+    manifest = pd.DataFrame({'frame': rows + 1})
+    for c, (v, off) in enumerate(zip(videos, offsets)):
+        manifest['cam{}'.format(c + 1)] = [
+            'labeled-data/{}/{}'.format(Path(v).stem, names[c][r + off]) if r + off in names[c] else ''
+            for r in rows]
+    manifest.to_csv(labdir / 'manifest.csv', index=False)
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='extract the digitized frames of an xypts file from all camera videos at once')
+    parser.add_argument('-xy', help='input path to xypts file')
+    parser.add_argument('-vid', nargs='+', help='paths to the videos of each camera, in the order used in the DLT calibration')
+    parser.add_argument('-offsets', nargs='+', default=None, help='offsets as space separated list including first camera e.g.: -offsets 0 -12 2, default all 0')
+    parser.add_argument('-newpath', default=None, help='folder to make labeled-data/<video name>/ in, e.g. the DLC project folder, default: the folder of the xypts file')
+    parser.add_argument('-jobs', default=None, type=int, help='number of videos to read at the same time, default: all')
+    parser.add_argument('-profile', default=None, help='folder to save a json timing/memory profile of this run (or set DLCDLT_PROFILE)')
+
+    args = parser.parse_args()
+
+    profiling.enable(args.profile)
+    offsets = args.offsets or [0] * len(args.vid)
+    if len(offsets) != len(args.vid):
+        parser.error('give one offset per video')
+    manifest = extract_frames(args.xy, args.vid, offsets, args.newpath, args.jobs)
+    print('extracted {} instants from {} videos'.format(len(manifest), len(args.vid)))
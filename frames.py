@@ -0,0 +1,199 @@
+"""
+Frame accurate random access to video frames, for the tools that extract or crop frames.
+
+Seeking with OpenCV (CAP_PROP_POS_MSEC or CAP_PROP_POS_FRAMES) converts the position with the nominal frame rate,
+which is slow and can land on the wrong frame with variable frame rate video (phones, GoPros), and reading from
+frame 0 decodes everything. Here each video is indexed once: the packets are read without decoding them, and the
+timestamp of every frame and which frames are keyframes are saved in <video>.frames.npz next to the video (or in
+the folder given by the DLCDLT_FRAME_CACHE environment variable, or cachedir), or in the shared cache (cache.py) if
+that folder can't be written. The index is rebuilt when the video changes.
+
+FrameReader then reads a requested frame either by decoding forward from where it is, or by seeking (OpenCV decodes
+forward from a keyframe before the target), whichever decodes fewer frames according to the keyframes in the index.
+Where it landed is checked by the timestamps of the decoded frames, so sparse sets of frames are read quickly and
+exactly.
+
+Example call, to index videos ahead of time:
+python frames.py cam1.mp4 cam2.mp4 cam3.mp4
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import hashlib
+import os
+from pathlib import Path
+import cv2
+import numpy as np
+import profiling
+import cache
+
+ENV_CACHE = 'DLCDLT_FRAME_CACHE'
+# OpenCV's ffmpeg backend seeks to the keyframe before (target - 16 frames) and decodes forward to the target
+SEEK_BACK = 16
+
+
+def index_path(video, cachedir=None):
+    """
+    where the index of video is kept: next to it, or in cachedir (or $DLCDLT_FRAME_CACHE) under a name made from
+    its full path
+    """
+    video = Path(video).resolve()
+    cachedir = cachedir or os.environ.get(ENV_CACHE)
+    if cachedir:
+        name = hashlib.sha1(str(video).encode()).hexdigest()[:16]
+        return Path(cachedir) / '{}_{}.frames.npz'.format(video.stem, name)
+    return video.with_name(video.name + '.frames.npz')
+
+
+def build_index(video):
+    """
+    reads every packet of video without decoding it, returns the timestamp (ms) of each frame and whether it is a
+    keyframe, both in display order
+    """
+    cap = cv2.VideoCapture(str(video), cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    if not cap.isOpened():
+        raise OSError('could not open video {}'.format(video))
+    ms = []
+    key = []
+    with profiling.stage('index_video') as stg:
+        while cap.grab():
+            ms.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+            key.append(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) > 0)
+        stg.items = len(ms)
+    cap.release()
+    # packets come in decoding order, which differs from display order with B frames
+    order = np.argsort(ms, kind='stable')
+    return np.asarray(ms, dtype=float)[order], np.asarray(key, dtype=bool)[order]
+
+
+def load_index(video, cachedir=None):
+    """
+    the (ms, key) index of video, from its index file if that is up to date, otherwise built and saved
+    (in the shared cache if the index file can't be written)
+    """
+    st = Path(video).stat()
+    stats = np.array([st.st_mtime_ns, st.st_size], dtype=np.int64)
+    path = index_path(video, cachedir)
+    try:
+        with np.load(path) as f:
+            if (f['stats'] == stats).all():
+                return f['ms'], f['key']
+    except (OSError, KeyError, ValueError):
+        pass
+    sharedkey = cache.make_key(cache.file_id(video))
+    shared = cache.get('frames', sharedkey)
+    if shared is not None:
+        return shared['ms'], shared['key']
+    ms, key = build_index(video)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + '.tmp.npz')
+        np.savez(tmp, ms=ms, key=key, stats=stats)
+        tmp.replace(path)
+    except OSError:
+        cache.put('frames', sharedkey, {'ms': ms, 'key': key})
+    return ms, key
+
+
+class FrameReader:
+    """
+    reads frames of a video by (0-indexed) frame number, using its index (see load_index)
+    reading frames in increasing order is fastest, as frames between them are only decoded when that is quicker than
+    seeking
+    """
+    def __init__(self, video, cachedir=None):
+        self.video = str(video)
+        self.ms, self.key = load_index(video, cachedir)
+        self.keyframes = np.flatnonzero(self.key)
+        if len(self.keyframes) == 0 or self.keyframes[0] != 0:
+            # the first frame can always be decoded from the start of the file
+            self.keyframes = np.r_[0, self.keyframes]
+        self.cap = cv2.VideoCapture(self.video)
+        self.pos = -1  # last decoded frame
+
+    def __len__(self):
+        return len(self.ms)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.cap.release()
+
+    def _locate(self):
+        """
+        frame number of the last decoded frame, from its timestamp
+        """
+        t = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+        i = int(np.searchsorted(self.ms, t))
+        if i > 0 and (i == len(self.ms) or t - self.ms[i - 1] < self.ms[i] - t):
+            i -= 1
+        return i
+
+    def _seek(self, frame):
+        """
+        seeks to frame by its timestamp, then to earlier keyframes (or the start) if that lands after it
+        """
+        targets = [frame] + list(self.keyframes[self.keyframes <= frame][::-1])
+        for t in targets:
+            if t == 0:
+                break
+            self.cap.set(cv2.CAP_PROP_POS_MSEC, self.ms[t])
+            if self.cap.grab():
+                self.pos = self._locate()
+                if self.pos <= frame:
+                    return
+        # from the top
+        self.cap.release()
+        self.cap = cv2.VideoCapture(self.video)
+        self.pos = -1
+
+    def _seek_cost(self, frame):
+        """
+        about how many frames a seek to frame decodes
+        """
+        k = self.keyframes[np.searchsorted(self.keyframes, max(frame - SEEK_BACK, 0), side='right') - 1]
+        return frame - k + 1
+
+    def read(self, frame):
+        """
+        the image (BGR) of frame, None if it can't be read
+        """
+        frame = int(frame)
+        if frame < 0 or frame >= len(self.ms):
+            return None
+        if frame < self.pos or (frame > self.pos and frame - self.pos > self._seek_cost(frame)):
+            self._seek(frame)
+        while self.pos < frame:
+            if not self.cap.grab():
+                return None
+            self.pos = self._locate()
+        if self.pos != frame:
+            return None
+        ok, img = self.cap.retrieve()
+        return img if ok else None
+
+    def frames(self, frames):
+        """
+        yields (frame, image) for each of frames, in increasing order
+        """
+        for f in np.unique(np.asarray(frames, dtype=int)):
+            yield int(f), self.read(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='index videos for frame accurate random access (see FrameReader)')
+    parser.add_argument('videos', nargs='+', help='paths to the videos')
+    parser.add_argument('-cachedir', default=None, help='folder to keep the indexes in, default: next to each video')
+
+    args = parser.parse_args()
+
+    for v in args.videos:
+        ms, key = load_index(v, args.cachedir)
+        print('{}: {} frames, {} keyframes, index {}'.format(v, len(ms), int(key.sum()), index_path(v, args.cachedir)))
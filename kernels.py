@@ -0,0 +1,153 @@
+"""
+Optional Numba compiled kernels for the per-point math in triangulation, reprojection errors and pinhole undistortion.
+
+Each point (frame, track) is seen by a different subset of cameras, so these kernels work on observations sorted by
+point (see tools.Observations): rows starts[p] to starts[p] + counts[p] are the observations of point p. Points are
+processed in parallel.
+
+If Numba is installed, tools.triangulate_obs, tools.repo_errors_obs and tools.Observations.undistort use these
+automatically, otherwise they use their NumPy versions. Set DLCDLT_NO_NUMBA=1 to use the NumPy versions anyway.
+Without Numba, the functions here still work (as plain, slow, python), which is only useful for checking them.
+
+To check the kernels against the reference implementations (tools.uv_to_xyz, tools.get_repo_errors, OpenCV):
+python benchmarks/validate_kernels.py
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import os
+import numpy as np
+
+ENV_OFF = 'DLCDLT_NO_NUMBA'
+
+NUMBA = False
+if not os.environ.get(ENV_OFF):
+    # only imported when it will be used, as importing numba takes a while
+    try:
+        from numba import njit, prange
+        NUMBA = True
+    except ImportError:
+        pass
+if not NUMBA:
+    prange = range
+
+    def njit(*args, **kwargs):
+        # no numba, leave the functions as they are
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+@njit(parallel=True, cache=True)
+def solve_groups(uv, cam, starts, counts, dlt, w):
+    """
+    least squares xyz of each point from its observations (uv, cam sorted by point), as in tools.uv_to_xyz
+    each observation's two equations are weighted by w (ones for ordinary least squares)
+    returns a (points, 3) array, NaN for points seen by fewer than 2 cameras
+    """
+    npts = len(starts)
+    out = np.full((npts, 3), np.nan)
+    for p in prange(npts):
+        if counts[p] < 2:
+            continue
+        AtA = np.zeros((3, 3))
+        Atb = np.zeros(3)
+        for k in range(starts[p], starts[p] + counts[p]):
+            L = dlt[cam[k]]
+            u = uv[k, 0]
+            v = uv[k, 1]
+            a0 = u * L[8] - L[0]
+            a1 = u * L[9] - L[1]
+            a2 = u * L[10] - L[2]
+            b = L[3] - u
+            c0 = v * L[8] - L[4]
+            c1 = v * L[9] - L[5]
+            c2 = v * L[10] - L[6]
+            d = L[7] - v
+            wk = w[k]
+            AtA[0, 0] += wk * (a0 * a0 + c0 * c0)
+            AtA[0, 1] += wk * (a0 * a1 + c0 * c1)
+            AtA[0, 2] += wk * (a0 * a2 + c0 * c2)
+            AtA[1, 1] += wk * (a1 * a1 + c1 * c1)
+            AtA[1, 2] += wk * (a1 * a2 + c1 * c2)
+            AtA[2, 2] += wk * (a2 * a2 + c2 * c2)
+            Atb[0] += wk * (a0 * b + c0 * d)
+            Atb[1] += wk * (a1 * b + c1 * d)
+            Atb[2] += wk * (a2 * b + c2 * d)
+        AtA[1, 0] = AtA[0, 1]
+        AtA[2, 0] = AtA[0, 2]
+        AtA[2, 1] = AtA[1, 2]
+        # cofactors of the symmetric 3x3 normal matrix
+        m00 = AtA[1, 1] * AtA[2, 2] - AtA[1, 2] * AtA[2, 1]
+        m01 = AtA[1, 2] * AtA[2, 0] - AtA[1, 0] * AtA[2, 2]
+        m02 = AtA[1, 0] * AtA[2, 1] - AtA[1, 1] * AtA[2, 0]
+        det = AtA[0, 0] * m00 + AtA[0, 1] * m01 + AtA[0, 2] * m02
+        if det == 0.:
+            # degenerate (e.g. cameras in a line with the point), minimum norm solution
+            out[p] = np.linalg.lstsq(AtA, Atb, -1.)[0]
+            continue
+        m11 = AtA[0, 0] * AtA[2, 2] - AtA[0, 2] * AtA[2, 0]
+        m12 = AtA[0, 1] * AtA[2, 0] - AtA[0, 0] * AtA[2, 1]
+        m22 = AtA[0, 0] * AtA[1, 1] - AtA[0, 1] * AtA[1, 0]
+        out[p, 0] = (m00 * Atb[0] + m01 * Atb[1] + m02 * Atb[2]) / det
+        out[p, 1] = (m01 * Atb[0] + m11 * Atb[1] + m12 * Atb[2]) / det
+        out[p, 2] = (m02 * Atb[0] + m12 * Atb[1] + m22 * Atb[2]) / det
+    return out
+
+
+@njit(parallel=True, cache=True)
+def repo_groups(uv, cam, starts, counts, xyz, dlt):
+    """
+    rmse reprojection error of each point from its observations (uv, cam sorted by point) and its xyz (points, 3),
+    as in tools.get_repo_errors, NaN where xyz is NaN
+    """
+    npts = len(starts)
+    out = np.full(npts, np.nan)
+    for p in prange(npts):
+        x = xyz[p, 0]
+        y = xyz[p, 1]
+        z = xyz[p, 2]
+        if np.isnan(x) or np.isnan(y) or np.isnan(z):
+            continue
+        sq = 0.
+        for k in range(starts[p], starts[p] + counts[p]):
+            L = dlt[cam[k]]
+            den = L[8] * x + L[9] * y + L[10] * z + 1.
+            ru = (L[0] * x + L[1] * y + L[2] * z + L[3]) / den
+            rv = (L[4] * x + L[5] * y + L[6] * z + L[7]) / den
+            sq += (uv[k, 0] - ru) ** 2 + (uv[k, 1] - rv) ** 2
+        out[p] = np.sqrt(sq / (counts[p] * 2 - 3))
+    return out
+
+
+@njit(parallel=True, cache=True)
+def undistort_pinhole(uv, prof, iters=5):
+    """
+    undistorts (N, 2) pixel coordinates with one camera's pinhole profile (f, cx, cy, k1, k2, p1, p2, k3, as from
+    tools.load_camera), using the same fixed point iteration as OpenCV's undistortPoints (5 iterations)
+    """
+    f = prof[0]
+    cx = prof[1]
+    cy = prof[2]
+    k1 = prof[-5]
+    k2 = prof[-4]
+    p1 = prof[-3]
+    p2 = prof[-2]
+    k3 = prof[-1]
+    out = np.empty((uv.shape[0], 2))
+    for i in prange(uv.shape[0]):
+        x0 = (uv[i, 0] - cx) / f
+        y0 = (uv[i, 1] - cy) / f
+        x = x0
+        y = y0
+        for _ in range(iters):
+            r2 = x * x + y * y
+            icdist = 1. / (1. + ((k3 * r2 + k2) * r2 + k1) * r2)
+            dx = 2. * p1 * x * y + p2 * (r2 + 2. * x * x)
+            dy = p1 * (r2 + 2. * y * y) + 2. * p2 * x * y
+            x = (x0 - dx) * icdist
+            y = (y0 - dy) * icdist
+        out[i, 0] = x * f + cx
+        out[i, 1] = y * f + cy
+    return out
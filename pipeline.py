@@ -0,0 +1,417 @@
+"""
+Runs the DLC -> DLT -> manual correction -> DLC -> 3D loop for a whole season of trials, re-running only what changed.
+
+makeCorrections.py runs one trial at a time, and every step every time. Here each step is a stage that declares the
+files it reads and writes. A stage re-runs only when the content of its inputs (or its settings) changed since it last
+ran, or one of its outputs is missing or not what it wrote, so after correcting one trial, re-running the season only
+touches that trial. Stages that don't depend on each other (cameras, trials, individuals) run in parallel with -jobs.
+
+For each trial, the stages are:
+    <trial>/<cam>/dlc2dlt        DLC tracks of one camera -> <path>_<cam>-xypts.csv, to correct in Argus or DLTdv
+    <trial>/<cam>/dlt2dlctracks  corrected xypts -> DLC tracks (likelihood 1.0 for corrected points), only runs once the
+                                 xypts file has been edited, the untouched DLC output is kept as <name>_orig.h5
+    <trial>/dlc2dlt              (corrected) DLC tracks of all cameras -> <path>-xypts.csv
+    <trial>/triangulate          -> <path>-xyzpts.csv and <path>-xyzres.csv, if dlt coefficients are given. Only the
+                                 rows of xypts that changed are re-triangulated (hashes in <path>-xyzstate.json,
+                                 delete it to redo the whole trial)
+    <trial>/filter               -> <path>-xyzfilt.csv, gaps filled and smoothed (xyzfilter.py), if filter is given
+Correction files that have been edited are never overwritten, delete them to regenerate them.
+Set correct: false to skip the correction stages (they are always skipped for multianimal projects, as dlt2dlctracks
+only works with single animal projects).
+
+The season is described in a yaml file, relative paths are relative to that file. Settings at the top are defaults
+for every trial, and can be overridden per trial:
+    config: /path/to/DLC/config.yaml
+    dlt: /path/to/dlt-coefficients.csv
+    profile: /path/to/camera-profiles.txt   (optional)
+    flipy: true
+    like: 0.9
+    precision: float64                      (or float32, to halve memory use)
+    robust: 5                               (optional, pixels, leave out cameras that don't fit, see tools.triangulate)
+    filter:                                 (optional, settings of xyzfilter.Filter)
+      gap: 10
+      butter: [12, 100]                     (cutoff and frame rate, Hz)
+    correct: true
+    trials:
+      - name: trial01
+        path: trial01/trial01               (prefix for the DLT files)
+        dlctracks: [trial01/cam1DLC.h5, trial01/cam2DLC.h5]
+        videos: [trial01/cam1.mp4, trial01/cam2.mp4]
+        offsets: [0, -12]
+
+Example call:
+python pipeline.py season.yaml -jobs 4
+
+What ran is kept in season.state.json next to the yaml file.
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import hashlib
+import json
+import shutil
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+import cv2
+import yaml
+import dlcio
+import tools
+from dlc2dlt import dlc2dlt
+from dlt2dlctracks import dlt2dlctracks
+
+
+class Stage:
+    """
+    one step of the pipeline, func(**params) reads the inputs and writes the outputs
+    protect - outputs that are edited by hand, never overwritten once edited
+    edited - inputs that have to be edited by hand (since the pipeline wrote them) before this stage runs
+    """
+    def __init__(self, name, func, params, inputs, outputs, protect=(), edited=()):
+        self.name = name
+        self.func = func
+        self.params = params
+        self.inputs = [str(p) for p in inputs]
+        self.outputs = [str(p) for p in outputs]
+        self.protect = [str(p) for p in protect]
+        self.edited = [str(p) for p in edited]
+        self.sig = None
+
+
+class Pipeline:
+    def __init__(self, statepath):
+        self.statepath = Path(statepath)
+        self.stages = []
+        try:
+            with open(self.statepath) as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+        # files: path -> [mtime_ns, size, digest], so unchanged files aren't hashed again
+        # written: path -> digest of the file as the pipeline wrote it
+        # stages: name -> signature of the inputs and settings it last ran with
+        for key in ['files', 'written', 'stages']:
+            self.state.setdefault(key, {})
+
+    def add(self, stage):
+        self.stages.append(stage)
+        return stage
+
+    def digest(self, path):
+        """
+        sha1 of a file's contents, None if it doesn't exist
+        """
+        p = Path(path)
+        try:
+            st = p.stat()
+        except OSError:
+            return None
+        known = self.state['files'].get(str(path))
+        if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+            return known[2]
+        h = hashlib.sha1()
+        with open(p, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        self.state['files'][str(path)] = [st.st_mtime_ns, st.st_size, h.hexdigest()]
+        return h.hexdigest()
+
+    def signature(self, stage):
+        # by content only, so a file that moved (e.g. DLC output archived as _orig.h5) doesn't count as a change
+        h = hashlib.sha1(json.dumps([stage.func.__name__, stage.params], sort_keys=True, default=str).encode())
+        for p in stage.inputs:
+            h.update(str(self.digest(p)).encode())
+        return h.hexdigest()
+
+    def is_edited(self, path):
+        """
+        True if the file exists and is not what the pipeline last wrote there
+        """
+        d = self.digest(path)
+        return d is not None and self.state['written'].get(path) != d
+
+    def dependencies(self):
+        """
+        each stage depends on the earlier stages that write its inputs
+        """
+        deps = {}
+        writers = {}
+        for st in self.stages:
+            deps[st.name] = {writers[p] for p in st.inputs if p in writers}
+            for p in st.outputs:
+                writers[p] = st.name
+        return deps
+
+    def check(self, stage, force=False):
+        """
+        decides what to do with a stage whose upstream stages are done, returns (run, status)
+        """
+        missing = [p for p in stage.inputs if self.digest(p) is None]
+        if missing:
+            return False, 'failed, missing inputs ' + ', '.join(missing)
+        if not all(self.is_edited(p) for p in stage.edited):
+            return False, 'waiting for corrections'
+        # kept for record(), as running the stage may change its inputs (dlt2dlctracks overwrites its DLC file)
+        stage.sig = self.signature(stage)
+        # an output that changed since this stage wrote it (e.g. rewritten by another stage) is redone, unless it is
+        # one that is edited by hand
+        if (not force and self.state['stages'].get(stage.name) == stage.sig
+                and all(Path(p).exists() for p in stage.outputs)
+                and not any(self.is_edited(p) for p in stage.outputs if p not in stage.protect)):
+            return False, 'up to date'
+        kept = [p for p in stage.protect if self.is_edited(p)]
+        if kept:
+            return False, 'kept edited ' + ', '.join(kept)
+        return True, 'run'
+
+    def record(self, stage):
+        for p in stage.outputs:
+            d = self.digest(p)
+            if d is not None:
+                self.state['written'][p] = d
+        self.state['stages'][stage.name] = stage.sig
+        self.save()
+
+    def save(self):
+        self.statepath.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.statepath.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        tmp.replace(self.statepath)
+
+    def run(self, jobs=1, force=False, dry=False):
+        """
+        runs every stage that is out of date, in parallel where possible, and returns a dict of stage name -> status
+        """
+        deps = self.dependencies()
+        pending = list(self.stages)
+        status = {}
+        bad = set()
+        running = {}
+        pool = ProcessPoolExecutor(jobs) if jobs > 1 and not dry else None
+        try:
+            while pending or running:
+                for st in list(pending):
+                    if not deps[st.name] <= set(status):
+                        continue
+                    pending.remove(st)
+                    if deps[st.name] & bad:
+                        status[st.name] = 'skipped, upstream failed'
+                        bad.add(st.name)
+                    elif dry and any(status[d].startswith('would run') for d in deps[st.name]):
+                        status[st.name] = 'would run (after upstream)'
+                    else:
+                        go, status[st.name] = self.check(st, force)
+                        if status[st.name].startswith('failed'):
+                            bad.add(st.name)
+                        if go and dry:
+                            status[st.name] = 'would run'
+                        elif go and pool is None:
+                            status[st.name] = self._run_here(st, bad)
+                        elif go:
+                            del status[st.name]
+                            running[pool.submit(st.func, **st.params)] = (st, time.time())
+                    if st.name in status:
+                        print('{:<48} {}'.format(st.name, status[st.name]))
+                if not running:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    st, t0 = running.pop(fut)
+                    if fut.exception() is not None:
+                        err = fut.exception()
+                        status[st.name] = 'failed, ' + ''.join(traceback.format_exception_only(type(err), err)).strip()
+                        bad.add(st.name)
+                    else:
+                        self.record(st)
+                        status[st.name] = 'ran in {:.1f} s'.format(time.time() - t0)
+                    print('{:<48} {}'.format(st.name, status[st.name]))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if not dry:
+                self.save()
+        return status
+
+    def _run_here(self, st, bad):
+        t0 = time.time()
+        try:
+            st.func(**st.params)
+        except Exception:
+            traceback.print_exc()
+            bad.add(st.name)
+            return 'failed'
+        self.record(st)
+        return 'ran in {:.1f} s'.format(time.time() - t0)
+
+
+def orig_tracks(dlcxy):
+    """
+    the untouched DLC output for a tracks file, which dlt2dlctracks archives as <name>_orig.h5 before overwriting it
+    """
+    dlcxy = Path(dlcxy)
+    orig = dlcxy.parent / '{}_orig.h5'.format(dlcxy.stem)
+    return orig if orig.exists() else dlcxy
+
+
+def video_heights(videos):
+    heights = []
+    for v in videos:
+        cap = cv2.VideoCapture(str(v))
+        heights.append(int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+    return heights
+
+
+# stage functions, kept at module level so they can be sent to worker processes
+def run_dlc2dlt(config, opath, dlctracks, flipy, offsets, like, videos, precision):
+    dlc2dlt(config, opath, dlctracks, flipy, offsets, like, vid=videos, precision=precision)
+
+
+def run_dlc2dlt_cam(config, opath, dlcxy, flipy, like, video, precision):
+    dlc2dlt(config, opath, [str(orig_tracks(dlcxy))], flipy, [0], like, vid=[video], precision=precision)
+
+
+def run_dlt2dlctracks(config, xypath, dlcxy, video, flipy, precision):
+    dlcxy = Path(dlcxy)
+    archive = dlcxy.parent / '{}_orig.h5'.format(dlcxy.stem)
+    if not archive.exists():
+        shutil.copy(dlcxy, archive)
+    # start from the DLC output each time, so corrections are found against it and the archived original stays original
+    shutil.copy(archive, dlcxy)
+    # dlt2dlctracks re-saves the archive, put back the byte for byte copy so its hash (the stage inputs) doesn't change
+    keep = archive.with_suffix('.keep')
+    shutil.copy(archive, keep)
+    try:
+        dlt2dlctracks(config, xypath, dlcxy, video, flipy=flipy, precision=precision)
+    finally:
+        keep.replace(archive)
+
+
+def run_triangulate(xypath, dltpath, profpath, flipy, videos, precision, robust=None):
+    heights = video_heights(videos) if flipy else []
+    # only the rows that changed since the last run are re-triangulated, see tools.triangulate
+    tools.triangulate(xypath, dltpath, profpath, flipy=flipy, heights=heights, precision=precision, incremental=True,
+                      robust=robust)
+
+
+def run_filter(xyzpath, settings):
+    # scipy is only needed for this stage
+    import xyzfilter
+    xyzfilter.filter_xyz(xyzpath, **settings)
+
+
+def dlt_files(prefix):
+    return [prefix + ext for ext in ['xypts.csv', 'xyzpts.csv', 'xyzres.csv', 'offsets.csv']]
+
+
+def load_season(specpath):
+    """
+    reads a season yaml file into a list of trial dicts, with the defaults filled in and paths made absolute
+    """
+    specpath = Path(specpath)
+    with open(specpath) as f:
+        spec = yaml.safe_load(f)
+    base = specpath.resolve().parent
+
+    def absolute(p):
+        return None if p is None else str((base / p).resolve())
+
+    defaults = {k: v for k, v in spec.items() if k != 'trials'}
+    trials = []
+    for tr in spec['trials']:
+        trial = dict(defaults, **tr)
+        trial.setdefault('flipy', True)
+        trial.setdefault('like', 0.9)
+        trial.setdefault('precision', 'float64')
+        trial.setdefault('robust', None)
+        trial.setdefault('filter', None)
+        trial.setdefault('correct', True)
+        trial.setdefault('offsets', [0] * len(trial['dlctracks']))
+        for key in ['config', 'dlt', 'profile', 'path']:
+            trial[key] = absolute(trial.get(key))
+        for key in ['dlctracks', 'videos']:
+            trial[key] = [absolute(p) for p in trial[key]]
+        if len(trial['videos']) != len(trial['dlctracks']) or len(trial['offsets']) != len(trial['dlctracks']):
+            raise ValueError('trial {} needs one video and one offset per DLC tracks file'.format(trial['name']))
+        trials.append(trial)
+    return trials
+
+
+def build_season(trials, statepath):
+    """
+    makes the pipeline for a list of trials (see load_season)
+    """
+    pipe = Pipeline(statepath)
+    for trial in trials:
+        name = trial['name']
+        cfg = dlcio.read_config(trial['config'])
+        ma = cfg['multianimalproject']
+        if trial['correct'] and not ma:
+            for dlcxy, vid in zip(trial['dlctracks'], trial['videos']):
+                cam = Path(vid).stem
+                prefix = '{}_{}-'.format(trial['path'], cam)
+                xypath = prefix + 'xypts.csv'
+                orig = str(orig_tracks(dlcxy))
+                pipe.add(Stage('{}/{}/dlc2dlt'.format(name, cam), run_dlc2dlt_cam,
+                               dict(config=trial['config'], opath=prefix[:-1], dlcxy=dlcxy, flipy=trial['flipy'],
+                                    like=trial['like'], video=vid, precision=trial['precision']),
+                               inputs=[trial['config'], orig], outputs=dlt_files(prefix), protect=[xypath]))
+                pipe.add(Stage('{}/{}/dlt2dlctracks'.format(name, cam), run_dlt2dlctracks,
+                               dict(config=trial['config'], xypath=xypath, dlcxy=dlcxy, video=vid, flipy=trial['flipy'],
+                                    precision=trial['precision']),
+                               inputs=[trial['config'], xypath, orig],
+                               outputs=[dlcxy, str(Path(dlcxy).parent / '{}_orig.h5'.format(Path(dlcxy).stem))],
+                               edited=[xypath]))
+        # (stage name, file prefix) for each individual, dlc2dlt writes one set of files each
+        if ma:
+            prefixes = [('{}/{}/'.format(name, ind), '{}_{}-'.format(trial['path'], ind)) for ind in cfg['individuals']]
+        else:
+            prefixes = [(name + '/', trial['path'] + '-')]
+        # dlc2dlt also writes empty xyzpts/xyzres files, when the trial is triangulated those belong to triangulate
+        outputs = [f for _, prefix in prefixes for f in dlt_files(prefix)]
+        if trial['dlt'] is not None:
+            outputs = [f for f in outputs if not f.endswith(('xyzpts.csv', 'xyzres.csv'))]
+        pipe.add(Stage('{}/dlc2dlt'.format(name), run_dlc2dlt,
+                       dict(config=trial['config'], opath=trial['path'], dlctracks=trial['dlctracks'],
+                            flipy=trial['flipy'], offsets=trial['offsets'], like=trial['like'], precision=trial['precision'],
+                            videos=trial['videos']),
+                       inputs=[trial['config']] + trial['dlctracks'], outputs=outputs))
+        if trial['dlt'] is None:
+            continue
+        for label, prefix in prefixes:
+            pipe.add(Stage(label + 'triangulate', run_triangulate,
+                           dict(xypath=prefix + 'xypts.csv', dltpath=trial['dlt'], profpath=trial['profile'],
+                                flipy=trial['flipy'], videos=trial['videos'], precision=trial['precision'],
+                                robust=trial['robust']),
+                           inputs=[prefix + 'xypts.csv', trial['dlt']] + ([trial['profile']] if trial['profile'] else []),
+                           outputs=[prefix + 'xyzpts.csv', prefix + 'xyzres.csv']
+                           + ([prefix + 'xyzrejected.csv'] if trial['robust'] is not None else [])))
+            if trial['filter']:
+                pipe.add(Stage(label + 'filter', run_filter,
+                               dict(xyzpath=prefix + 'xyzpts.csv', settings=trial['filter']),
+                               inputs=[prefix + 'xyzpts.csv'], outputs=[prefix + 'xyzfilt.csv']))
+    return pipe
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='run the DLC/DLT correction and triangulation pipeline for a season of trials, re-running only what changed')
+    parser.add_argument('season', help='path to the season yaml file')
+    parser.add_argument('-trials', nargs='+', default=None, help='only these trials (by name), all by default')
+    parser.add_argument('-jobs', default=1, type=int, help='number of stages to run in parallel')
+    parser.add_argument('-force', action='store_true', help='re-run stages even if they are up to date (edited correction files are still kept)')
+    parser.add_argument('-dry', action='store_true', help='only show what would run')
+
+    args = parser.parse_args()
+
+    trials = load_season(args.season)
+    if args.trials:
+        trials = [t for t in trials if t['name'] in args.trials]
+    pipe = build_season(trials, Path(args.season).with_suffix('.state.json'))
+    status = pipe.run(args.jobs, args.force, args.dry)
+    if any(s.startswith('failed') or s.startswith('skipped') for s in status.values()):
+        raise SystemExit(1)
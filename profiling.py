@@ -0,0 +1,227 @@
+"""
+Optional per-stage timing and memory instrumentation for the conversion and triangulation tools.
+
+Profiling is off by default. Turn it on by setting the DLCDLT_PROFILE environment variable to a folder
+(or pass -profile /path/to/folder to any of the command line tools). Each run of an entry point (dlc2dlt,
+dlt2dlclabels, dlt2dlctracks, tools.triangulate) then saves a json report to that folder with, for each named stage:
+wall time, cpu time, peak RSS of the process at the end of the stage, and an item count (frames, cameras, points...).
+
+Reports from many runs (e.g. a batch over a whole season) can be summarized to find the hot spots:
+python profiling.py /path/to/folder -top 20 -out summary.json
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+ENV = 'DLCDLT_PROFILE'
+
+# the run currently being profiled, None if profiling is off
+_active = None
+# number of reports saved by this process, keeps file names unique when one process makes many runs
+_saved = 0
+
+
+def peak_rss_mb():
+    """
+    peak resident memory of this process so far in MB, None if it can't be determined
+    """
+    try:
+        import resource
+    except ImportError:
+        # windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        mem = psutil.Process().memory_info()
+        return getattr(mem, 'peak_wset', mem.rss) / 1e6
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on mac, kilobytes on linux
+    if sys.platform == 'darwin':
+        return peak / 1e6
+    return peak / 1e3
+
+
+class Stage:
+    """
+    handed out by stage(), so the caller can set the item count once it is known
+    """
+    def __init__(self, name, items=None):
+        self.name = name
+        self.items = items
+
+
+class Run:
+    def __init__(self, name, outdir):
+        self.name = name
+        self.outdir = Path(outdir)
+        self.stages = []
+        self.prefix = []
+        self.start = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.wall0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+
+    def to_dict(self):
+        return {'run': self.name,
+                'start': self.start,
+                'pid': os.getpid(),
+                'argv': sys.argv,
+                'wall': time.perf_counter() - self.wall0,
+                'cpu': time.process_time() - self.cpu0,
+                'peak_rss_mb': peak_rss_mb(),
+                'stages': self.stages}
+
+    def save(self):
+        global _saved
+        self.outdir.mkdir(parents=True, exist_ok=True)
+        _saved += 1
+        fname = self.outdir / '{}-{}-{}-{}.json'.format(self.name, time.strftime('%Y%m%d-%H%M%S'), os.getpid(), _saved)
+        with open(fname, 'w') as f:
+            # numpy scalars (e.g. item counts) are saved as plain numbers
+            json.dump(self.to_dict(), f, indent=2, default=lambda o: o.item() if hasattr(o, 'item') else str(o))
+        return fname
+
+
+def _outdir():
+    outdir = os.environ.get(ENV)
+    if not outdir or outdir.lower() in ['0', 'false']:
+        return None
+    if outdir.lower() in ['1', 'true']:
+        return Path.cwd()
+    return Path(outdir)
+
+
+@contextmanager
+def run(name):
+    """
+    profiles one run of an entry point, saving a json report if DLCDLT_PROFILE is set
+    if a run is already being profiled (e.g. a script calling triangulate), this is recorded as a stage of that run
+    """
+    global _active
+    if _active is not None:
+        with stage(name) as st:
+            yield st
+        return
+    outdir = _outdir()
+    if outdir is None:
+        yield None
+        return
+    _active = Run(name, outdir)
+    try:
+        yield _active
+    finally:
+        fname = _active.save()
+        _active = None
+        print('profile written to ', fname)
+
+
+@contextmanager
+def stage(name, items=None):
+    """
+    times a named stage of the current run, does nothing if profiling is off
+    nested stages are named outer/inner
+    """
+    st = Stage(name, items)
+    if _active is None:
+        yield st
+        return
+    _active.prefix.append(name)
+    fullname = '/'.join(_active.prefix)
+    wall0 = time.perf_counter()
+    cpu0 = time.process_time()
+    try:
+        yield st
+    finally:
+        _active.prefix.pop()
+        _active.stages.append({'stage': fullname,
+                               'wall': time.perf_counter() - wall0,
+                               'cpu': time.process_time() - cpu0,
+                               'peak_rss_mb': peak_rss_mb(),
+                               'items': st.items})
+
+
+def profiled(name):
+    """
+    decorator to profile every call of an entry point function as a run
+    """
+    def wrap(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with run(name):
+                return func(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def enable(outdir):
+    """
+    turns profiling on for this process (and any subprocesses it starts), used by the -profile command line flags
+    """
+    if outdir:
+        os.environ[ENV] = str(outdir)
+
+
+def aggregate(paths):
+    """
+    combines json reports (files, or folders of them) into one row per run and stage, sorted by total wall time
+    """
+    files = []
+    for p in paths:
+        p = Path(p)
+        if p.is_dir():
+            files.extend(sorted(p.glob('*.json')))
+        else:
+            files.append(p)
+    rows = {}
+    for f in files:
+        with open(f) as fh:
+            rep = json.load(fh)
+        if 'stages' not in rep:
+            continue
+        records = [dict(stage='(total)', wall=rep['wall'], cpu=rep['cpu'], peak_rss_mb=rep['peak_rss_mb'], items=None)]
+        for rec in records + rep['stages']:
+            key = (rep['run'], rec['stage'])
+            row = rows.setdefault(key, {'run': key[0], 'stage': key[1], 'count': 0, 'wall': 0., 'wall_max': 0.,
+                                        'cpu': 0., 'peak_rss_mb': None, 'items': 0})
+            row['count'] += 1
+            row['wall'] += rec['wall']
+            row['wall_max'] = max(row['wall_max'], rec['wall'])
+            row['cpu'] += rec['cpu']
+            if rec['peak_rss_mb'] is not None:
+                row['peak_rss_mb'] = max(row['peak_rss_mb'] or 0., rec['peak_rss_mb'])
+            if rec['items']:
+                row['items'] += rec['items']
+    return sorted(rows.values(), key=lambda r: r['wall'], reverse=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='summarize profile reports from many runs')
+    parser.add_argument('reports', nargs='+', help='json report files, or folders containing them')
+    parser.add_argument('-top', default=None, type=int, help='only show the slowest n stages')
+    parser.add_argument('-out', default=None, help='path to save the summary as json')
+
+    args = parser.parse_args()
+
+    rows = aggregate(args.reports)
+    if args.top:
+        rows = rows[:args.top]
+    print('{:<16} {:<32} {:>6} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'run', 'stage', 'count', 'wall s', 'max s', 'cpu s', 'rss MB', 'items'))
+    for r in rows:
+        print('{:<16} {:<32} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>10} {:>10}'.format(
+            r['run'], r['stage'], r['count'], r['wall'], r['wall_max'], r['cpu'],
+            '' if r['peak_rss_mb'] is None else '{:.1f}'.format(r['peak_rss_mb']), r['items'] or ''))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print('summary written to ', args.out)
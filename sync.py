@@ -0,0 +1,147 @@
+"""
+Estimates the frame offsets between cameras from their 2D tracks and the DLT coefficients, for when no audio sync
+(Argus Sync) is available, or to check it.
+
+For each camera, every candidate offset within +-search frames is scored against the first camera: a sample of
+frames is triangulated from the two cameras with that offset, and the score is the median reprojection error. The
+tracks only agree in 3D at the right offset, so the lowest score wins. With -subframe the best offset is refined to
+a fraction of a frame from the scores of its neighbours (only useful as a check, the tools take whole frames).
+The subject has to move during the sampled frames, a still subject fits any offset.
+
+Offsets are as used by dlc2dlt.py, dlt2dlclabels.py, etc: the first camera is 0 and DLT row = video frame - offset.
+dlc2dlt.py can also estimate them itself, with -offsets auto and -dlt.
+
+Example call:
+python sync.py -config /path/to/config.yaml -dlctracks cam1DLC.h5 cam2DLC.h5 cam3DLC.h5 -dlt /path/dlt-coefficients.csv -search 500
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import numpy as np
+import tools
+import profiling
+
+
+def shifted(arr, rows):
+    """
+    (frames, tracks, 2) arr at integer rows, NaN outside arr, returns an array of shape rows.shape + (tracks, 2)
+    """
+    # one NaN frame at the end stands in for everything outside arr
+    pad = np.concatenate([arr, np.full((1,) + arr.shape[1:], np.nan, dtype=arr.dtype)])
+    return pad[np.where((rows >= 0) & (rows < len(arr)), rows, len(arr))]
+
+
+def offset_scores(ref, cam, dlt, offsets, frames, chunk=50):
+    """
+    scores candidate offsets of cam against ref, both (frames, tracks, 2) arrays in the DLT coordinate system
+    dlt holds the coefficients of [ref, cam] (2 x 11), frames are the ref frames to use
+    returns the median reprojection error and the number of points triangulated for each offset
+    """
+    offsets = np.asarray(offsets, dtype=int)
+    med = np.full(len(offsets), np.nan)
+    num = np.zeros(len(offsets), dtype=int)
+    uvr = ref[frames].astype(float)
+    for i in range(0, len(offsets), chunk):
+        off = offsets[i:i + chunk]
+        uvc = shifted(cam, frames[None, :] + off[:, None])
+        # one "frame" per (offset, sampled frame), cameras ref and cam
+        arr = np.stack([np.broadcast_to(uvr, uvc.shape), uvc], axis=-2)
+        obs = tools.Observations.from_array(arr.reshape((-1,) + arr.shape[2:]))
+        xyz = tools.triangulate_obs(obs, dlt)
+        err = tools.repo_errors_obs(obs, xyz, dlt).reshape((len(off), -1))
+        for k in range(len(off)):
+            good = err[k][np.isfinite(err[k])]
+            num[i + k] = len(good)
+            if len(good):
+                med[i + k] = np.median(good)
+    return med, num
+
+
+def estimate_offsets(cams, dlt, search=500, sample=300, subframe=False, minfrac=0.25):
+    """
+    estimates the offset of each camera from its (frames, tracks, 2) tracks, in the DLT coordinate system (i.e.
+    flipped if the coefficients are from Argus or DLTdv 1-7), and the dlt coefficients (cams x 11)
+    every candidate is first scored on a fifth of the sampled frames, then the best few on all of them
+    candidates triangulating fewer than minfrac of the most points any candidate got are ignored
+    returns the offsets (first camera 0) and, for each camera, a dict with the best score, the number of points
+    and the coarse score of every candidate
+    """
+    ref = cams[0]
+    seen = np.flatnonzero(np.isfinite(ref).all(axis=-1).any(axis=-1))
+    if len(seen) == 0:
+        raise ValueError('the first camera has no tracked points')
+    frames = seen[np.unique(np.linspace(0, len(seen) - 1, min(sample, len(seen))).astype(int))]
+    cands = np.arange(-search, search + 1)
+    offsets = [0]
+    info = [{'offset': 0, 'score': np.nan, 'points': len(frames)}]
+    for c in range(1, len(cams)):
+        pair = dlt[[0, c]]
+        with profiling.stage('offset_search', items=len(cands)):
+            med, num = offset_scores(ref, cams[c], pair, cands, frames[::5])
+            ok = num >= max(1, minfrac * num.max())
+            if not ok.any() or np.isnan(med[ok]).all():
+                raise ValueError('camera {} has no points in common with the first camera'.format(c + 1))
+            # the best few, and their neighbours for the sub-frame fit, on all the sampled frames
+            top = cands[np.argsort(np.where(ok, med, np.inf))[:5]]
+            near = np.unique(np.clip((top[:, None] + np.arange(-1, 2)).ravel(), -search, search))
+            fmed, fnum = offset_scores(ref, cams[c], pair, near, frames)
+        score = np.where(fnum >= max(1, minfrac * fnum.max()), fmed, np.inf)
+        k = int(np.argmin(score))
+        best = int(near[k])
+        res = {'offset': best, 'score': float(score[k]), 'points': int(fnum[k]),
+               'candidates': cands.tolist(), 'scores': med.tolist()}
+        if subframe and 0 < k < len(near) - 1 and near[k - 1] == best - 1 and near[k + 1] == best + 1:
+            # vertex of the parabola through the scores at best - 1, best, best + 1
+            s0, s1, s2 = score[k - 1:k + 2]
+            curve = s0 - 2 * s1 + s2
+            if np.isfinite(curve) and curve > 0:
+                res['offset'] = round(best + 0.5 * (s0 - s2) / curve, 2)
+        offsets.append(res['offset'])
+        info.append(res)
+    return offsets, info
+
+
+def estimate_from_tracks(alldata, dltpath, heights=None, **kwargs):
+    """
+    estimate_offsets from the tracks loaded by dlc2dlt.load_tracks, all individuals together
+    heights (one per camera) flips the tracks to a lower left origin, for coefficients from Argus or DLTdv 1-7
+    dltpath is the path to the dlt coefficients or a tools.Calibration
+    """
+    cams = []
+    for c in range(len(alldata)):
+        arr = np.concatenate([alldata[c][k] for k in alldata[c]], axis=1).astype(float)
+        if heights is not None:
+            arr[..., 1] = heights[c] - arr[..., 1]
+        cams.append(arr)
+    dlt = tools.as_calibration(dltpath).dlt
+    return estimate_offsets(cams, dlt, **kwargs)
+
+
+if __name__ == '__main__':
+    from dlc2dlt import load_tracks, video_sizes
+    parser = argparse.ArgumentParser(
+        description='estimate camera frame offsets from DLC tracks and DLT coefficients')
+    parser.add_argument('-config', help='input path to DLC config file')
+    parser.add_argument('-dlctracks', nargs='+', help='input paths of DLC tracked coordinates (h5) in order used in DLT calibration')
+    parser.add_argument('-dlt', help='input path to dlt coefficients file')
+    parser.add_argument('-flipy', default=True, help='flip y coordinates - necessary for DLTdv versions 1-7 and Argus, set to False for DLTdv8, default = True')
+    parser.add_argument('-vid', default=None, nargs='+', help='paths to the videos if they are not located with the data files')
+    parser.add_argument('-like', default=0.9, help='likelihood threshold - defaults to 0.9')
+    parser.add_argument('-search', default=500, type=int, help='largest offset to try, in frames, default = 500')
+    parser.add_argument('-sample', default=300, type=int, help='number of frames of the first camera to use, default = 300')
+    parser.add_argument('-subframe', action='store_true', help='refine the offsets to a fraction of a frame')
+
+    args = parser.parse_args()
+
+    flipy = str(args.flipy).lower() not in ['false', '0']
+    alldata, _, _, scorers, _ = load_tracks(args.config, args.dlctracks, float(args.like))
+    heights = video_sizes(args.dlctracks, scorers, args.vid)[0] if flipy else None
+    offsets, info = estimate_from_tracks(alldata, args.dlt, heights, search=args.search, sample=args.sample,
+                                         subframe=args.subframe)
+    for c, res in enumerate(info[1:]):
+        print('camera {}: offset {}, median reprojection error {:.3f} px over {} points'.format(
+            c + 2, res['offset'], res['score'], res['points']))
+    # the tools take whole frames
+    print('-offsets ' + ' '.join(str(int(round(o))) for o in offsets))
@@ -4,8 +4,15 @@ More details are available at https://argus.web.unc.edu/ and https://github.com/
 
 If you use this code, please cite the argus paper, which can be found at https://journals.biologists.com/bio/article/5/9/1334/1215/3D-for-the-people-multi-camera-motion-capture-in
 """
+import io
+import json
+import hashlib
+from pathlib import Path
 import numpy as np
 import pandas as pd
+import profiling
+import kernels
+import cache
 
 
 def DLTcameraPosition(coefs):
@@ -92,6 +99,550 @@ def dlt_invert(dlt, heights):
     for c in range(dlt.shape[0]):
         invcoefs[c,:] = cFlip(dlt[c,:], heights[c])
 
+
+def xypts_to_array(pts, ncams):
+    """
+    reshapes a DLT xypts array (frames x tracks*ncams*2, columns ordered track, camera, x/y)
+    into a (frames, tracks, cams, 2) array
+    """
+    pts = np.asarray(pts)
+    return pts.reshape((pts.shape[0], -1, ncams, 2))
+
+
+def array_to_xypts(arr):
+    """
+    inverse of xypts_to_array, flattens a (frames, tracks, cams, 2) array to the DLT xypts column layout
+    """
+    return arr.reshape((arr.shape[0], -1))
+
+
+def read_xypts(xypath, start=None, end=None, dtype=None):
+    """
+    reads rows start <= row < end (0-indexed DLT frames, None for open ends) of an xypts file, or any csv file with
+    one row per frame, as a dataframe indexed by row; rows outside the window are skipped without being parsed
+    the parsed values are kept in the shared cache (see cache.py) until the file changes
+    """
+    start = max(int(start or 0), 0)
+    nrows = None if end is None else max(int(end) - start, 0)
+
+    def parse():
+        df = pd.read_csv(xypath, index_col=False, dtype=dtype, skiprows=range(1, start + 1), nrows=nrows)
+        return {'values': df.values, 'columns': np.array(df.columns, dtype=str)}
+    arrays = cache.cached('xypts', cache.make_key(cache.file_id(xypath), start, nrows, str(dtype)), parse)
+    return pd.DataFrame(arrays['values'], columns=list(arrays['columns']),
+                        index=pd.RangeIndex(start, start + len(arrays['values'])))
+
+
+def count_rows(path):
+    """
+    number of data rows of a csv file, without parsing it
+    """
+    return len(_csv_lines(path)[1])
+
+
+def flip_y(arr, heights):
+    """
+    flips the y coordinates of a (frames, tracks, cams, 2) array, one height per camera
+    origin is lower left in Argus and DLTdv 1-7, upper left in openCV, DLC, DLTdv8
+    flipping is its own inverse, so this works in either direction
+    """
+    out = arr.copy()
+    heights = np.asarray(heights, dtype=out.dtype)[:out.shape[2]]
+    out[..., 1] = heights - out[..., 1]
+    return out
+
+
+def shift_frames(arr, offsets, nrows=None, inverse=False):
+    """
+    applies per-camera frame offsets to a (frames, tracks, cams, 2) array in a single gather
+
+    forward (inverse=False) goes from video frame numbers to DLT rows: out[r] = in[r + offset]
+    inverse goes from DLT rows back to video frame numbers: out[f] = in[f - offset]
+    rows that fall outside the input are filled with NaN
+    nrows sets the number of output rows, defaults to the number of input rows
+    """
+    offsets = np.asarray(offsets, dtype=int)[:arr.shape[2]]
+    if inverse:
+        offsets = -offsets
+    if nrows is None:
+        nrows = arr.shape[0]
+    # source row for every (output row, camera)
+    src = np.arange(nrows)[:, None] + offsets[None, :]
+    valid = (src >= 0) & (src < arr.shape[0])
+    src = np.clip(src, 0, max(arr.shape[0] - 1, 0))
+    tr = np.arange(arr.shape[1])[None, :, None]
+    cams = np.arange(arr.shape[2])[None, None, :]
+    out = arr[src[:, None, :], tr, cams]
+    out[~np.broadcast_to(valid[:, None, :], out.shape[:3])] = np.nan
+    return out
+
+
+def shift_crop(arr, origins, inverse=False):
+    """
+    converts between cropped and full frame coordinates
+    origins are the upper left corners of the crop, either (cams, 2) or per frame (frames, cams, 2)
+    forward adds the origin (cropped -> full), inverse subtracts it (full -> cropped)
+    """
+    origins = np.asarray(origins, dtype=arr.dtype)
+    if origins.ndim == 2:
+        origins = origins[None, None, :, :]
+    else:
+        origins = origins[:, None, :, :]
+    if inverse:
+        return arr - origins
+    return arr + origins
+
+
+def transform_coords(arr, heights=None, offsets=None, origins=None, nrows=None, inverse=False):
+    """
+    shared coordinate transform stage for all the conversion tools
+    arr is a (frames, tracks, cams, 2) array
+
+    forward (inverse=False) goes from video/DLC space to DLT space:
+        add crop origins (video frames), then shift by frame offsets, then flip y
+    inverse goes from DLT space to video/DLC space:
+        flip y, shift back to video frames, then subtract crop origins
+    any step whose parameter is None is skipped
+    float32 and float64 arrays keep their precision, anything else becomes float64
+    """
+    out = np.array(arr, dtype=np.result_type(arr, np.float32))
+    if inverse:
+        if heights is not None:
+            out = flip_y(out, heights)
+        if offsets is not None:
+            out = shift_frames(out, offsets, nrows=nrows, inverse=True)
+        if origins is not None:
+            out = shift_crop(out, origins, inverse=True)
+    else:
+        if origins is not None:
+            out = shift_crop(out, origins)
+        if offsets is not None:
+            out = shift_frames(out, offsets, nrows=nrows)
+        if heights is not None:
+            out = flip_y(out, heights)
+    return out
+
+
+def fill_gaps(arr, maxgap, method='linear'):
+    """
+    fills the NaN gaps of up to maxgap frames along the first axis of arr (frames, ...), where there are points on
+    both sides, every column at once
+    method 'linear', or 'spline' for a cubic through the two points on each side of the gap (linear where there is
+    only one)
+    """
+    if method not in ['linear', 'spline']:
+        raise ValueError("method must be 'linear' or 'spline'")
+    flat = arr.reshape((len(arr), -1))
+    nrows = len(flat)
+    valid = ~np.isnan(flat)
+    idx = np.arange(nrows, dtype=np.int32)[:, None]
+    # last point at or before, and first point at or after, each frame
+    prev = np.maximum.accumulate(np.where(valid, idx, -1), axis=0)
+    nxt = np.minimum.accumulate(np.where(valid, idx, nrows)[::-1], axis=0)[::-1]
+    r, c = np.nonzero(~valid & (prev >= 0) & (nxt < nrows) & (nxt - prev - 1 <= maxgap))
+    out = flat.copy()
+    if len(r) == 0:
+        return out.reshape(arr.shape)
+    p = prev[r, c]
+    q = nxt[r, c]
+    t = (r - p) / (q - p)
+    out[r, c] = flat[p, c] + t * (flat[q, c] - flat[p, c])
+    if method == 'spline':
+        pp = p - 1
+        qq = q + 1
+        ok = (pp >= 0) & (qq < nrows)
+        ok[ok] = valid[pp[ok], c[ok]] & valid[qq[ok], c[ok]]
+        # lagrange cubic through the frames pp, p, q, qq
+        x = np.stack([pp, p, q, qq])[:, ok].astype(float)
+        y = np.stack([flat[pp[ok], c[ok]], flat[p[ok], c[ok]], flat[q[ok], c[ok]], flat[qq[ok], c[ok]]])
+        val = np.zeros(ok.sum())
+        for i in range(4):
+            term = y[i]
+            for j in range(4):
+                if j != i:
+                    term = term * (r[ok] - x[j]) / (x[i] - x[j])
+            val += term
+        out[r[ok], c[ok]] = val
+    return out.reshape(arr.shape)
+
+
+def jump_outliers(arr, maxjump):
+    """
+    single frame jumps (e.g. identity swaps) in a (frames, tracks, cams, 2) array: points that are more than maxjump
+    pixels per frame from both the previous and the next point of their track and camera, while those two are
+    within maxjump pixels per frame of each other
+    returns a (frames, tracks, cams) boolean mask
+    """
+    nrows = len(arr)
+    flat = arr.reshape((nrows, -1, 2))
+    valid = np.isfinite(flat).all(axis=-1)
+    idx = np.arange(nrows, dtype=np.int32)[:, None]
+    # previous and next point, not counting the point itself
+    prev = np.maximum.accumulate(np.where(valid, idx, -1), axis=0)
+    prev = np.vstack([np.full((1, prev.shape[1]), -1, dtype=prev.dtype), prev[:-1]])
+    nxt = np.minimum.accumulate(np.where(valid, idx, nrows)[::-1], axis=0)[::-1]
+    nxt = np.vstack([nxt[1:], np.full((1, nxt.shape[1]), nrows, dtype=nxt.dtype)])
+    r, c = np.nonzero(valid & (prev >= 0) & (nxt < nrows))
+
+    def speed(a, b):
+        d = flat[b, c] - flat[a, c]
+        return np.sqrt(d[:, 0] ** 2 + d[:, 1] ** 2) / (b - a)
+
+    # jumps are rare, so the speed from the previous point first, then the rest only where that is too fast
+    p = prev[r, c]
+    fast = speed(p, r) > maxjump
+    r, c, p = r[fast], c[fast], p[fast]
+    q = nxt[r, c]
+    jump = (speed(r, q) > maxjump) & (speed(p, q) <= maxjump)
+    out = np.zeros(valid.shape, dtype=bool)
+    out[r[jump], c[jump]] = True
+    return out.reshape(arr.shape[:3])
+
+
+def clean_tracks(arr, like=None, maxgap=0, maxjump=None):
+    """
+    cleans a (frames, tracks, cams, 2) array before triangulation: removes single frame jumps of more than maxjump
+    pixels per frame (see jump_outliers), then fills gaps of up to maxgap frames linearly (see fill_gaps), the
+    likelihoods (frames, tracks, cams) of filled points are interpolated the same way
+    returns the cleaned array, likelihoods and a (frames, tracks, cams) int8 array of flags: 1 for removed jumps,
+    2 for filled points (3 for a jump that was filled)
+    """
+    arr = arr.copy()
+    flags = np.zeros(arr.shape[:3], dtype=np.int8)
+    if maxjump is not None:
+        jump = jump_outliers(arr, maxjump)
+        arr[jump] = np.nan
+        flags[jump] |= 1
+    if maxgap:
+        missing = np.isnan(arr).any(axis=-1)
+        arr = fill_gaps(arr, maxgap)
+        filled = missing & np.isfinite(arr).all(axis=-1)
+        flags[filled] |= 2
+        if like is not None:
+            like = fill_gaps(np.where(missing, np.nan, like), maxgap)
+    return arr, like, flags
+
+
+class Observations:
+    """
+    sparse table of 2D observations, one row per digitized point: frame, track, camera, u, v (and likelihood)
+    xypts data is mostly NaN, so conversion and triangulation work on this, and the dense
+    (frames, tracks, cams, 2) array is only made (to_array) when writing DLT files
+    shape is the (frames, tracks, cams) of that dense array
+    u, v and likelihoods keep the precision they are given in (float32 or float64)
+    """
+    def __init__(self, frame, track, cam, uv, shape, like=None):
+        self.frame = np.asarray(frame, dtype=np.int32)
+        self.track = np.asarray(track, dtype=np.int32)
+        self.cam = np.asarray(cam, dtype=np.int32)
+        uv = np.asarray(uv)
+        self.uv = uv.astype(np.result_type(uv, np.float32), copy=False).reshape((-1, 2))
+        self.shape = tuple(int(s) for s in shape)
+        self.like = None if like is None else np.asarray(like, dtype=self.uv.dtype)
+
+    def __len__(self):
+        return len(self.frame)
+
+    @classmethod
+    def from_array(cls, arr, like=None):
+        """
+        from a dense (frames, tracks, cams, 2) array, keeping points where both u and v are finite
+        like is an optional (frames, tracks, cams) array of likelihoods
+        """
+        arr = np.asarray(arr)
+        f, t, c = np.nonzero(np.isfinite(arr).all(axis=-1))
+        return cls(f, t, c, arr[f, t, c], arr.shape[:3], None if like is None else like[f, t, c])
+
+    @classmethod
+    def from_cameras(cls, arrs, likes=None):
+        """
+        from one (frames, tracks, 2) array per camera, which may have different numbers of frames
+        likes is an optional (frames, tracks) array of likelihoods per camera
+        """
+        parts = []
+        for c, arr in enumerate(arrs):
+            f, t = np.nonzero(np.isfinite(arr).all(axis=-1))
+            parts.append((f, t, np.full(len(f), c), arr[f, t], None if likes is None else likes[c][f, t]))
+        shape = (max(len(a) for a in arrs), arrs[0].shape[1], len(arrs))
+        like = None if likes is None else np.concatenate([p[4] for p in parts])
+        return cls(*[np.concatenate([p[i] for p in parts]) for i in range(4)], shape, like)
+
+    @classmethod
+    def join_tracks(cls, tables):
+        """
+        one table with the tracks of all the tables side by side (e.g. one table per individual), which may have
+        different numbers of frames, returns it and the first track of each table in it
+        """
+        firsts = np.cumsum([0] + [t.shape[1] for t in tables])
+        shape = (max(t.shape[0] for t in tables), firsts[-1]) + tables[0].shape[2:]
+        like = None if any(t.like is None for t in tables) else np.concatenate([t.like for t in tables])
+        return cls(np.concatenate([t.frame for t in tables]),
+                   np.concatenate([t.track + f for t, f in zip(tables, firsts)]),
+                   np.concatenate([t.cam for t in tables]), np.concatenate([t.uv for t in tables]),
+                   shape, like), firsts[:-1]
+
+    def select(self, mask):
+        return Observations(self.frame[mask], self.track[mask], self.cam[mask], self.uv[mask], self.shape,
+                            None if self.like is None else self.like[mask])
+
+    def to_array(self):
+        """
+        the dense (frames, tracks, cams, 2) array, NaN where there is no observation
+        """
+        out = np.full(self.shape + (2,), np.nan, dtype=self.uv.dtype)
+        out[self.frame, self.track, self.cam] = self.uv
+        return out
+
+    def like_array(self):
+        """
+        the dense (frames, tracks, cams) array of likelihoods, NaN where there is no observation
+        """
+        out = np.full(self.shape, np.nan, dtype=self.uv.dtype)
+        if self.like is not None:
+            out[self.frame, self.track, self.cam] = self.like
+        return out
+
+    def shift_frames(self, offsets, nrows=None, inverse=False):
+        """
+        same as shift_frames for the dense array: forward out[r] = in[r + offset], inverse out[f] = in[f - offset]
+        observations that fall outside the nrows output rows are dropped
+        """
+        offsets = np.asarray(offsets, dtype=np.int32)[:self.shape[2]]
+        if nrows is None:
+            nrows = self.shape[0]
+        frame = self.frame + offsets[self.cam] if inverse else self.frame - offsets[self.cam]
+        keep = (frame >= 0) & (frame < nrows)
+        out = self.select(keep)
+        out.frame = frame[keep]
+        out.shape = (nrows,) + self.shape[1:]
+        return out
+
+    def flip_y(self, heights):
+        """
+        same as flip_y for the dense array
+        """
+        out = self.select(slice(None))
+        out.uv = self.uv.copy()
+        out.uv[:, 1] = np.asarray(heights, dtype=self.uv.dtype)[self.cam] - out.uv[:, 1]
+        return out
+
+    def undistort(self, prof):
+        """
+        undistorts all observations, one call per camera, prof is the camera profile from load_camera
+        pinhole profiles use the compiled kernels.undistort_pinhole if Numba is installed
+        """
+        out = self.select(slice(None))
+        out.uv = self.uv.copy()
+        for c in np.unique(self.cam):
+            sel = self.cam == c
+            if kernels.NUMBA and isinstance(prof[c], np.ndarray):
+                out.uv[sel] = kernels.undistort_pinhole(self.uv[sel].astype(float), prof[c].astype(float))
+            else:
+                out.uv[sel] = undistort_pts(self.uv[sel], prof[c])
+        return out
+
+
+def _point_index(obs):
+    """
+    numbers the points (frame, track) that have observations
+    returns the flat (frame * tracks + track) index of each point, the point number of each observation, and the
+    number of cameras that saw each point
+    """
+    point = obs.frame.astype(np.int64) * obs.shape[1] + obs.track
+    return np.unique(point, return_inverse=True, return_counts=True)
+
+
+def _point_groups(obs):
+    """
+    sorts the observations by point (frame, track), for the kernels
+    returns the sort order, the flat index of each point, and where each point's observations start and how many there are
+    """
+    point = obs.frame.astype(np.int64) * obs.shape[1] + obs.track
+    order = np.argsort(point, kind='stable')
+    points, starts, counts = np.unique(point[order], return_index=True, return_counts=True)
+    return order, points, starts, counts
+
+
+def triangulate_obs(obs, dlt, weights=None):
+    """
+    least squares xyz of every (frame, track) seen by 2 or more cameras
+    takes an Observations table and dlt coefficients (cams x 11)
+    weights (one per observation, e.g. DLC likelihoods) make it a weighted least squares solve
+    returns a (frames, tracks, 3) array, NaN where a point was seen by fewer than 2 cameras
+    the solve is always done in float64, whatever the precision of the observations
+    uses the compiled kernels.solve_groups if Numba is installed
+    """
+    nframes, ntracks = obs.shape[:2]
+    xyz = np.full((nframes * ntracks, 3), np.nan)
+    if kernels.NUMBA:
+        order, points, starts, counts = _point_groups(obs)
+        w = np.ones(len(obs)) if weights is None else np.asarray(weights, dtype=float)[order]
+        xyz[points] = kernels.solve_groups(obs.uv[order].astype(float), obs.cam[order], starts, counts,
+                                           np.ascontiguousarray(dlt, dtype=float), w)
+        return xyz.reshape((nframes, ntracks, 3))
+    points, inv, counts = _point_index(obs)
+    # normal equations of each point, summed over its observations one camera at a time
+    AtA = np.zeros((len(points), 3, 3))
+    Atb = np.zeros((len(points), 3))
+    for c in np.unique(obs.cam):
+        sel = obs.cam == c
+        L = np.asarray(dlt[c], dtype=float)
+        u = obs.uv[sel, 0:1].astype(float)
+        v = obs.uv[sel, 1:2].astype(float)
+        # two rows of the linear system per observation, as in uv_to_xyz
+        Au = u * L[8:11] - L[0:3]
+        Av = v * L[8:11] - L[4:7]
+        bu = L[3] - u[:, 0]
+        bv = L[7] - v[:, 0]
+        if weights is not None:
+            # weighting both equations of an observation is the same as scaling its products by w
+            w = np.asarray(weights, dtype=float)[sel]
+            bu = bu * w
+            bv = bv * w
+        for i in range(3):
+            Atb[:, i] += np.bincount(inv[sel], Au[:, i] * bu + Av[:, i] * bv, minlength=len(points))
+            wAu = Au[:, i] if weights is None else Au[:, i] * w
+            wAv = Av[:, i] if weights is None else Av[:, i] * w
+            for j in range(i, 3):
+                AtA[:, i, j] += np.bincount(inv[sel], wAu * Au[:, j] + wAv * Av[:, j], minlength=len(points))
+    for i in range(3):
+        for j in range(i + 1, 3):
+            AtA[:, j, i] = AtA[:, i, j]
+    good = counts > 1
+    AtA = AtA[good]
+    Atb = Atb[good]
+    try:
+        sol = np.linalg.solve(AtA, Atb[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        # a degenerate point somewhere, solve them one by one
+        sol = np.stack([np.linalg.lstsq(a, b, rcond=None)[0] for a, b in zip(AtA, Atb)]).reshape((-1, 3))
+    xyz[points[good]] = sol
+    return xyz.reshape((nframes, ntracks, 3))
+
+
+def repo_errors_obs(obs, xyz, dlt):
+    """
+    rmse reprojection error of each point, as in get_repo_errors
+    takes an Observations table, the (frames, tracks, 3) xyz array from triangulate_obs and dlt coefficients
+    returns a (frames, tracks) array, NaN where there is no xyz
+    uses the compiled kernels.repo_groups if Numba is installed
+    """
+    nframes, ntracks = obs.shape[:2]
+    err = np.full(nframes * ntracks, np.nan)
+    if kernels.NUMBA:
+        order, points, starts, counts = _point_groups(obs)
+        err[points] = kernels.repo_groups(obs.uv[order].astype(float), obs.cam[order], starts, counts,
+                                          xyz.reshape((-1, 3))[points], np.ascontiguousarray(dlt, dtype=float))
+        err[err == 0] = np.nan
+        return err.reshape((nframes, ntracks))
+    points, inv, counts = _point_index(obs)
+    pxyz = xyz.reshape((-1, 3))[points]
+    sq = np.zeros(len(points))
+    for c in np.unique(obs.cam):
+        sel = obs.cam == c
+        L = np.asarray(dlt[c], dtype=float)
+        p = pxyz[inv[sel]]
+        den = np.dot(p, L[8:11]) + 1.
+        ru = (np.dot(p, L[0:3]) + L[3]) / den
+        rv = (np.dot(p, L[4:7]) + L[7]) / den
+        du = obs.uv[sel, 0].astype(float) - ru
+        dv = obs.uv[sel, 1].astype(float) - rv
+        sq += np.bincount(inv[sel], du ** 2 + dv ** 2, minlength=len(points))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        err[points] = np.sqrt(sq / (counts * 2 - 3))
+    err[err == 0] = np.nan
+    return err.reshape((nframes, ntracks))
+
+
+def _camera_subsets(ncams, subsets):
+    """
+    (subsets, cams) boolean masks of the camera subsets reject_cameras tries
+    """
+    if subsets == 'leave_one_out':
+        return ~np.eye(ncams, dtype=bool)
+    if subsets == 'all':
+        masks = (np.arange(1 << ncams)[:, None] >> np.arange(ncams)) & 1 == 1
+        return masks[(masks.sum(axis=1) >= 2) & (masks.sum(axis=1) < ncams)]
+    raise ValueError("subsets must be 'leave_one_out' or 'all'")
+
+
+def reject_cameras(obs, dlt, thresh, subsets='leave_one_out', weights=None, chunk=50000):
+    """
+    finds the cameras to leave out of points whose reprojection error (rmse over all their cameras) is above thresh
+    pixels, e.g. one bad DLC detection
+    for each such point, every subset of its cameras (all but one, or with subsets='all' every subset of 2 or more)
+    is solved at once, and the largest subset with an error at or under thresh is kept, the one with the lowest error
+    if there are several; points without such a subset keep all their cameras
+    returns a boolean mask of the observations to keep, and a (frames, tracks) bitmask of the cameras left out of
+    each point (bit c set for camera c + 1)
+    """
+    nframes, ntracks, ncams = obs.shape
+    keep = np.ones(len(obs), dtype=bool)
+    rejected = np.zeros((nframes, ntracks), dtype=np.int64)
+    # the usual solution first, only the points that don't fit it need the subsets
+    xyz = triangulate_obs(obs, dlt, weights)
+    points, inv, counts = _point_index(obs)
+    err = repo_errors_obs(obs, xyz, dlt).ravel()[points]
+    with np.errstate(invalid='ignore'):
+        bad = np.flatnonzero((err > thresh) & (counts > 2))
+    if len(bad) == 0:
+        return keep, rejected
+    L = np.asarray(dlt, dtype=float)[:ncams]
+    masks = _camera_subsets(ncams, subsets)
+    pos = np.full(len(points), -1)
+    pos[bad] = np.arange(len(bad))
+    sel = np.flatnonzero(pos[inv] >= 0)
+    best = np.full(len(bad), -1)
+    for start in range(0, len(bad), chunk):
+        stop = min(start + chunk, len(bad))
+        # the observations of these points as dense (points, cams) arrays
+        osel = sel[(pos[inv[sel]] >= start) & (pos[inv[sel]] < stop)]
+        b = pos[inv[osel]] - start
+        c = obs.cam[osel]
+        uv = np.full((stop - start, ncams, 2), np.nan)
+        uv[b, c] = obs.uv[osel]
+        w = np.zeros((stop - start, ncams))
+        w[b, c] = 1. if weights is None else np.asarray(weights, dtype=float)[osel]
+        present = w > 0
+        u = np.nan_to_num(uv[..., 0:1])
+        v = np.nan_to_num(uv[..., 1:2])
+        # each camera's part of the normal equations, as in triangulate_obs
+        Au = u * L[:, 8:11] - L[:, 0:3]
+        Av = v * L[:, 8:11] - L[:, 4:7]
+        bu = L[:, 3] - u[..., 0]
+        bv = L[:, 7] - v[..., 0]
+        M = w[..., None, None] * (Au[..., :, None] * Au[..., None, :] + Av[..., :, None] * Av[..., None, :])
+        r = w[..., None] * (Au * bu[..., None] + Av * bv[..., None])
+        key = np.full(stop - start, -np.inf)
+        for s, mask in enumerate(masks):
+            m = present & mask
+            k = m.sum(axis=1)
+            valid = (k >= 2) & (k < present.sum(axis=1))
+            AtA = np.einsum('pc,pcij->pij', m, M)
+            AtA[~valid] = np.eye(3)
+            Atb = np.einsum('pc,pci->pi', m, r)
+            try:
+                sol = np.linalg.solve(AtA, Atb[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                sol = np.einsum('pij,pj->pi', np.linalg.pinv(AtA), Atb)
+            den = sol @ L[:, 8:11].T + 1.
+            ru = (sol @ L[:, 0:3].T + L[:, 3]) / den
+            rv = (sol @ L[:, 4:7].T + L[:, 7]) / den
+            sq = np.where(m, (uv[..., 0] - ru) ** 2 + (uv[..., 1] - rv) ** 2, 0.).sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                res = np.sqrt(sq / (2 * k - 3))
+            # more cameras first, then the lowest error
+            score = np.where(valid & (res <= thresh), k * 1e6 - res, -np.inf)
+            better = score > key
+            key[better] = score[better]
+            best[start:stop][better] = s
+        dropped = present & (best[start:stop, None] >= 0) & ~masks[best[start:stop]]
+        keep[osel] = ~dropped[b, c]
+        fr, tr = np.divmod(points[bad[start:stop]], ntracks)
+        rejected[fr, tr] = (dropped * (1 << np.arange(ncams))).sum(axis=1)
+    return keep, rejected
+
+
 def load_camera(filename):
     if filename:
         camera_profile = np.loadtxt(filename)
@@ -102,6 +653,54 @@ def load_camera(filename):
             camera_profile = np.delete(camera_profile, [0, 2, 3, 6], axis=1)
             return camera_profile
 
+# calibrations loaded so far, keyed by file, modification time and flip settings
+# long-lived processes (e.g. worker.py) then only load and decompose each calibration once, and other processes get
+# them from the shared cache
+_calib_cache = {}
+
+
+def _cached(path, extra, loader):
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_mtime_ns, stat.st_size) + tuple(extra)
+    if key not in _calib_cache:
+        diskkey = cache.make_key(loader.__qualname__, list(key))
+        arrays = cache.get('calibration', diskkey)
+        if arrays is None:
+            val = loader(path)
+            if val is not None:
+                cache.put('calibration', diskkey, {'value': val})
+        else:
+            val = arrays['value']
+        _calib_cache[key] = val
+    val = _calib_cache[key]
+    return None if val is None else val.copy()
+
+
+def load_dlt(dltpath, flipy=False, heights=None):
+    """
+    loads DLT coefficients (cams x 11) from an Argus/DLTdv coefficients csv (one column per camera)
+    if flipy, the coefficients are converted to an upper left origin using one height per camera
+    results are cached, so repeated calls with an unchanged file are free
+    """
+    def loader(path):
+        coefs = pd.read_csv(path, index_col = False, header = None).values.T
+        if flipy:
+            for c in range(min(coefs.shape[0], len(heights))):
+                coefs[c, :] = cFlip(coefs[c, :], heights[c])
+        return coefs
+    return _cached(dltpath, (bool(flipy), tuple(heights) if flipy else None), loader)
+
+
+def load_camera_cached(filename):
+    """
+    load_camera, cached like load_dlt
+    """
+    if not filename:
+        return None
+    return _cached(filename, (), load_camera)
+
+
 # undistort using OpenCV
 """
 Parameters:
@@ -125,12 +724,14 @@ def undistort_pts(pts, prof):
         src = np.zeros((1, pts.shape[0], 2), dtype=np.float32)
         src[0] = pts
         ret = cv2.undistortPoints(src, K, prof[-5:], P=K)
-        return ret[0]
+        # newer opencv returns (N, 1, 2), older (1, N, 2)
+        return ret.reshape((-1, 2))
 
     else:
         # return prof.undistort_points(pts.T).T # broken due to numpy 1d transpose no-op
         return prof.undistort_points(pts.reshape((-1, 1))).T
 
+
 def uv_to_xyz(pts, dlt, prof=None):
     """
     takes uv coordinates for a single point (ncols = ncams *2) and dlt array
@@ -229,84 +830,753 @@ def get_repo_errors(xyzs, pts, prof, dlt):
     ret[ret == 0] = np.nan
     return ret
 
-def triangulate(xypath, dltpath, profpath=None, flipy = False, heights = [688, 688]):
+# rows per block for incremental triangulation, see triangulate
+INCREMENTAL_BLOCK = 256
+
+
+def _track_names(header):
+    tracks = []
+    for st in header.split(','):
+        if st.rsplit('_', 3)[0] not in tracks:
+            tracks.append(st.rsplit('_', 3)[0])
+    return tracks
+
+
+def _csv_lines(path):
+    """
+    header and data lines (bytes, with line endings) of a csv file, blank lines skipped as pandas does
+    """
+    with open(path, 'rb') as f:
+        lines = f.read().splitlines(keepends=True)
+    return lines[0], [ln for ln in lines[1:] if ln.strip()]
+
+
+def _parse_lines(header, lines, dtype, **kwargs):
+    return pd.read_csv(io.BytesIO(header + b''.join(lines)), index_col=False, dtype=dtype, **kwargs).values
+
+
+def _block_hashes(lines, size):
+    return [hashlib.sha1(b''.join(lines[i:i + size])).hexdigest() for i in range(0, len(lines), size)]
+
+
+def _track_hashes(pts, ntracks, size):
+    """
+    sha1 of each track's 2D data in each block of rows, as a (blocks, tracks) list
+    """
+    arr = pts.reshape((len(pts), ntracks, pts.shape[1] // ntracks))
+    return [[hashlib.sha1(np.ascontiguousarray(arr[i:i + size, t]).tobytes()).hexdigest() for t in range(ntracks)]
+            for i in range(0, len(arr), size)]
+
+
+def _file_stats(paths):
+    try:
+        return [[p.stat().st_mtime_ns, p.stat().st_size] for p in paths]
+    except OSError:
+        return None
+
+
+def write_likelihoods(basename, obs):
+    """
+    saves the likelihood of each point of an Observations table, with its u, v as written to the xypts file, as
+    basename + likelihood.npz, to threshold or weight the points when triangulating (see load_likelihoods)
+    """
+    np.savez_compressed(basename + 'likelihood.npz', xy=obs.to_array(), like=obs.like_array())
+
+
+def load_likelihoods(filename, arr, rows=None, tol=1e-3):
+    """
+    the (frames, tracks, cams) likelihoods of the points in arr, the dense xypts array (or the given rows of it),
+    from filename + likelihood.npz
+    points that aren't in the file, or have moved by more than tol pixels since it was written (i.e. were corrected
+    in Argus or DLTdv) get NaN, which counts as fully trusted
+    returns None if there is no likelihood file, or it doesn't match the tracks and cameras of arr
+    """
+    path = Path(filename + 'likelihood.npz')
+    if not path.exists():
+        return None
+    with np.load(path) as f:
+        xy = f['xy']
+        like = f['like']
+    if xy.shape[1:] != arr.shape[1:]:
+        print('{} does not match the xypts tracks and cameras, not used'.format(path.name))
+        return None
+    rows = np.arange(len(arr)) if rows is None else np.asarray(rows)
+    out = np.full(arr.shape[:3], np.nan, dtype=like.dtype)
+    inside = rows < len(xy)
+    same = (np.abs(arr[inside] - xy[rows[inside]]) <= tol).all(axis=-1)
+    out[inside] = np.where(same, like[rows[inside]], np.nan)
+    return out
+
+
+def _observations(filename, arr, like=None, weighted=False, rows=None):
+    """
+    Observations of a dense xypts array, with likelihoods from the likelihood file if they are needed to threshold
+    (like) or weight the points, points at or below the like threshold are dropped
+    """
+    likes = load_likelihoods(filename, arr, rows) if (weighted or like is not None) else None
+    obs = Observations.from_array(arr, like=likes)
+    if like is not None and obs.like is not None:
+        obs = obs.select(~(obs.like <= like))
+    return obs
+
+
+def _solve_obs(obs, dlt, prof, flipy, heights, weighted=False, robust=None, subsets='leave_one_out', source=None):
+    """
+    flips and undistorts an Observations table, then triangulates it
+    with weighted, each observation is weighted by its likelihood (NaN likelihoods count as 1)
+    with robust (pixels), cameras that don't fit are left out of each point first, see reject_cameras
+    returns the (frames, tracks, 3) xyz, (frames, tracks) reprojection errors and (frames, tracks) bitmask of the
+    cameras left out (None without robust)
+    source identifies where the points came from (see _points_source), to keep their undistorted points in the
+    shared cache, None to not cache them
+    """
+    if flipy:
+        with profiling.stage('flip', items=len(obs)):
+            obs = obs.flip_y(heights)
+
+    # undistort every point once, up front, so the solve and the residuals don't each have to
+    # the undistorted points of a file are kept in the shared cache, keyed by the file, the settings and the profile
+    if prof is not None:
+        with profiling.stage('undistort', items=len(obs)):
+            if source is None:
+                obs = obs.undistort(prof)
+            else:
+                key = cache.make_key(source, np.asarray(prof, dtype=float), kernels.NUMBA)
+                uv = cache.cached('undistort', key, lambda: {'uv': obs.undistort(prof).uv})['uv']
+                obs = obs.select(slice(None))
+                obs.uv = uv
+
+    weights = np.where(np.isnan(obs.like), 1., obs.like) if weighted and obs.like is not None else None
+    rejected = None
+    if robust is not None:
+        with profiling.stage('reject', items=len(obs)):
+            keep, rejected = reject_cameras(obs, dlt, robust, subsets, weights)
+            obs = obs.select(keep)
+            weights = None if weights is None else weights[keep]
+
+    with profiling.stage('solve', items=len(obs)):
+        xyz = triangulate_obs(obs, dlt, weights)
+    # get reprojection errors for all 3d points, unweighted
+    with profiling.stage('residuals', items=len(obs)):
+        errs = repo_errors_obs(obs, xyz, dlt)
+    return xyz, errs, rejected
+
+
+def _points_source(xypath, start, end, precision, like, flipy, heights, ncams):
+    """
+    what identifies the points read from xypath with these settings (flipped, thresholded by like), so their
+    undistorted points can be cached without hashing them
+    """
+    likepath = Path(str(xypath).split('xypts')[0] + 'likelihood.npz')
+    return [cache.file_id(xypath), start, end, str(precision), like, bool(flipy),
+            [float(h) for h in heights[:ncams]] if flipy else None,
+            cache.file_id(likepath) if like is not None and likepath.exists() else None]
+
+
+def _xyz_frames(xyz, errs, tracks, index=None):
+    xyz_cols = list()
+    for k in range(len(tracks)):
+        xyz_cols.append(tracks[k] + '_X')
+        xyz_cols.append(tracks[k] + '_Y')
+        xyz_cols.append(tracks[k] + '_Z')
+    dataf1 = pd.DataFrame(xyz.reshape((len(xyz), 3 * len(tracks))), columns=xyz_cols, index=index)
+    dataf2 = pd.DataFrame(errs, columns=tracks, index=index)
+    return dataf1, dataf2
+
+
+@profiling.profiled('triangulate')
+def triangulate(xypath, dltpath, profpath=None, flipy = False, heights = [688, 688], precision='float64',
+                incremental=False, like=None, weighted=False, robust=None, subsets='leave_one_out', start=None, end=None,
+                embed=False):
     """
     This function is specific to the DLTconvertDLC repository.
     It provides a function to automate triangulation of xypts files from either DLC conversion or manual digitizing. 
 
     Parameters
     ----------
-    xypath: string
-        Full path to xypts.csv file
-    dltpath: string
-        Full path to the dlt coefficients file (.csv) generated by Argus Wand or DLTdv
+    xypath: string or Points2D
+        Full path to xypts.csv file, or the points in memory (then nothing is written, see Outputs)
+    dltpath: string or Calibration
+        Full path to the dlt coefficients file (.csv) generated by Argus Wand or DLTdv, or a Calibration in memory
+        (which has its own camera profile, profpath is then not used)
     profpath: string
         Full path to the camera profile file (.txt) generated from Argus Calibrate. If 'None', no undistortion is performed.
     flipy: boolean
         Flips y-coordinates. 'False' if dlt coefficients were created with DLTdv8, true for dlt coefficients from Argus or from DLTdv < 7.
     heights: list
         One entry per camera, the vertical resolution. Important for flipping y coordinates. 
+    precision: string
+        'float64' or 'float32', precision of the 2D points in memory. The 3D solve is always done in float64.
+    incremental: boolean
+        If True, hashes of the xypts file (per block of rows and per track) and of the calibration are kept in
+        _xyzstate.json next to the outputs. On the next call, only the tracks in the blocks of rows that changed are
+        re-triangulated and patched into the existing _xyzpts.csv and _xyzres.csv. Everything is redone if the
+        calibration, the settings, the number of rows or the outputs themselves changed.
+    like: float
+        If given, points with a DLC likelihood at or below like (from the _likelihood.npz file dlc2dlt writes next to
+        the xypts file) are left out. Only thresholds above the one given to dlc2dlt have an effect, so run dlc2dlt
+        with -like 0 to choose the threshold here instead.
+    weighted: boolean
+        If True, each camera's point is weighted by its DLC likelihood in the least squares solve. Points without a
+        likelihood (digitized or corrected in Argus/DLTdv) get weight 1.
+    robust: float
+        If given (pixels), points with a reprojection error above robust are re-solved without the camera(s) that
+        don't fit, e.g. one bad DLC detection: the largest subset of cameras with an error at or under robust is kept.
+        The cameras left out of each point are saved as a bitmask (1 for camera 1, 2 for camera 2, 4 for camera 3, ...)
+        in _xyzrejected.csv. Off by default.
+    subsets: string
+        'leave_one_out' (try leaving out each camera in turn) or 'all' (every subset of 2 or more cameras, only
+        sensible with a few cameras).
+    start, end: int
+        If given, only the xypts rows start <= row < end (0-indexed DLT frames) are read and triangulated. The outputs
+        then only have those rows (row 0 is row start of the xypts file), unless embed is True.
+    embed: boolean
+        With start/end, write the window into full length outputs instead: its rows are patched into the existing
+        _xyzpts.csv and _xyzres.csv if they have as many rows as the xypts file, otherwise those are written with
+        NaN outside the window. Can't be combined with incremental.
     Outputs
     -------
     dataf1: Pandas dataframe of xyzpts
     dataf2: Pandas dataframe of reconstruction residuals
     dataf1 and dataf2 are saved as _xyzpts.csv and _res.csv files, respectively, with the same file name stem as the file entered for xypath
+    with incremental=True, dataf1 and dataf2 only have the rows that were re-triangulated (indexed by frame), unless
+    the whole file was redone; with embed, they have the rows of the window (indexed by frame)
+    given a Points2D, the Points3D is returned instead and nothing is written (Points3D.write saves it)
     """
     
+    windowed = start is not None or end is not None
+    if incremental and windowed:
+        raise ValueError('incremental triangulation works on the whole file, not a frame window')
+    if isinstance(xypath, Points2D):
+        if incremental or embed:
+            raise ValueError('incremental and embed update the files of an xypts file, give its path')
+        points = xypath.window(start, end) if windowed else xypath
+        return triangulate_points(points, as_calibration(dltpath, profpath), flipy, heights, like, weighted, robust,
+                                  subsets)
     filename = str(xypath).split('xypts')[0]
-    # get track names
-    track_csv = open(xypath)
-    header = track_csv.readline()
-    track_csv.close()
-    new_tracks = []
-    header = header.split(',')
-    for st in header:
-        if st.rsplit('_', 3)[0] not in new_tracks:
-            new_tracks.append(st.rsplit('_', 3)[0])
-
-    # load files
-    pts = pd.read_csv(xypath, index_col = False).values
-    ncams = int(pts.shape[1]/(2*len(new_tracks)))
-
-    DLTCoefficients = pd.read_csv(dltpath, index_col = False, header = None).values.T
-    if flipy:
-        for c in range(ncams):
-            DLTCoefficients[c, :] = cFlip(DLTCoefficients[c, :], heights[c])
-    if profpath is not None:
-        camera_profile = load_camera(profpath)
+    if incremental:
+        return _triangulate_incremental(xypath, filename, dltpath, profpath, flipy, heights, precision, like, weighted,
+                                        robust, subsets)
+    with profiling.stage('load') as stg:
+        # load files, only the rows of the window if there is one
+        # only the digitized points (frame, track, camera, u, v) are kept, so the work scales with those, not the
+        # mostly NaN file
+        points = Points2D.read(xypath, start, end, precision, likelihoods=weighted or like is not None)
+        calib = as_calibration(dltpath, profpath)
+        stg.items = len(points)
+
+    source = _points_source(xypath, start, end, precision, like, flipy, heights, points.ncams)
+    res = triangulate_points(points, calib, flipy, heights, like, weighted, robust, subsets, source)
+    if windowed and embed:
+        rows = np.arange(len(points)) + max(int(start or 0), 0)
+        return embed_xyz(filename, count_rows(xypath), rows, res.xyz, res.errs, res.tracks, res.rejected)
+    return res.write(filename)
+
+
+def _load_calibration(dltpath, profpath, flipy, heights, ncams):
+    if flipy and len(heights) < ncams:
+        raise ValueError('heights must have one entry per camera ({} cameras found)'.format(ncams))
+    calib = as_calibration(dltpath, profpath)
+    return calib.coefficients(flipy, heights[:ncams] if flipy else None), calib.prof
+
+
+def write_xyz(filename, xyz, errs, tracks, rejected=None):
+    """
+    writes the (frames, tracks, 3) xyz and (frames, tracks) residuals as filename + xyzpts.csv and xyzres.csv
+    and, if given, the (frames, tracks) bitmask of rejected cameras as filename + xyzrejected.csv
+    """
+    dataf1, dataf2 = _xyz_frames(xyz, errs, tracks)
+    # write to CSV
+    with profiling.stage('write_xyzpts', items=len(dataf1)):
+        dataf1.to_csv(filename + 'xyzpts.csv', index=False, na_rep='NaN')
+    with profiling.stage('write_xyzres', items=len(dataf2)):
+        dataf2.to_csv(filename + 'xyzres.csv', index=False, na_rep='NaN')
+    if rejected is not None:
+        pd.DataFrame(rejected, columns=tracks).to_csv(filename + 'xyzrejected.csv', index=False)
+    return dataf1, dataf2
+
+
+def embed_xyz(filename, nrows, rows, xyz, errs, tracks, rejected=None):
+    """
+    writes the (len(rows), tracks, 3) xyz, residuals and rejected cameras of a window of rows into full length (nrows)
+    outputs, as write_xyz does: patched into the existing files if they all have nrows rows, otherwise written whole
+    with NaN (no rejected cameras) outside the window
+    returns the dataframes of the window's rows, indexed by frame
+    """
+    paths = [Path(filename + 'xyzpts.csv'), Path(filename + 'xyzres.csv')]
+    values = [xyz.reshape((len(rows), -1)), errs]
+    if rejected is not None:
+        paths.append(Path(filename + 'xyzrejected.csv'))
+        values.append(rejected)
+    if all(p.exists() and count_rows(p) == nrows for p in paths):
+        with profiling.stage('patch', items=len(rows)):
+            for i, (p, v) in enumerate(zip(paths, values)):
+                _patch_csv(p, rows, v, np.ones(v.shape, dtype=bool), np.int64 if i == 2 else float)
     else:
-        camera_profile = None
-    
+        full = np.full((nrows,) + xyz.shape[1:], np.nan)
+        full[rows] = xyz
+        fullerrs = np.full((nrows,) + errs.shape[1:], np.nan)
+        fullerrs[rows] = errs
+        fullrej = None
+        if rejected is not None:
+            fullrej = np.zeros((nrows,) + rejected.shape[1:], dtype=rejected.dtype)
+            fullrej[rows] = rejected
+        write_xyz(filename, full, fullerrs, tracks, fullrej)
+    return _xyz_frames(xyz, errs, tracks, index=rows)
 
-    # make a data frame for the xyz coordinates for all tracks and all frames
-    xyzss = list()
-    for j in range(int(pts.shape[1] / (2 * ncams))):
-        if flipy:
-            flippts = pts[:, j * 2 * ncams:(j + 1) * 2 * ncams].copy()
-            flippts[:, 1] = heights[0] - flippts[:, 1]
-            flippts[:, 3] = heights[1] - flippts[:, 3]
-            xyzs = uv_to_xyz(flippts, DLTCoefficients, prof=camera_profile)
+
+def _patch_csv(path, frames, values, mask, dtype=float):
+    """
+    replaces values[mask] in the given data rows of a csv file written by write_xyz, other rows are left byte for byte
+    values and mask are (len(frames), columns), returns the patched rows
+    """
+    header, lines = _csv_lines(path)
+    # round_trip, so the values that are kept are written back exactly as they were
+    old = _parse_lines(header, [lines[f] for f in frames], dtype, float_precision='round_trip')
+    new = np.where(mask, values, old)
+    out = pd.DataFrame(new).to_csv(index=False, header=False, na_rep='NaN').encode().splitlines(keepends=True)
+    for f, ln in zip(frames, out):
+        lines[f] = ln
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(header + b''.join(lines))
+    tmp.replace(path)
+    return new
+
+
+def _triangulate_incremental(xypath, filename, dltpath, profpath, flipy, heights, precision, like, weighted,
+                             robust=None, subsets='leave_one_out'):
+    """
+    triangulate with incremental=True
+    """
+    statepath = Path(filename + 'xyzstate.json')
+    outpaths = [Path(filename + 'xyzpts.csv'), Path(filename + 'xyzres.csv')]
+    if robust is not None:
+        outpaths.append(Path(filename + 'xyzrejected.csv'))
+    size = INCREMENTAL_BLOCK
+    with profiling.stage('load') as stg:
+        header, lines = _csv_lines(xypath)
+        new_tracks = _track_names(header.decode())
+        ncams = (header.count(b',') + 1) // (2 * len(new_tracks))
+        DLTCoefficients, camera_profile = _load_calibration(dltpath, profpath, flipy, heights, ncams)
+        stg.items = len(lines)
+
+    with profiling.stage('hash', items=len(lines)) as stg:
+        # everything that changes the result other than the 2D points themselves
+        calib = hashlib.sha1(json.dumps([header.decode().strip(), bool(flipy), list(heights[:ncams]) if flipy else None,
+                                         precision, size, like, bool(weighted)]
+                                        + ([robust, subsets] if robust is not None else [])).encode())
+        calib.update(np.ascontiguousarray(DLTCoefficients, dtype=float).tobytes())
+        if camera_profile is not None:
+            calib.update(np.asarray(camera_profile, dtype=float).tobytes())
+        likepath = Path(filename + 'likelihood.npz')
+        if (weighted or like is not None) and likepath.exists():
+            calib.update(likepath.read_bytes())
+        calib = calib.hexdigest()
+        blocks = _block_hashes(lines, size)
+        try:
+            with open(statepath) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        if (state is None or state.get('calibration') != calib or state.get('rows') != len(lines)
+                or state.get('outputs') != _file_stats(outpaths)):
+            state = None
+            changed = []
         else:
-            xyzs = uv_to_xyz(pts[:, j * 2 * ncams:(j + 1) * 2 * ncams], DLTCoefficients, prof=camera_profile)
-        xyzss.append(xyzs)
+            changed = [b for b in range(len(blocks)) if blocks[b] != state['blocks'][b]]
+        stg.items = len(changed)
 
-    xyzss = np.asarray(xyzss)
-    _ = xyzss[0]
-    for k in range(1, len(xyzss)):
-        _ = np.hstack((_, xyzss[k]))
+    if state is None:
+        # first run, or something other than the 2D points changed, redo everything
+        pts = _parse_lines(header, lines, precision)
+        obs = _observations(filename, xypts_to_array(pts, ncams), like, weighted)
+        source = _points_source(xypath, None, None, precision, like, flipy, heights, ncams)
+        xyz, repoErrs, rejected = _solve_obs(obs, DLTCoefficients, camera_profile, flipy, heights, weighted, robust,
+                                             subsets, source)
+        dataf1, dataf2 = write_xyz(filename, xyz, repoErrs, new_tracks, rejected)
+        state = {'calibration': calib, 'rows': len(lines), 'blocks': blocks,
+                 'tracks': _track_hashes(pts, len(new_tracks), size)}
+    else:
+        # only the blocks whose text changed are parsed, then only the tracks whose values changed in them are solved
+        rows = np.array([r for b in changed for r in range(b * size, min((b + 1) * size, len(lines)))], dtype=int)
+        tracks = []
+        redo = np.zeros((len(rows), len(new_tracks)), dtype=bool)
+        if len(rows):
+            pts = _parse_lines(header, [lines[r] for r in rows], precision)
+            tracks = _track_hashes(pts, len(new_tracks), size)
+            redo = np.array([[tracks[i][t] != state['tracks'][b][t] for t in range(len(new_tracks))]
+                             for i, b in enumerate(changed)])[np.searchsorted(changed, rows // size)]
+        keep = redo.any(axis=1)
+        rows = rows[keep]
+        redo = redo[keep]
+        xyz = np.zeros((len(rows), len(new_tracks), 3))
+        repoErrs = np.zeros((len(rows), len(new_tracks)))
+        if len(rows):
+            obs = _observations(filename, xypts_to_array(pts[keep], ncams), like, weighted, rows)
+            obs = obs.select(redo[obs.frame, obs.track])
+            xyz, repoErrs, rejected = _solve_obs(obs, DLTCoefficients, camera_profile, flipy, heights, weighted,
+                                                 robust, subsets)
+            # the redone points are written even if they are now NaN (e.g. a point that was deleted)
+            with profiling.stage('patch', items=len(rows)):
+                xyz = _patch_csv(outpaths[0], rows, xyz.reshape((len(rows), -1)), np.repeat(redo, 3, axis=1))
+                repoErrs = _patch_csv(outpaths[1], rows, repoErrs, redo)
+                if robust is not None:
+                    _patch_csv(outpaths[2], rows, rejected, redo, np.int64)
+        dataf1, dataf2 = _xyz_frames(xyz, repoErrs, new_tracks, index=rows)
+        for i, b in enumerate(changed):
+            state['tracks'][b] = tracks[i]
+        state['blocks'] = blocks
+    state['outputs'] = _file_stats(outpaths)
+    tmp = statepath.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    tmp.replace(statepath)
+    return dataf1, dataf2
 
-    xyz_cols = list()
-    # sTracks = sorted(new_tracks)
-    for k in range(len(new_tracks)):
-        xyz_cols.append(new_tracks[k] + '_X')
-        xyz_cols.append(new_tracks[k] + '_Y')
-        xyz_cols.append(new_tracks[k] + '_Z')
-    dataf1 = pd.DataFrame(_, columns=xyz_cols)
+
+def triangulate_individuals(tables, dlt, prof=None, flipy=False, heights=None, weighted=False):
+    """
+    triangulates several Observations tables (e.g. one per individual) in one pass, so the points of all of them are
+    flipped, undistorted and solved together with one copy of the calibration
+    with weighted, each observation is weighted by its likelihood
+    returns a list of (xyz, residuals) arrays, one per table, with that table's frames and tracks
+    """
+    obs, firsts = Observations.join_tracks(tables)
+    xyz, errs, _ = _solve_obs(obs, dlt, prof, flipy, heights, weighted)
+    return [(xyz[:t.shape[0], f:f + t.shape[1]], errs[:t.shape[0], f:f + t.shape[1]]) for t, f in zip(tables, firsts)]
+
+
+def long_table(results, names, tracks):
+    """
+    one long format data frame (individual, frame, track, x, y, z, residual) of the triangulated points of several
+    individuals, results as from triangulate_individuals, tracks is a list of track names per individual
+    frames are 1-indexed, as in Argus and DLTdv
+    """
+    parts = []
+    for (xyz, errs), name, trk in zip(results, names, tracks):
+        f, t = np.nonzero(np.isfinite(xyz).all(axis=-1))
+        parts.append(pd.DataFrame({'individual': name, 'frame': f + 1, 'track': np.asarray(trk)[t],
+                                   'x': xyz[f, t, 0], 'y': xyz[f, t, 1], 'z': xyz[f, t, 2], 'residual': errs[f, t]}))
+    return pd.concat(parts, ignore_index=True)
+
+
+@profiling.profiled('triangulate_many')
+def triangulate_many(xypaths, dltpath, profpath=None, flipy=False, heights=[688, 688], precision='float64',
+                     longpath=None, names=None, like=None, weighted=False):
+    """
+    triangulates the xypts files of several individuals (e.g. the <name>_<ind>-xypts.csv files dlc2dlt makes for a
+    multianimal project) in one pass, loading the calibration once
+    writes -xyzpts.csv and -xyzres.csv for each file, as triangulate does, and, if longpath is given, one long format
+    csv of all of them (see long_table), with individuals named by names or by their file names
+    like and weighted use each file's likelihoods as in triangulate
+    returns the long format data frame
+    """
+    prefixes = [str(p).split('xypts')[0] for p in xypaths]
+    if names is None:
+        names = [Path(p).name.rstrip('-_') for p in prefixes]
+    tables = []
+    tracks = []
+    with profiling.stage('load') as stg:
+        for xypath in xypaths:
+            with open(xypath) as f:
+                tracks.append(_track_names(f.readline()))
+            pts = read_xypts(xypath, dtype=precision).values
+            ncams = int(pts.shape[1] / (2 * len(tracks[-1])))
+            tables.append(_observations(str(xypath).split('xypts')[0], xypts_to_array(pts, ncams), like, weighted))
+        if len(set(t.shape[2] for t in tables)) > 1:
+            raise ValueError('all xypts files must have the same cameras')
+        DLTCoefficients, camera_profile = _load_calibration(dltpath, profpath, flipy, heights, tables[0].shape[2])
+        stg.items = sum(t.shape[0] for t in tables)
+
+    results = triangulate_individuals(tables, DLTCoefficients, camera_profile, flipy, heights, weighted)
+    for prefix, (xyz, errs), trk in zip(prefixes, results, tracks):
+        write_xyz(prefix, xyz, errs, trk)
+    longdf = long_table(results, names, tracks)
+    if longpath is not None:
+        with profiling.stage('write_long', items=len(longdf)):
+            longdf.to_csv(longpath, index=False, na_rep='NaN')
+    return longdf
+
+
+# in-memory trial data
+# each tool reads its inputs from and writes its outputs to the DLT files, but also takes and returns these, so
+# stages run in one process (or a notebook) hand each other arrays, and files are only written where asked for
+
+
+def xypts_columns(tracks, ncams):
+    """
+    the column names of an xypts file, ordered track, camera, x/y
+    """
+    return ['{}_cam_{}_{}'.format(x, c, d) for x in tracks for c in range(1, ncams + 1) for d in ['x', 'y']]
+
+
+def write_dlt_files(basename, xy, tracks, offsets):
+    """
+    writes basename + xypts.csv from a flat xypts array, plus the "dummy" xyzpts, xyzres and offsets files
+    DLTdv and Argus need to load the data
+    """
+    numcams = len(offsets)
+    xydf = pd.DataFrame(xy, columns=xypts_columns(tracks, numcams), index=range(len(xy)))
     # write to CSV
-    dataf1.to_csv(filename + 'xyzpts.csv', index=False, na_rep='NaN')
-    # get reprojection errors for all 3d points and make a data frame for it
-    repoErrs = get_repo_errors(_, pts, camera_profile, DLTCoefficients).T
-    # cols = sorted(new_trac)
-    dataf2 = pd.DataFrame(repoErrs, columns=new_tracks)
-    dataf2.to_csv(filename + 'xyzres.csv', index=False, na_rep='NaN')
-    return dataf1, dataf2
\ No newline at end of file
+    xydf.to_csv((basename + 'xypts.csv'), na_rep="NaN", index=False)
+    # make "dummy" files
+    xyzcols = ['{}_{}'.format(x, d) for x in tracks for d in ['x', 'y', 'z']]
+    xyzdf = pd.DataFrame(np.nan, columns=xyzcols, index=range(len(xy)))
+    xyzdf.to_csv((basename + 'xyzpts.csv'), na_rep='NaN', index=False)
+
+    residdf = pd.DataFrame(np.nan, columns=tracks, index=range(len(xy)))
+    residdf.to_csv((basename + 'xyzres.csv'), na_rep='NaN', index=False)
+
+    offcols = ['camera_{}'.format(cnum) for cnum in range(1, numcams + 1)]
+    offdf = pd.DataFrame(0, columns=offcols, index=range(len(xy)))
+    offdf.iloc[0] = offsets
+    offdf.to_csv((basename + 'offsets.csv'), na_rep='NaN', index=False)
+
+
+def write_flags(basename, flags, tracks):
+    """
+    writes the (frames, tracks, cams) flags of clean_tracks as basename + xyflags.csv, columns as in xypts
+    """
+    numcams = flags.shape[2]
+    cols = ['{}_cam_{}'.format(x, c) for x in tracks for c in range(1, numcams + 1)]
+    pd.DataFrame(flags.reshape((len(flags), -1)), columns=cols).to_csv(basename + 'xyflags.csv', index=False)
+
+
+def read_offsets(basename, ncams):
+    """
+    the camera offsets in basename + offsets.csv (its first row), zeros if there is no such file
+    """
+    try:
+        offsets = pd.read_csv(basename + 'offsets.csv', index_col=False, nrows=1).values[0, :ncams]
+    except (OSError, ValueError, IndexError):
+        return [0] * ncams
+    return [int(o) for o in np.nan_to_num(offsets)] + [0] * (ncams - len(offsets))
+
+
+class Points2D:
+    """
+    the 2D points of a trial, as in an xypts file: an Observations table (u, v in the file's coordinates, with the
+    DLC likelihoods if there are any), the track names, the offset of each camera and, if the tracks were cleaned,
+    the (frames, tracks, cams) flags of clean_tracks
+    """
+    def __init__(self, obs, tracks, offsets=None, flags=None):
+        self.obs = obs
+        self.tracks = list(tracks)
+        self.offsets = [0] * obs.shape[2] if offsets is None else [int(o) for o in offsets]
+        self.flags = flags
+
+    @property
+    def ncams(self):
+        return self.obs.shape[2]
+
+    def __len__(self):
+        return self.obs.shape[0]
+
+    @classmethod
+    def from_array(cls, arr, tracks, offsets=None, like=None):
+        """
+        from a dense (frames, tracks, cams, 2) array, like is an optional (frames, tracks, cams) array of likelihoods
+        """
+        return cls(Observations.from_array(arr, like), tracks, offsets)
+
+    @classmethod
+    def read(cls, xypath, start=None, end=None, precision='float64', likelihoods=True):
+        """
+        reads an xypts file (the rows start <= row < end, see read_xypts), with the offsets file and, if
+        likelihoods, the likelihood file next to it
+        """
+        basename = str(xypath).split('xypts')[0]
+        with open(xypath) as f:
+            tracks = _track_names(f.readline())
+        pts = read_xypts(xypath, start, end, dtype=precision)
+        ncams = int(pts.shape[1] / (2 * len(tracks)))
+        arr = xypts_to_array(pts.values, ncams)
+        like = load_likelihoods(basename, arr, pts.index.values) if likelihoods else None
+        # row 0 of a window is frame start of the file
+        offsets = [o + pts.index.start for o in read_offsets(basename, ncams)]
+        return cls(Observations.from_array(arr, like), tracks, offsets)
+
+    def to_array(self):
+        return self.obs.to_array()
+
+    def to_frame(self):
+        """
+        the points as a dataframe with the xypts columns
+        """
+        return pd.DataFrame(array_to_xypts(self.to_array()), columns=xypts_columns(self.tracks, self.ncams))
+
+    def window(self, start=None, end=None):
+        """
+        the frames start <= frame < end (None for open ends), row 0 is then frame start and the offsets are shifted
+        to match
+        """
+        start = max(int(start or 0), 0)
+        end = len(self) if end is None else min(int(end), len(self))
+        obs = self.obs.shift_frames([start] * self.ncams, nrows=max(end - start, 0))
+        flags = None if self.flags is None else self.flags[start:end]
+        return Points2D(obs, self.tracks, [o + start for o in self.offsets], flags)
+
+    def write(self, basename):
+        """
+        writes basename + xypts.csv with the files DLTdv and Argus need to load it (see write_dlt_files, the xyzpts and
+        xyzres files are replaced by empty ones), and the likelihood and flags files if there are likelihoods or flags
+        """
+        write_dlt_files(basename, array_to_xypts(self.to_array()), self.tracks, self.offsets)
+        if self.obs.like is not None:
+            write_likelihoods(basename, self.obs)
+        if self.flags is not None:
+            write_flags(basename, self.flags, self.tracks)
+
+    def embed(self, basename, rows):
+        """
+        writes only the given rows into the files of an existing full length trial (basename + xypts.csv with as many
+        rows as these points), as embed_xyz does: the other rows are left byte for byte, and the rows of the xyzpts and
+        xyzres files are emptied; writes the whole files (see write) if there is no xypts file yet
+        raises ValueError if there is one that doesn't match, rather than overwrite it
+        """
+        xypath = Path(basename + 'xypts.csv')
+        if not xypath.exists():
+            self.write(basename)
+            return
+        header, lines = _csv_lines(xypath)
+        if header.decode().strip() != ','.join(xypts_columns(self.tracks, self.ncams)) or len(lines) != len(self):
+            raise ValueError('{} does not match the trial ({} rows of {} tracks in {} cameras), not overwritten'.format(
+                xypath, len(self), len(self.tracks), self.ncams))
+        rows = np.asarray(rows)
+        arr = self.to_array()
+        flat = array_to_xypts(arr[rows])
+        with profiling.stage('patch', items=len(rows)):
+            _patch_csv(xypath, rows, flat, np.ones(flat.shape, dtype=bool), flat.dtype)
+            if self.obs.like is not None:
+                likepath = Path(basename + 'likelihood.npz')
+                like = self.obs.like_array()
+                if likepath.exists():
+                    with np.load(likepath) as f:
+                        oldxy = f['xy']
+                        oldlike = f['like']
+                    if oldxy.shape == arr.shape:
+                        oldxy[rows] = arr[rows]
+                        oldlike[rows] = like[rows]
+                        arr, like = oldxy, oldlike
+                np.savez_compressed(likepath, xy=arr, like=like)
+            if self.flags is not None:
+                flagpath = Path(basename + 'xyflags.csv')
+                if flagpath.exists() and count_rows(flagpath) == len(self):
+                    flags = self.flags[rows].reshape((len(rows), -1))
+                    _patch_csv(flagpath, rows, flags, np.ones(flags.shape, dtype=bool), np.int64)
+                else:
+                    write_flags(basename, self.flags, self.tracks)
+        # the 3D points of these rows are out of date
+        nan = np.full((len(rows), len(self.tracks)), np.nan)
+        embed_xyz(basename, len(self), rows, np.stack([nan] * 3, axis=-1), nan, self.tracks)
+
+
+class Calibration:
+    """
+    (cams, 11) DLT coefficients, as in the coefficients file (for the points as in the xypts files), and the camera
+    profile (see load_camera) to undistort the points with, or None
+    """
+    def __init__(self, dlt, prof=None):
+        self.dlt = np.asarray(dlt, dtype=float)
+        self.prof = prof
+
+    @property
+    def ncams(self):
+        return len(self.dlt)
+
+    @classmethod
+    def read(cls, dltpath, profpath=None):
+        return cls(load_dlt(dltpath), load_camera_cached(profpath))
+
+    def coefficients(self, flipy=False, heights=None):
+        """
+        the coefficients, converted to an upper left origin with one height per camera if flipy (as load_dlt does)
+        """
+        coefs = self.dlt.copy()
+        if flipy:
+            for c in range(min(coefs.shape[0], len(heights))):
+                coefs[c, :] = cFlip(coefs[c, :], heights[c])
+        return coefs
+
+    def write(self, dltpath):
+        """
+        saves the coefficients as Argus and DLTdv do: 11 rows, one column per camera (the profile is not saved)
+        """
+        pd.DataFrame(self.dlt.T).to_csv(dltpath, header=False, index=False)
+
+
+class Points3D:
+    """
+    triangulated points: (frames, tracks, 3) xyz, (frames, tracks) reprojection errors, the track names and, from
+    robust triangulation, the (frames, tracks) bitmask of the cameras left out of each point (or None)
+    """
+    def __init__(self, xyz, errs, tracks, rejected=None):
+        self.xyz = xyz
+        self.errs = errs
+        self.tracks = list(tracks)
+        self.rejected = rejected
+
+    def __len__(self):
+        return len(self.xyz)
+
+    @classmethod
+    def read(cls, xyzpath):
+        """
+        reads an xyzpts file (or xyzfilt, columns <track>_X, _Y, _Z in any case) with the xyzres and xyzrejected files
+        next to it if there are any, residuals are NaN without an xyzres file
+        """
+        df = pd.read_csv(xyzpath, index_col=False, dtype=float)
+        tracks = [c.rsplit('_', 1)[0] for c in df.columns[::3]]
+        xyz = df.values.reshape((len(df), len(tracks), 3))
+        basename = str(xyzpath).rsplit('xyz', 1)[0]
+        errs = np.full(xyz.shape[:2], np.nan)
+        rejected = None
+        if Path(basename + 'xyzres.csv').exists():
+            errs = pd.read_csv(basename + 'xyzres.csv', index_col=False, dtype=float).values[:len(df)]
+        if Path(basename + 'xyzrejected.csv').exists():
+            rejected = pd.read_csv(basename + 'xyzrejected.csv', index_col=False).values[:len(df)]
+        return cls(xyz, errs, tracks, rejected)
+
+    def to_frames(self, index=None):
+        """
+        the xyzpts and xyzres dataframes, as triangulate returns them
+        """
+        return _xyz_frames(self.xyz, self.errs, self.tracks, index)
+
+    def write(self, basename):
+        """
+        writes basename + xyzpts.csv, xyzres.csv (and xyzrejected.csv), see write_xyz
+        """
+        return write_xyz(basename, self.xyz, self.errs, self.tracks, self.rejected)
+
+
+def as_points2d(xy, **kwargs):
+    """
+    xy if it is a Points2D, otherwise Points2D.read(xy, **kwargs)
+    """
+    return xy if isinstance(xy, Points2D) else Points2D.read(xy, **kwargs)
+
+
+def as_calibration(dlt, profpath=None):
+    """
+    dlt if it is a Calibration (which has its own profile), otherwise the Calibration read from the coefficients file
+    dlt and profpath
+    """
+    return dlt if isinstance(dlt, Calibration) else Calibration.read(dlt, profpath)
+
+
+def triangulate_points(points, calib, flipy=False, heights=None, like=None, weighted=False, robust=None,
+                       subsets='leave_one_out', source=None):
+    """
+    triangulates a Points2D with a Calibration, returns a Points3D; the settings are those of triangulate
+    source identifies the file the points were read from, to cache their undistorted points (see _solve_obs)
+    """
+    if flipy and (heights is None or len(heights) < points.ncams):
+        raise ValueError('heights must have one entry per camera ({} cameras found)'.format(points.ncams))
+    dlt = calib.coefficients(flipy, heights[:points.ncams] if flipy else None)
+    obs = points.obs
+    if like is not None and obs.like is not None:
+        obs = obs.select(~(obs.like <= like))
+    xyz, errs, rejected = _solve_obs(obs, dlt, calib.prof, flipy, heights, weighted, robust, subsets, source)
+    return Points3D(xyz, errs, points.tracks, rejected)
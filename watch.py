@@ -0,0 +1,172 @@
+"""
+Watches an xypts file while it is being corrected in Argus or DLTdv, and re-triangulates it every time it is saved.
+
+Each save is picked up within a fraction of a second (rapid saves are waited out, -debounce), only the rows that
+changed are re-triangulated (tools.triangulate with incremental=True), the -xyzpts.csv and -xyzres.csv files are
+patched, and a short summary of the frames with the worst reprojection residuals is printed.
+
+Optionally, the DLC tracks (.h5) can be watched too, e.g. the files dlt2dlctracks writes after a correction. When
+one of them changes, dlc2dlt rebuilds the xypts file from all of them first (single animal projects only).
+
+Example calls:
+python watch.py -xy /path/trial-xypts.csv -dlt /path/dlt-coefficients.csv -vid cam1.mp4 cam2.mp4 cam3.mp4
+python watch.py -xy /path/trial-xypts.csv -dlt /path/dlt-coefficients.csv -heights 1080 1080 1080 -dlctracks cam1DLC.h5 cam2DLC.h5 cam3DLC.h5 -config /path/config.yaml -offsets 0 -12 2
+
+Frames in the summary are 1-indexed, as in Argus and DLTdv. Stop with ctrl-c.
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import shutil
+import sys
+import time
+from pathlib import Path
+import pandas as pd
+import tools
+from dlc2dlt import dlc2dlt
+from pipeline import video_heights
+
+
+def file_stats(paths):
+    """
+    (modification time, size) of each file, None for files that don't exist
+    """
+    out = []
+    for p in paths:
+        try:
+            st = Path(p).stat()
+            out.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            out.append(None)
+    return out
+
+
+def wait_for_change(paths, last, poll=0.1, debounce=0.3):
+    """
+    waits until one of the files differs from last, then until none of them has changed for debounce seconds
+    (programs often save in several writes), returns the new stats
+    """
+    cur = file_stats(paths)
+    while cur == last:
+        time.sleep(poll)
+        cur = file_stats(paths)
+    while True:
+        time.sleep(debounce)
+        new = file_stats(paths)
+        if new == cur:
+            return cur
+        cur = new
+
+
+def rebuild_xypts(xypath, config, dlctracks, flipy, offsets, like, videos, precision):
+    """
+    runs dlc2dlt to make the xypts file from the DLC tracks, keeping the existing xyzpts and xyzres files (dlc2dlt
+    writes empty ones), so the triangulation after it only redoes the rows that changed
+    """
+    prefix = str(xypath).split('xypts')[0]
+    outputs = [Path(prefix + 'xyzpts.csv'), Path(prefix + 'xyzres.csv')]
+    kept = [p for p in outputs if p.exists()]
+    for p in kept:
+        # copy2 keeps the modification time, which tools.triangulate checks
+        shutil.copy2(p, p.with_suffix('.keep'))
+    try:
+        dlc2dlt(config, prefix[:-1], dlctracks, flipy, offsets, like, vid=videos, precision=precision)
+    finally:
+        for p in kept:
+            p.with_suffix('.keep').replace(p)
+
+
+def summary(res, top=10):
+    """
+    lines of text on the residuals (frames x tracks data frame): how many points, median and the worst frames
+    """
+    pts = res.stack()
+    lines = ['{} points, median residual {:.3f} px, max {:.3f} px'.format(
+        len(pts), pts.median() if len(pts) else float('nan'), pts.max() if len(pts) else float('nan'))]
+    if len(pts):
+        lines.append('{:>8}  {:<24} {:>10}'.format('frame', 'track', 'residual'))
+        for (frame, track), val in pts.nlargest(top).items():
+            lines.append('{:>8}  {:<24} {:>10.3f}'.format(frame + 1, track, val))
+    return lines
+
+
+def watch(xypath, dltpath, profpath=None, flipy=True, heights=None, precision='float64', dlctracks=None,
+          config=None, offsets=None, like=0.9, videos=None, poll=0.1, debounce=0.3, top=10, robust=None):
+    """
+    re-triangulates xypath every time it (or one of the dlctracks) is saved, until interrupted
+    """
+    xypath = Path(xypath)
+    dlctracks = [str(p) for p in dlctracks or []]
+    watched = [xypath] + dlctracks
+    prefix = str(xypath).split('xypts')[0]
+    clear = sys.stdout.isatty()
+    res = None
+    last = None
+    while True:
+        cur = wait_for_change(watched, last, poll, debounce)
+        t0 = time.perf_counter()
+        try:
+            if dlctracks and (last is None or cur[1:] != last[1:]):
+                print('DLC tracks changed, rebuilding', xypath.name)
+                rebuild_xypts(xypath, config, dlctracks, flipy, offsets or [0] * len(dlctracks), like, videos,
+                              precision)
+                # the rebuilt xypts file is not a new save to respond to
+                cur = [file_stats([xypath])[0]] + cur[1:]
+            _, d2 = tools.triangulate(xypath, dltpath, profpath, flipy=flipy, heights=heights, precision=precision,
+                                      incremental=True, robust=robust)
+        except Exception as e:
+            # usually a file caught in the middle of being written, the next save will be picked up
+            print('could not update ({}: {}), waiting for the next save'.format(type(e).__name__, e))
+            last = cur
+            continue
+        last = cur
+        # a RangeIndex means the whole file was redone, otherwise d2 has just the rows that changed
+        if isinstance(d2.index, pd.RangeIndex) and len(d2):
+            res = d2
+        elif res is None:
+            res = pd.read_csv(prefix + 'xyzres.csv')
+        elif len(d2):
+            res.loc[d2.index] = d2.values
+        if clear:
+            print('\033[H\033[J', end='')
+        print('{}  {}: {} rows updated in {:.2f} s'.format(time.strftime('%H:%M:%S'), xypath.name, len(d2),
+                                                          time.perf_counter() - t0))
+        print('\n'.join(summary(res, top)))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='re-triangulate an xypts file every time it is saved, and show the worst residuals')
+    parser.add_argument('-xy', help='input path to xypts file')
+    parser.add_argument('-dlt', help='input path to dlt coefficients file')
+    parser.add_argument('-prof', default=None, help='input path to camera profile file, no undistortion if not given')
+    parser.add_argument('-flipy', default=True, help='flip y coordinates - necessary for DLTdv versions 1-7 and Argus, set to False for DLTdv8, default = True')
+    parser.add_argument('-vid', default=None, nargs='+', help='paths to the videos of each camera, to get their heights for -flipy')
+    parser.add_argument('-heights', default=None, nargs='+', type=int, help='video heights of each camera, instead of -vid')
+    parser.add_argument('-dlctracks', default=None, nargs='+', help='also watch these DLC tracks (h5, one per camera in DLT order), and rebuild the xypts file with dlc2dlt when they change')
+    parser.add_argument('-config', default=None, help='input path to DLC config file, needed with -dlctracks')
+    parser.add_argument('-offsets', nargs='+', default=None, help='offsets for dlc2dlt, e.g.: -offsets 0 -12 2')
+    parser.add_argument('-like', default=0.9, help='likelihood threshold for dlc2dlt - defaults to 0.9')
+    parser.add_argument('-precision', default='float64', choices=['float64', 'float32'], help='precision of the 2D coordinates in memory')
+    parser.add_argument('-debounce', default=0.3, type=float, help='seconds without changes before a save is processed, default = 0.3')
+    parser.add_argument('-robust', default=None, type=float, help='leave out cameras that don\'t fit points with a residual above this (pixels), see tools.triangulate')
+    parser.add_argument('-top', default=10, type=int, help='number of worst residuals to show, default = 10')
+
+    args = parser.parse_args()
+
+    flipy = str(args.flipy).lower() not in ['false', '0']
+    heights = args.heights
+    if flipy and heights is None:
+        if args.vid is None:
+            parser.error('-flipy needs the video heights, give -vid or -heights')
+        heights = video_heights(args.vid)
+    if args.dlctracks and args.config is None:
+        parser.error('-dlctracks needs -config')
+    try:
+        watch(args.xy, args.dlt, args.prof, flipy, heights, args.precision, args.dlctracks, args.config, args.offsets,
+              float(args.like), args.vid, debounce=args.debounce, top=args.top, robust=args.robust)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,287 @@
+"""
+A long-lived worker that runs conversion and triangulation jobs in one warm Python process.
+
+Batch scripts (and makeCorrections.py) call dlc2dlt.py, dlt2dlctracks.py, etc. hundreds of times, and each call
+pays for starting python and importing pandas, opencv, etc. With the worker running, those command line tools
+forward their arguments to it and print its output instead of doing the work themselves, so the imports and any
+cached calibrations stay loaded between calls. If no worker is running, the tools work exactly as before.
+
+Start, check and stop the worker:
+python worker.py serve
+python worker.py status
+python worker.py stop
+
+Jobs can also be dropped as json files in a queue folder (python worker.py serve -queue /path/to/jobs), e.g.
+{"func": "triangulate", "kwargs": {"xypath": "/path/trial-xypts.csv", "dltpath": "/path/dlt-coefficients.csv"}}
+{"script": "dlc2dlt.py", "argv": ["-config", "/path/config.yaml", "-dlctracks", "..."]}
+finished jobs are moved to done/ or failed/ inside the queue folder, with a .log file of their output.
+
+From python, worker.run('triangulate', xypath, dltpath) runs the job in the worker if there is one, locally if not.
+
+Jobs run one at a time. Connections are local only and authenticated with a random key kept in ~/.dlcdlt_worker.json.
+Set DLCDLT_NO_WORKER=1 to make the command line tools ignore a running worker.
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+# only the standard library is imported here, so the command line tools can check for a worker before their own imports
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import runpy
+import secrets
+import shutil
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from pathlib import Path
+
+STATE = Path.home() / '.dlcdlt_worker.json'
+ENV_OFF = 'DLCDLT_NO_WORKER'
+# environment variables passed from a client to the job it forwards
+PASS_ENV = ['DLCDLT_PROFILE', 'DLCDLT_CACHE', 'DLCDLT_CACHE_MB']
+REPO = Path(__file__).resolve().parent
+
+# jobs that can be called by name, as (module, function)
+JOBS = {'triangulate': ('tools', 'triangulate'),
+        'dlc2dlt': ('dlc2dlt', 'dlc2dlt'),
+        'dlt2dlclabels': ('dlt2dlclabels', 'dlt2dlclabels'),
+        'dlt2dlctracks': ('dlt2dlctracks', 'dlt2dlctracks')}
+
+_lock = threading.Lock()
+
+
+def _read_state():
+    try:
+        with open(STATE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _connect():
+    state = _read_state()
+    if state is None:
+        return None
+    try:
+        return Client(tuple(state['address']), authkey=bytes.fromhex(state['authkey']))
+    except (OSError, EOFError, KeyError, ValueError, AuthenticationError):
+        # no worker, or a stale state file (another listener on that port)
+        return None
+
+
+def _request(msg):
+    """
+    sends one message to the worker and returns its reply, or None if no worker is running
+    """
+    conn = _connect()
+    if conn is None:
+        return None
+    try:
+        conn.send(msg)
+        return conn.recv()
+    except (OSError, EOFError):
+        return None
+    finally:
+        conn.close()
+
+
+def forward(script, argv):
+    """
+    called at the top of each command line tool
+    runs the tool in the worker and returns its exit code, or None if there is no worker (run locally)
+    """
+    if os.environ.get(ENV_OFF):
+        return None
+    reply = _request({'kind': 'script',
+                      'script': str(Path(script).resolve()),
+                      'argv': list(argv),
+                      'cwd': os.getcwd(),
+                      'env': {k: os.environ[k] for k in PASS_ENV if k in os.environ}})
+    if reply is None:
+        return None
+    sys.stdout.write(reply['stdout'])
+    if reply['error']:
+        sys.stderr.write(reply['error'])
+    return reply['code']
+
+
+def run(func, *args, **kwargs):
+    """
+    runs a named job (see JOBS) in the worker if one is running, otherwise in this process, and returns its result
+    """
+    if not os.environ.get(ENV_OFF):
+        reply = _request({'kind': 'func',
+                          'func': func,
+                          'args': args,
+                          'kwargs': kwargs,
+                          'cwd': os.getcwd(),
+                          'env': {k: os.environ[k] for k in PASS_ENV if k in os.environ}})
+        if reply is not None:
+            sys.stdout.write(reply['stdout'])
+            if reply['code'] != 0:
+                raise RuntimeError('job {} failed in worker:\n{}'.format(func, reply['error']))
+            return reply['result']
+    return _job(func)(*args, **kwargs)
+
+
+def _job(name):
+    module, attr = JOBS[name]
+    return getattr(importlib.import_module(module), attr)
+
+
+def run_job(job):
+    """
+    runs one job in this process, capturing its output
+    returns a dict with the exit code, captured stdout, captured stderr and traceback (if it failed), and the
+    function's result
+    """
+    out = io.StringIO()
+    err = io.StringIO()
+    code = 0
+    error = ''
+    result = None
+    cwd = os.getcwd()
+    # the whole environment, as jobs can set variables of their own (e.g. profiling.enable)
+    oldenv = dict(os.environ)
+    with _lock:
+        try:
+            os.chdir(job.get('cwd', cwd))
+            os.environ.update(job.get('env', {}))
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                if job['kind'] == 'script':
+                    script = Path(job['script'])
+                    if not script.is_absolute():
+                        script = REPO / script
+                    oldargv = sys.argv
+                    sys.argv = [str(script)] + list(job['argv'])
+                    sys.path.insert(0, str(script.parent))
+                    try:
+                        runpy.run_path(str(script), run_name='__main__')
+                    finally:
+                        sys.argv = oldargv
+                        sys.path.remove(str(script.parent))
+                else:
+                    result = _job(job['func'])(*job.get('args', ()), **job.get('kwargs', {}))
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                code = 1
+                error = str(e.code) + '\n'
+        except Exception:
+            code = 1
+            error = traceback.format_exc()
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(oldenv)
+    return {'code': code, 'stdout': out.getvalue(), 'error': err.getvalue() + error, 'result': result}
+
+
+def watch_queue(queue, poll=1.):
+    """
+    runs *.json job files dropped in the queue folder, oldest first, forever
+    """
+    queue = Path(queue)
+    for sub in ['done', 'failed']:
+        (queue / sub).mkdir(parents=True, exist_ok=True)
+    while True:
+        jobs = sorted(queue.glob('*.json'), key=lambda p: p.stat().st_mtime)
+        for jobfile in jobs:
+            try:
+                with open(jobfile) as f:
+                    job = json.load(f)
+            except ValueError:
+                # probably still being written, try again next time
+                continue
+            job['kind'] = 'script' if 'script' in job else 'func'
+            job.setdefault('cwd', str(queue))
+            t0 = time.time()
+            reply = run_job(job)
+            dest = queue / ('done' if reply['code'] == 0 else 'failed')
+            with open(dest / (jobfile.stem + '.log'), 'w') as f:
+                f.write(reply['stdout'])
+                f.write(reply['error'])
+                f.write('\nexit code {} after {:.2f} s\n'.format(reply['code'], time.time() - t0))
+            shutil.move(str(jobfile), str(dest / jobfile.name))
+        time.sleep(poll)
+
+
+def serve(port=0, queue=None, poll=1.):
+    # jobs run in here (and anything they start) must not forward back to the worker
+    os.environ[ENV_OFF] = '1'
+    sys.path.insert(0, str(REPO))
+    # warm up, import everything the jobs need
+    for name in JOBS:
+        _job(name)
+    authkey = secrets.token_bytes(16)
+    listener = Listener(('localhost', port), authkey=authkey)
+    with open(STATE, 'w') as f:
+        json.dump({'address': list(listener.address), 'authkey': authkey.hex(), 'pid': os.getpid()}, f)
+    os.chmod(STATE, 0o600)
+    print('worker listening on {}:{} (pid {})'.format(listener.address[0], listener.address[1], os.getpid()))
+    if queue:
+        print('watching job queue ', queue)
+        threading.Thread(target=watch_queue, args=(queue, poll), daemon=True).start()
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                # failed authentication or a dropped connection
+                continue
+            try:
+                msg = conn.recv()
+                if msg['kind'] == 'stop':
+                    conn.send({'code': 0, 'stdout': 'worker stopped\n', 'error': '', 'result': None})
+                    break
+                if msg['kind'] == 'status':
+                    conn.send({'code': 0, 'stdout': 'worker running (pid {})\n'.format(os.getpid()), 'error': '',
+                               'result': None})
+                    continue
+                t0 = time.time()
+                reply = run_job(msg)
+                conn.send(reply)
+                # not while a queued job is capturing stdout
+                with _lock:
+                    print('{} {} finished with code {} in {:.2f} s'.format(
+                        msg['kind'], msg.get('func', msg.get('script')), reply['code'], time.time() - t0))
+            except (OSError, EOFError):
+                continue
+            finally:
+                conn.close()
+    finally:
+        listener.close()
+        state = _read_state()
+        if state is not None and state.get('pid') == os.getpid():
+            STATE.unlink()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='run conversion and triangulation jobs in a long-lived worker')
+    parser.add_argument('command', choices=['serve', 'status', 'stop'], help='start the worker, check on it, or stop it')
+    parser.add_argument('-port', default=0, type=int, help='local port to listen on, any free port by default')
+    parser.add_argument('-queue', default=None, help='folder to watch for json job files')
+    parser.add_argument('-poll', default=1., type=float, help='seconds between checks of the job queue')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.port, args.queue, args.poll)
+    else:
+        reply = _request({'kind': args.command})
+        if reply is None:
+            print('no worker running')
+            sys.exit(1)
+        print(reply['stdout'], end='')
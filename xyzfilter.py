@@ -0,0 +1,210 @@
+"""
+Fills short gaps in and smooths triangulated 3D points (-xyzpts.csv, from tools.triangulate, Argus or DLTdv), and
+writes them as -xyzfilt.csv next to the input.
+
+Each column is handled on its own and NaN aware:
+    gaps of up to -gap frames are filled, linearly or with a cubic through the two points on each side (-fill spline),
+    longer gaps and the ends of the trial are left NaN
+    then each contiguous (non NaN) segment is smoothed on its own, with a zero phase Butterworth low pass filter
+    (-butter cutoff, with -fps), or a Savitzky-Golay filter (-savgol window order). Segments too short for the
+    Savitzky-Golay window are left as they are.
+
+The file is read and processed in chunks of rows (-chunk), with enough rows of overlap between chunks that the
+result is the same as processing the whole file at once (for the Butterworth filter, to within 1e-9 of the
+filtered values' range, as its response never quite ends). The filters need scipy.
+
+Example calls:
+python xyzfilter.py -xyz /path/trial-xyzpts.csv -gap 10 -butter 12 -fps 100
+python xyzfilter.py -xyz /path/trial-xyzpts.csv -gap 5 -fill spline -savgol 11 3
+
+Author: Brandon E. Jackson, Ph.D.
+email: jacksonbe3@longwood.edu
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import signal
+import tools
+import profiling
+
+
+def runs(valid):
+    """
+    contiguous True runs in each column of a (frames, columns) boolean array
+    returns the column, first frame and length of each run
+    """
+    pad = np.zeros((valid.shape[1], 1), dtype=bool)
+    edges = np.diff(np.hstack([pad, valid.T, pad]).astype(np.int8), axis=1)
+    col, start = np.nonzero(edges == 1)
+    _, stop = np.nonzero(edges == -1)
+    return col, start, stop - start
+
+
+def _each_length(arr, col, start, length, func):
+    """
+    applies func to the runs of arr, all runs of the same length at once as the rows of a 2D array
+    """
+    out = arr.copy()
+    for n in np.unique(length):
+        sel = length == n
+        rows = start[sel, None] + np.arange(n)
+        cols = np.broadcast_to(col[sel, None], rows.shape)
+        out[rows, cols] = func(arr[rows, cols], n)
+    return out
+
+
+def savgol(arr, window, order):
+    """
+    Savitzky-Golay filter of each contiguous segment of each column, segments shorter than window are left as they are
+    """
+    col, start, length = runs(~np.isnan(arr))
+    sel = length >= window
+    return _each_length(arr, col[sel], start[sel], length[sel],
+                        lambda x, n: signal.savgol_filter(x, window, order, axis=1, mode='interp'))
+
+
+def butter_sos(cutoff, fps, order=2):
+    """
+    second order sections of a Butterworth low pass filter, cutoff and fps in Hz
+    """
+    return signal.butter(order, cutoff, fs=fps, output='sos')
+
+
+def butterworth(arr, sos):
+    """
+    zero phase (forward and backward) filter of each contiguous segment of each column
+    """
+    col, start, length = runs(~np.isnan(arr))
+    # default padding of sosfiltfilt, shorter for short segments
+    padlen = 3 * (2 * len(sos) + 1)
+    sel = length > 1
+    return _each_length(arr, col[sel], start[sel], length[sel],
+                        lambda x, n: signal.sosfiltfilt(sos, x, axis=1, padlen=min(padlen, n - 1)))
+
+
+def butter_reach(sos, tol=1e-9):
+    """
+    frames after which the filter's impulse response has decayed to below tol of its peak, plus its padding
+    """
+    n = 256
+    while True:
+        h = np.abs(signal.sosfilt(sos, np.r_[1., np.zeros(n - 1)]))
+        above = np.flatnonzero(h >= tol * h.max())
+        if above[-1] < n // 2:
+            return int(above[-1]) + 1 + 3 * (2 * len(sos) + 1)
+        n *= 2
+
+
+class Filter:
+    """
+    gap filling and smoothing settings, see the module docstring
+    gap - longest gap to fill (frames), 0 to fill none
+    fill - 'linear' or 'spline'
+    butter - (cutoff, fps, order) for a Butterworth filter
+    savgol - (window, order) for a Savitzky-Golay filter
+    """
+    def __init__(self, gap=0, fill='linear', butter=None, savgol=None):
+        if butter is not None and savgol is not None:
+            raise ValueError('use either the Butterworth or the Savitzky-Golay filter, not both')
+        if savgol is not None and (int(savgol[0]) % 2 == 0 or int(savgol[1]) >= int(savgol[0])):
+            raise ValueError('the Savitzky-Golay window must be odd and larger than the order')
+        self.gap = int(gap)
+        self.fill = fill
+        self.sos = butter_sos(*butter) if butter is not None else None
+        self.savgol = None if savgol is None else (int(savgol[0]), int(savgol[1]))
+        # how far (in frames) each output frame looks, for the overlap between chunks
+        self.reach = 0
+        if self.gap:
+            self.reach += self.gap + (2 if fill == 'spline' else 1)
+        if self.sos is not None:
+            self.reach += butter_reach(self.sos)
+        if self.savgol is not None:
+            self.reach += self.savgol[0] - 1
+
+    def __call__(self, arr):
+        """
+        fills and filters a (frames, columns) array as a whole
+        """
+        arr = np.asarray(arr, dtype=float)
+        if self.gap:
+            with profiling.stage('fill', items=len(arr)):
+                arr = tools.fill_gaps(arr, self.gap, self.fill)
+        if self.sos is not None:
+            with profiling.stage('butterworth', items=len(arr)):
+                arr = butterworth(arr, self.sos)
+        if self.savgol is not None:
+            with profiling.stage('savgol', items=len(arr)):
+                arr = savgol(arr, *self.savgol)
+        return arr
+
+
+def filter_chunks(chunks, func, reach):
+    """
+    applies func to a stream of (frames, columns) chunks of one array, keeping reach frames of overlap on each side
+    so the result is the same as func of the whole array; yields the filtered frames in order
+    """
+    buf = None
+    start = 0  # frame of buf[0]
+    done = 0  # frames yielded so far
+    for chunk in chunks:
+        buf = chunk if buf is None else np.concatenate([buf, chunk])
+        # frames with reach frames after them in buf are final
+        stop = start + len(buf) - reach
+        if stop > done:
+            yield func(buf)[done - start:stop - start]
+            done = stop
+        drop = max(0, done - reach - start)
+        buf = buf[drop:]
+        start += drop
+    if buf is not None and done < start + len(buf):
+        yield func(buf)[done - start:]
+
+
+@profiling.profiled('xyzfilter')
+def filter_xyz(xyzpath, outpath=None, chunk=20000, **settings):
+    """
+    fills and filters an -xyzpts.csv file in chunks, writes outpath (by default -xyzfilt.csv next to it)
+    settings are those of Filter, returns the output path
+    xyzpath can also be a tools.Points3D, which is filtered as a whole and returned as a new Points3D (residuals and
+    rejected cameras kept as they are), its points are then only written if outpath is given
+    """
+    flt = Filter(**settings)
+    if isinstance(xyzpath, tools.Points3D):
+        xyz = flt(xyzpath.xyz.reshape((len(xyzpath), -1))).reshape(xyzpath.xyz.shape)
+        out = tools.Points3D(xyz, xyzpath.errs, xyzpath.tracks, xyzpath.rejected)
+        if outpath is not None:
+            with profiling.stage('write', items=len(out)):
+                out.to_frames()[0].to_csv(outpath, index=False, na_rep='NaN')
+        return out
+    if outpath is None:
+        outpath = str(xyzpath).split('xyzpts')[0] + 'xyzfilt.csv'
+    header = pd.read_csv(xyzpath, nrows=0).columns
+    reader = pd.read_csv(xyzpath, index_col=False, dtype=float, chunksize=chunk)
+    with open(outpath, 'w', newline='') as f:
+        pd.DataFrame(columns=header).to_csv(f, index=False)
+        for out in filter_chunks((c.values for c in reader), flt, flt.reach):
+            with profiling.stage('write', items=len(out)):
+                pd.DataFrame(out, columns=header).to_csv(f, index=False, header=False, na_rep='NaN')
+    return outpath
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='fill short gaps in and smooth triangulated 3D points (xyzpts.csv)')
+    parser.add_argument('-xyz', help='input path to xyzpts file')
+    parser.add_argument('-o', default=None, help='output path, default: xyzfilt.csv next to the input')
+    parser.add_argument('-gap', default=0, type=int, help='fill gaps of up to this many frames, default = 0 (none)')
+    parser.add_argument('-fill', default='linear', choices=['linear', 'spline'], help='how to fill gaps, default = linear')
+    parser.add_argument('-butter', default=None, type=float, help='Butterworth low pass cutoff frequency (Hz), needs -fps')
+    parser.add_argument('-fps', default=None, type=float, help='frame rate (Hz), for -butter')
+    parser.add_argument('-order', default=2, type=int, help='Butterworth filter order, default = 2')
+    parser.add_argument('-savgol', default=None, nargs=2, type=int, help='Savitzky-Golay window length (odd) and polynomial order, e.g.: -savgol 11 3')
+    parser.add_argument('-chunk', default=20000, type=int, help='rows processed at a time, default = 20000')
+
+    args = parser.parse_args()
+
+    if args.butter is not None and args.fps is None:
+        parser.error('-butter needs -fps')
+    butter = None if args.butter is None else (args.butter, args.fps, args.order)
+    filter_xyz(args.xyz, args.o, args.chunk, gap=args.gap, fill=args.fill, butter=butter, savgol=args.savgol)